@@ -31,7 +31,8 @@
 CREATE OR REPLACE FUNCTION sync_api_key_to_webui()
 RETURNS TRIGGER AS $$
 DECLARE 
-    target_conn_str TEXT := 'host=localhost port=5432 dbname=webui user=webui password=webui';
+    target_conn_str TEXT := COALESCE(sync_target_conn_override(),
+                                      'host=localhost port=5432 dbname=webui user=webui password=webui');
     webui_user_id TEXT;
 BEGIN
     -- Only process if user_id is provided (skip system tokens)
@@ -61,13 +62,8 @@ BEGIN
                 )::jsonb);
         
         -- Update mapping table if exists
-        INSERT INTO sync_mapping (litellm_type, litellm_id, openwebui_type, openwebui_id, sync_data)
-        VALUES ('api_key', NEW.token, 'user_api_key', webui_user_id,
-                json_build_object('models', NEW.models, 'key_alias', NEW.key_alias)::jsonb)
-        ON CONFLICT (litellm_type, litellm_id) DO UPDATE SET
-            openwebui_id = EXCLUDED.openwebui_id,
-            sync_data = EXCLUDED.sync_data,
-            updated_at = CURRENT_TIMESTAMP;
+        PERFORM sync_record_mapping('api_key', NEW.token, 'user_api_key', webui_user_id,
+                jsonb_build_object('models', NEW.models, 'key_alias', NEW.key_alias));
         
     EXCEPTION WHEN OTHERS THEN
         -- Record sync failure
@@ -93,7 +89,8 @@ $$ LANGUAGE plpgsql;
 CREATE OR REPLACE FUNCTION sync_api_key_delete_to_webui()
 RETURNS TRIGGER AS $$
 DECLARE 
-    target_conn_str TEXT := 'host=localhost port=5432 dbname=webui user=webui password=webui';
+    target_conn_str TEXT := COALESCE(sync_target_conn_override(),
+                                      'host=localhost port=5432 dbname=webui user=webui password=webui');
     webui_user_id TEXT;
 BEGIN
     -- Only process if user_id is provided
@@ -215,17 +212,14 @@ RETURNS TABLE(
 BEGIN
     RETURN QUERY
     SELECT 
-        sa.id,
-        sa.operation,
-        sa.record_id,
-        sa.sync_result,
-        sa.error_message,
-        COALESCE(sa.new_data, sa.old_data) as sync_data,
-        sa.created_at
-    FROM sync_audit sa
-    WHERE sa.operation IN ('SYNC_API_KEY', 'DELETE_API_KEY')
-    ORDER BY sa.created_at DESC
-    LIMIT limit_rows;
+        q.id,
+        q.operation,
+        q.record_id,
+        q.sync_result,
+        q.error_message,
+        COALESCE(q.new_data, q.old_data) as sync_data,
+        q.created_at
+    FROM query_sync_audit(ARRAY['SYNC_API_KEY', 'DELETE_API_KEY'], p_limit := limit_rows) q;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -0,0 +1,288 @@
+-- LiteLLM WebUI Bridge - Effective Model Permissions Extension
+-- Version: 1.3.0
+-- Compatible with: LiteLLM Latest + Open WebUI Latest
+--
+-- LiteLLM decides which models a user may call from three lists: the user's
+-- own models, the models of the user's team and the models of the user's
+-- organization. Open WebUI only sees the raw user list. This script keeps a
+-- materialized table with each user's effective model set and pushes it to
+-- "user".settings->'effective_models' in Open WebUI in batches.
+--
+-- Rules (same as LiteLLM): an empty list, or one containing
+-- 'all-proxy-models', does not restrict; the effective set is the
+-- intersection of every restricting list. NULL means all models.
+--
+-- Recomputation is incremental: a change to a user recomputes that user, a
+-- change to a team's models recomputes only that team's members and a change
+-- to an organization's models recomputes only its members (directly or
+-- through a team). Rows whose effective set did not change are not pushed again.
+--
+-- PREREQUISITE: Run litellm-webui-sync.sql first
+--
+-- BEFORE RUNNING:
+-- 1. Ensure basic user sync is working (run litellm-webui-sync.sql first)
+-- 2. Run this script on your LiteLLM database
+-- 3. Schedule SELECT push_effective_models(); (for example with pg_cron every minute)
+
+-- =============================================================================
+-- MATERIALIZED TABLE
+-- =============================================================================
+
+CREATE TABLE IF NOT EXISTS sync_effective_models (
+    user_id TEXT PRIMARY KEY,
+    team_id TEXT,
+    organization_id TEXT,
+    models TEXT[],                        -- NULL means all models
+    pending_push BOOLEAN NOT NULL DEFAULT true,
+    computed_at TIMESTAMP NOT NULL DEFAULT clock_timestamp(),
+    pushed_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_sync_effective_models_pending
+    ON sync_effective_models (user_id) WHERE pending_push;
+
+-- Member lookups for team and organization changes. LiteLLM does not index
+-- these columns itself; the indexes are additive and safe for its migrations.
+CREATE INDEX IF NOT EXISTS idx_bridge_user_team_id ON "LiteLLM_UserTable" (team_id);
+CREATE INDEX IF NOT EXISTS idx_bridge_user_organization_id ON "LiteLLM_UserTable" (organization_id);
+CREATE INDEX IF NOT EXISTS idx_bridge_team_organization_id ON "LiteLLM_TeamTable" (organization_id);
+
+-- =============================================================================
+-- COMPUTATION
+-- =============================================================================
+
+-- Function to narrow a model set by one more level (organization, team, user)
+CREATE OR REPLACE FUNCTION sync_restrict_models(current_models TEXT[], level_models TEXT[])
+RETURNS TEXT[] AS $$
+BEGIN
+    IF level_models IS NULL OR cardinality(level_models) = 0 OR 'all-proxy-models' = ANY(level_models) THEN
+        RETURN current_models;
+    END IF;
+
+    IF current_models IS NULL THEN
+        RETURN ARRAY(SELECT DISTINCT m FROM unnest(level_models) AS m ORDER BY m);
+    END IF;
+
+    RETURN ARRAY(SELECT DISTINCT m FROM unnest(level_models) AS m WHERE m = ANY(current_models) ORDER BY m);
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- Function to recompute the effective models of the given users (NULL = all users).
+-- Only rows whose effective set changed are marked for push. Returns that count.
+CREATE OR REPLACE FUNCTION refresh_effective_models(p_user_ids TEXT[] DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    changed_count INTEGER;
+BEGIN
+    INSERT INTO sync_effective_models AS em (user_id, team_id, organization_id, models, pending_push, computed_at)
+    SELECT u.user_id,
+           u.team_id,
+           COALESCE(u.organization_id, t.organization_id),
+           sync_restrict_models(sync_restrict_models(sync_restrict_models(NULL, o.models), t.models), u.models),
+           true,
+           clock_timestamp()
+    FROM "LiteLLM_UserTable" u
+    LEFT JOIN "LiteLLM_TeamTable" t ON t.team_id = u.team_id
+    LEFT JOIN "LiteLLM_OrganizationTable" o ON o.organization_id = COALESCE(u.organization_id, t.organization_id)
+    WHERE p_user_ids IS NULL OR u.user_id = ANY(p_user_ids)
+    ON CONFLICT (user_id) DO UPDATE SET
+        team_id = EXCLUDED.team_id,
+        organization_id = EXCLUDED.organization_id,
+        models = EXCLUDED.models,
+        pending_push = true,
+        computed_at = EXCLUDED.computed_at
+    WHERE em.models IS DISTINCT FROM EXCLUDED.models;
+
+    GET DIAGNOSTICS changed_count = ROW_COUNT;
+    RETURN changed_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================================================
+-- INCREMENTAL REFRESH TRIGGERS
+-- =============================================================================
+
+-- Function to refresh one user after its models, team or organization changed
+CREATE OR REPLACE FUNCTION refresh_user_effective_models()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM sync_effective_models WHERE user_id = OLD.user_id;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'UPDATE'
+       AND OLD.models IS NOT DISTINCT FROM NEW.models
+       AND OLD.team_id IS NOT DISTINCT FROM NEW.team_id
+       AND OLD.organization_id IS NOT DISTINCT FROM NEW.organization_id THEN
+        RETURN NULL;
+    END IF;
+
+    PERFORM refresh_effective_models(ARRAY[NEW.user_id]);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to refresh the members of a team whose models or organization changed
+CREATE OR REPLACE FUNCTION refresh_team_effective_models()
+RETURNS TRIGGER AS $$
+DECLARE
+    team_id_val TEXT;
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND OLD.models IS NOT DISTINCT FROM NEW.models
+       AND OLD.organization_id IS NOT DISTINCT FROM NEW.organization_id THEN
+        RETURN NULL;
+    END IF;
+
+    team_id_val := CASE WHEN TG_OP = 'DELETE' THEN OLD.team_id ELSE NEW.team_id END;
+
+    PERFORM refresh_effective_models(ARRAY(
+        SELECT u.user_id FROM "LiteLLM_UserTable" u WHERE u.team_id = team_id_val
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to refresh the members of an organization whose models changed
+CREATE OR REPLACE FUNCTION refresh_organization_effective_models()
+RETURNS TRIGGER AS $$
+DECLARE
+    org_id_val TEXT;
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.models IS NOT DISTINCT FROM NEW.models THEN
+        RETURN NULL;
+    END IF;
+
+    org_id_val := CASE WHEN TG_OP = 'DELETE' THEN OLD.organization_id ELSE NEW.organization_id END;
+
+    -- Members are users of the organization and users of its teams
+    PERFORM refresh_effective_models(ARRAY(
+        SELECT u.user_id FROM "LiteLLM_UserTable" u WHERE u.organization_id = org_id_val
+        UNION
+        SELECT u.user_id
+        FROM "LiteLLM_UserTable" u
+        JOIN "LiteLLM_TeamTable" t ON t.team_id = u.team_id
+        WHERE t.organization_id = org_id_val AND u.organization_id IS NULL
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Named so that it fires before user_sync_trigger (triggers fire in name
+-- order); the user sync then pushes the fresh effective set with the user.
+DROP TRIGGER IF EXISTS effective_models_user_trigger ON "LiteLLM_UserTable";
+CREATE TRIGGER effective_models_user_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON "LiteLLM_UserTable"
+    FOR EACH ROW EXECUTE FUNCTION refresh_user_effective_models();
+
+DROP TRIGGER IF EXISTS effective_models_team_trigger ON "LiteLLM_TeamTable";
+CREATE TRIGGER effective_models_team_trigger
+    AFTER UPDATE OR DELETE ON "LiteLLM_TeamTable"
+    FOR EACH ROW EXECUTE FUNCTION refresh_team_effective_models();
+
+DROP TRIGGER IF EXISTS effective_models_organization_trigger ON "LiteLLM_OrganizationTable";
+CREATE TRIGGER effective_models_organization_trigger
+    AFTER UPDATE OR DELETE ON "LiteLLM_OrganizationTable"
+    FOR EACH ROW EXECUTE FUNCTION refresh_organization_effective_models();
+
+-- =============================================================================
+-- BATCHED PUSH TO OPEN WEBUI
+-- =============================================================================
+
+-- Function to push pending effective model sets to Open WebUI.
+-- Each batch is one remote UPDATE ... FROM (VALUES ...) statement, i.e. one
+-- round trip per batch_size users. A failed batch stays pending and is
+-- retried on the next call. Only users the remote UPDATE actually matched
+-- (RETURNING id) are cleared; a user that does not exist in Open WebUI yet
+-- (push before backfill, or before delivery in outbox mode) stays pending and
+-- is pushed again on a later call. Each call walks the pending rows once in
+-- user_id order. Returns the number of users pushed.
+-- Only the default target is pushed: pending_push is a single flag per user, so
+-- targets registered in multi-target-sync.sql do not receive effective_models.
+CREATE OR REPLACE FUNCTION push_effective_models(batch_size INTEGER DEFAULT 500)
+RETURNS INTEGER AS $$
+DECLARE
+    target_conn_str TEXT := COALESCE(sync_target_conn_override(),
+                                      'host=localhost port=5432 dbname=webui user=webui password=webui');
+    batch_user_ids TEXT[];
+    batch_values TEXT;
+    pushed_ids TEXT[];
+    last_user_id TEXT := '';
+    pushed_total INTEGER := 0;
+BEGIN
+    LOOP
+        SELECT array_agg(b.user_id),
+               string_agg(format('(%L, %L::jsonb)', 'usr_' || b.user_id, to_jsonb(b.models)::text), ', ')
+        INTO batch_user_ids, batch_values
+        FROM (
+            SELECT em.user_id, em.models
+            FROM sync_effective_models em
+            WHERE em.pending_push AND em.user_id > last_user_id
+            ORDER BY em.user_id
+            LIMIT batch_size
+            FOR UPDATE SKIP LOCKED
+        ) b;
+
+        EXIT WHEN batch_user_ids IS NULL;
+        SELECT MAX(b) INTO last_user_id FROM unnest(batch_user_ids) AS b;
+
+        BEGIN
+            SELECT COALESCE(array_agg(substr(r.id, 5)), '{}') INTO pushed_ids
+            FROM dblink(target_conn_str, format('
+                UPDATE "user" u SET
+                    settings = (COALESCE(u.settings::jsonb, ''{}''::jsonb)
+                                || jsonb_build_object(''effective_models'', v.models))::json
+                FROM (VALUES %s) AS v(id, models)
+                WHERE u.id = v.id
+                RETURNING u.id
+            ', batch_values)) AS r(id TEXT);
+        EXCEPTION WHEN OTHERS THEN
+            INSERT INTO sync_audit (operation, record_id, sync_result, error_message, new_data)
+            VALUES ('PUSH_MODELS', 'effective_models', 'FAILED', SQLERRM,
+                    json_build_object('users', cardinality(batch_user_ids))::jsonb);
+            RETURN pushed_total;
+        END;
+
+        UPDATE sync_effective_models
+        SET pending_push = false, pushed_at = clock_timestamp()
+        WHERE user_id = ANY(pushed_ids);
+
+        INSERT INTO sync_audit (operation, record_id, sync_result, new_data)
+        VALUES ('PUSH_MODELS', 'effective_models', 'SUCCESS',
+                json_build_object('users', cardinality(pushed_ids),
+                                  'not_in_target', cardinality(batch_user_ids) - cardinality(pushed_ids))::jsonb);
+
+        pushed_total := pushed_total + cardinality(pushed_ids);
+    END LOOP;
+
+    RETURN pushed_total;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to check effective model materialization status
+CREATE OR REPLACE FUNCTION check_effective_models_status()
+RETURNS TABLE(metric TEXT, value TEXT) AS $$
+BEGIN
+    RETURN QUERY SELECT 'Materialized Users', COUNT(*)::TEXT FROM sync_effective_models;
+    RETURN QUERY SELECT 'Unrestricted Users', COUNT(*)::TEXT FROM sync_effective_models WHERE models IS NULL;
+    RETURN QUERY SELECT 'Pending Push', COUNT(*)::TEXT FROM sync_effective_models WHERE pending_push;
+    RETURN QUERY SELECT 'Last Push', COALESCE(MAX(pushed_at)::TEXT, 'never') FROM sync_effective_models;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================================================
+-- INITIAL MATERIALIZATION
+-- =============================================================================
+
+SELECT refresh_effective_models() AS materialized_users;
+
+INSERT INTO sync_audit (operation, record_id, sync_result, new_data)
+VALUES ('INSTALL', 'effective-models', 'SUCCESS',
+        json_build_object('version', '1.3.0', 'installed_at', CURRENT_TIMESTAMP));
+
+SELECT 'LiteLLM WebUI Effective Models Extension Installed!' AS message;
+SELECT 'Next Steps:' AS info;
+SELECT '1. Push the initial sets: SELECT push_effective_models();' AS step1;
+SELECT '2. Schedule push_effective_models() to run periodically' AS step2;
+SELECT '3. Monitor with: SELECT * FROM check_effective_models_status();' AS step3;
@@ -20,6 +20,9 @@
 
 -- NOTE: This connection string will be used in all sync functions below.
 --       You can also update individual functions if you need different connections.
+--       Test harnesses (src/fault_scenarios.py) redirect every sync function by
+--       writing sync_target_override below. Only the role that ran this script
+--       can write that table, so ordinary LiteLLM sessions cannot redirect sync.
 
 -- =============================================================================
 -- EXTENSIONS AND SETUP
@@ -31,6 +34,22 @@ CREATE EXTENSION IF NOT EXISTS dblink;
 -- Check if pgcrypto extension exists in target database (for password hashing)
 -- This will be attempted during first sync operation
 
+-- Target connection override, empty in production. The table is private to the
+-- installing role; triggers (which run as the LiteLLM role) read it only through
+-- the SECURITY DEFINER function below.
+CREATE TABLE IF NOT EXISTS sync_target_override (
+    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+    conn_str TEXT NOT NULL,
+    set_by TEXT NOT NULL DEFAULT current_user,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+REVOKE ALL ON sync_target_override FROM PUBLIC;
+
+CREATE OR REPLACE FUNCTION sync_target_conn_override()
+RETURNS TEXT AS $$
+    SELECT conn_str FROM sync_target_override WHERE id;
+$$ LANGUAGE sql STABLE SECURITY DEFINER SET search_path FROM CURRENT;
+
 -- =============================================================================
 -- AUDIT AND MAPPING TABLES
 -- =============================================================================
@@ -47,19 +66,231 @@ CREATE TABLE IF NOT EXISTS sync_audit (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Table to maintain mapping between LiteLLM and Open WebUI entities
+-- Audit rows record when the sync step finished rather than when the
+-- transaction began, so created_at minus the source updated_at is the sync latency
+ALTER TABLE sync_audit ALTER COLUMN created_at SET DEFAULT clock_timestamp();
+
+-- Indexes for keyset pagination on (created_at, id); see query_sync_audit().
+-- One index per filter that query_sync_audit() can lead with, so a page costs
+-- the same at any depth whichever filter is given (scanned backwards for the
+-- newest-first order). The operation index includes the narrow listing columns
+-- so combined filters are checked in the index.
+CREATE INDEX IF NOT EXISTS idx_sync_audit_created_id
+    ON sync_audit (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_sync_audit_operation_created_id
+    ON sync_audit (operation, created_at, id) INCLUDE (record_id, sync_result);
+CREATE INDEX IF NOT EXISTS idx_sync_audit_record_created_id
+    ON sync_audit (record_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_sync_audit_result_created_id
+    ON sync_audit (sync_result, created_at, id);
+
+-- Entity kinds on both sides of a mapping (4 bytes instead of a VARCHAR per row;
+-- string literals such as 'user' still compare and insert directly)
+DO $$
+BEGIN
+    CREATE TYPE sync_entity_type AS ENUM ('organization', 'user', 'api_key', 'group', 'user_api_key');
+EXCEPTION WHEN duplicate_object THEN
+    NULL;
+END $$;
+
+-- Table to maintain mapping between LiteLLM and Open WebUI entities.
+-- Only identity lives here; it is written once and rarely changes.
 CREATE TABLE IF NOT EXISTS sync_mapping (
     id SERIAL PRIMARY KEY,
-    litellm_type VARCHAR(20) NOT NULL,
+    litellm_type sync_entity_type NOT NULL,
     litellm_id TEXT NOT NULL,
-    openwebui_type VARCHAR(20) NOT NULL,
+    openwebui_type sync_entity_type NOT NULL,
     openwebui_id TEXT NOT NULL,
-    sync_data JSONB DEFAULT '{}',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(litellm_type, litellm_id)
 );
 
+-- Per-sync payload, rewritten on every sync. Kept in its own narrow table with
+-- free space on each page so the rewrites stay HOT and never touch sync_mapping
+-- or its indexes.
+CREATE TABLE IF NOT EXISTS sync_mapping_state (
+    mapping_id INTEGER PRIMARY KEY REFERENCES sync_mapping(id) ON DELETE CASCADE,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    sync_data JSONB NOT NULL DEFAULT '{}'
+) WITH (fillfactor = 80);
+
+-- Upgrade an existing sync_mapping in place: enum types, payload moved out
+DO $$
+BEGIN
+    IF (SELECT atttypid FROM pg_attribute
+        WHERE attrelid = 'sync_mapping'::regclass AND attname = 'litellm_type') <> 'sync_entity_type'::regtype THEN
+        ALTER TABLE sync_mapping
+            ALTER COLUMN litellm_type TYPE sync_entity_type USING litellm_type::sync_entity_type,
+            ALTER COLUMN openwebui_type TYPE sync_entity_type USING openwebui_type::sync_entity_type;
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM pg_attribute
+               WHERE attrelid = 'sync_mapping'::regclass AND attname = 'sync_data' AND NOT attisdropped) THEN
+        INSERT INTO sync_mapping_state (mapping_id, sync_data, updated_at)
+        SELECT id, COALESCE(sync_data, '{}'), COALESCE(updated_at, created_at, CURRENT_TIMESTAMP)
+        FROM sync_mapping
+        ON CONFLICT (mapping_id) DO NOTHING;
+
+        ALTER TABLE sync_mapping DROP COLUMN sync_data, DROP COLUMN updated_at;
+    END IF;
+END $$;
+
+-- Reverse lookups from the Open WebUI side ("which LiteLLM user owns usr_x",
+-- "which tokens are on this user")
+CREATE INDEX IF NOT EXISTS idx_sync_mapping_openwebui
+    ON sync_mapping (openwebui_type, openwebui_id);
+
+-- Mapping with its latest payload, in the column layout sync_mapping used to have
+CREATE OR REPLACE VIEW sync_mapping_detail AS
+SELECT m.id, m.litellm_type, m.litellm_id, m.openwebui_type, m.openwebui_id,
+       s.sync_data, m.created_at, s.updated_at
+FROM sync_mapping m
+LEFT JOIN sync_mapping_state s ON s.mapping_id = m.id;
+
+-- Sequence used as tie-breaker for source versions (see sync_source_version)
+CREATE SEQUENCE IF NOT EXISTS sync_source_version_seq;
+
+-- =============================================================================
+-- SOURCE VERSIONING
+-- =============================================================================
+
+-- Function to build a monotonic source version for a pushed row.
+-- The version is the LiteLLM updated_at (microseconds) followed by a sequence
+-- number, zero-padded so that plain text comparison (COLLATE "C") orders it.
+-- Remote upserts only apply when the incoming version is newer than the one
+-- already stored, so retries, parallel sessions and migrations running next to
+-- live triggers can never overwrite newer data with older data.
+--
+-- Limitation: a row without updated_at is versioned with CURRENT_TIMESTAMP of
+-- the database server. LiteLLM (Prisma) sets updated_at from the application
+-- clock, so for such rows the order is only as good as the agreement between
+-- the two clocks. Keep the hosts NTP-synchronized; rows that always carry
+-- updated_at are not affected.
+CREATE OR REPLACE FUNCTION sync_source_version(source_updated_at TIMESTAMP)
+RETURNS TEXT AS $$
+BEGIN
+    RETURN lpad(floor(EXTRACT(EPOCH FROM COALESCE(source_updated_at, CURRENT_TIMESTAMP)) * 1000000)::bigint::text, 20, '0')
+        || '.' || lpad(nextval('sync_source_version_seq')::text, 20, '0');
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to record a LiteLLM → Open WebUI mapping after a successful sync.
+-- The identity row is only rewritten when the Open WebUI side changes; the
+-- payload goes to sync_mapping_state.
+CREATE OR REPLACE FUNCTION sync_record_mapping(
+    p_litellm_type sync_entity_type,
+    p_litellm_id TEXT,
+    p_openwebui_type sync_entity_type,
+    p_openwebui_id TEXT,
+    p_sync_data JSONB
+)
+RETURNS INTEGER AS $$
+DECLARE
+    mapping_id_val INTEGER;
+BEGIN
+    INSERT INTO sync_mapping (litellm_type, litellm_id, openwebui_type, openwebui_id)
+    VALUES (p_litellm_type, p_litellm_id, p_openwebui_type, p_openwebui_id)
+    ON CONFLICT (litellm_type, litellm_id) DO UPDATE SET
+        openwebui_type = EXCLUDED.openwebui_type,
+        openwebui_id = EXCLUDED.openwebui_id
+    WHERE sync_mapping.openwebui_type <> EXCLUDED.openwebui_type
+       OR sync_mapping.openwebui_id <> EXCLUDED.openwebui_id
+    RETURNING id INTO mapping_id_val;
+
+    IF mapping_id_val IS NULL THEN
+        -- Unchanged identity: the conflicting row is locked, so it still exists
+        SELECT id INTO mapping_id_val
+        FROM sync_mapping
+        WHERE litellm_type = p_litellm_type AND litellm_id = p_litellm_id;
+    END IF;
+
+    INSERT INTO sync_mapping_state (mapping_id, sync_data, updated_at)
+    VALUES (mapping_id_val, COALESCE(p_sync_data, '{}'), CURRENT_TIMESTAMP)
+    ON CONFLICT (mapping_id) DO UPDATE SET
+        sync_data = EXCLUDED.sync_data,
+        updated_at = EXCLUDED.updated_at;
+
+    RETURN mapping_id_val;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================================================
+-- REMOTE BATCHING
+-- =============================================================================
+
+-- Function to run several remote statements in one remote transaction and one
+-- round trip. Each statement runs in its own subtransaction; once a statement
+-- fails, the remaining statements of the same group are skipped while other
+-- groups still run. statement_groups NULL means a single group (stop at the
+-- first failure). Returns one row per statement so callers can audit failures
+-- individually. Same script layout as src/remote_batch.py.
+CREATE OR REPLACE FUNCTION sync_remote_batch(
+    target_conn_str TEXT,
+    statements TEXT[],
+    statement_groups INTEGER[] DEFAULT NULL
+)
+RETURNS TABLE(stmt_index INTEGER, succeeded BOOLEAN, error_message TEXT) AS $$
+DECLARE
+    stmt_count INTEGER := COALESCE(array_length(statements, 1), 0);
+    groups_val INTEGER[];
+    script TEXT;
+    failures_text TEXT;
+BEGIN
+    IF stmt_count = 0 THEN
+        RETURN;
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM unnest(statements) AS s(stmt) WHERE position('$bridge_batch$' IN s.stmt) > 0) THEN
+        RAISE EXCEPTION 'sync_remote_batch: statements must not contain the $bridge_batch$ tag';
+    END IF;
+
+    groups_val := COALESCE(statement_groups, array_fill(0, ARRAY[stmt_count]));
+
+    script := format('
+        DO $bridge_batch$
+        DECLARE
+            stmts TEXT[] := %L::text[];
+            stmt_groups INTEGER[] := %L::integer[];
+            failed_groups INTEGER[] := ''{}''::integer[];
+            failures JSONB := ''[]''::jsonb;
+        BEGIN
+            FOR i IN 1 .. COALESCE(array_length(stmts, 1), 0) LOOP
+                IF stmt_groups[i] = ANY(failed_groups) THEN
+                    failures := failures || jsonb_build_array(jsonb_build_object(
+                        ''stmt'', i - 1, ''group'', stmt_groups[i], ''skipped'', true));
+                    CONTINUE;
+                END IF;
+                BEGIN
+                    EXECUTE stmts[i];
+                EXCEPTION WHEN OTHERS THEN
+                    failed_groups := failed_groups || stmt_groups[i];
+                    failures := failures || jsonb_build_array(jsonb_build_object(
+                        ''stmt'', i - 1, ''group'', stmt_groups[i], ''error'', SQLERRM));
+                END;
+            END LOOP;
+            PERFORM set_config(''bridge.batch_failures'', failures::text, true);
+        END
+        $bridge_batch$;
+        SELECT current_setting(''bridge.batch_failures'');
+    ', statements, groups_val);
+
+    SELECT t.failures INTO failures_text
+    FROM dblink(target_conn_str, script) AS t(failures TEXT);
+
+    RETURN QUERY
+    SELECT (s.idx - 1)::INTEGER,
+           f.failure IS NULL,
+           CASE
+               WHEN f.failure ? 'error' THEN f.failure->>'error'
+               WHEN f.failure IS NOT NULL THEN 'skipped after an earlier failure in the same group'
+           END
+    FROM generate_subscripts(statements, 1) AS s(idx)
+    LEFT JOIN jsonb_array_elements(COALESCE(failures_text, '[]')::jsonb) AS f(failure)
+           ON (f.failure->>'stmt')::INTEGER = s.idx - 1
+    ORDER BY s.idx;
+END;
+$$ LANGUAGE plpgsql;
+
 -- =============================================================================
 -- SYNC FUNCTIONS
 -- =============================================================================
@@ -68,11 +299,14 @@ CREATE TABLE IF NOT EXISTS sync_mapping (
 CREATE OR REPLACE FUNCTION sync_organization_to_group()
 RETURNS TRIGGER AS $$
 DECLARE 
-    target_conn_str TEXT := 'host=localhost port=5432 dbname=webui user=webui password=webui';
+    target_conn_str TEXT := COALESCE(sync_target_conn_override(),
+                                      'host=localhost port=5432 dbname=webui user=webui password=webui');
     group_id TEXT;
+    source_version_val TEXT;
 BEGIN
     -- Generate group ID with prefix
     group_id := 'grp_' || NEW.organization_id;
+    source_version_val := sync_source_version(NEW.updated_at);
     
     BEGIN
         -- Sync to target database group table
@@ -84,6 +318,8 @@ BEGIN
                 description = EXCLUDED.description,
                 meta = EXCLUDED.meta,
                 updated_at = EXCLUDED.updated_at
+            WHERE ("group".meta::jsonb->>''source_version'') IS NULL
+               OR ("group".meta::jsonb->>''source_version'') COLLATE "C" < (EXCLUDED.meta::jsonb->>''source_version'')
         ', group_id, NEW.organization_alias, 
            COALESCE(NEW.organization_alias || ' organization', ''),
            json_build_object(
@@ -92,18 +328,15 @@ BEGIN
                'models', NEW.models,
                'spend', NEW.spend,
                'model_spend', NEW.model_spend,
-               'metadata', NEW.metadata
+               'metadata', NEW.metadata,
+               'source_version', source_version_val
            )::text,
            EXTRACT(EPOCH FROM NEW.created_at)::bigint, EXTRACT(EPOCH FROM COALESCE(NEW.updated_at, CURRENT_TIMESTAMP))::bigint));
         
         -- Update mapping table
-        INSERT INTO sync_mapping (litellm_type, litellm_id, openwebui_type, openwebui_id, sync_data)
-        VALUES ('organization', NEW.organization_id, 'group', group_id, 
-               json_build_object('organization_alias', NEW.organization_alias))
-        ON CONFLICT (litellm_type, litellm_id) 
-        DO UPDATE SET 
-            sync_data = EXCLUDED.sync_data,
-            updated_at = CURRENT_TIMESTAMP;
+        PERFORM sync_record_mapping('organization', NEW.organization_id, 'group', group_id,
+               jsonb_build_object('organization_alias', NEW.organization_alias,
+                                  'source_version', source_version_val));
         
         -- Log success
         INSERT INTO sync_audit (operation, record_id, sync_result, new_data)
@@ -119,18 +352,47 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Function to recognize the UPDATE written by reverse_sync_openwebui_activity():
+-- true when nothing but metadata->'openwebui' changed. The forward triggers skip
+-- such updates so reverse-synced data is not pushed back. The check looks at the
+-- row contents rather than a session setting, so a caller cannot use it to hide
+-- any other change from the sync.
+CREATE OR REPLACE FUNCTION sync_is_reverse_only_update(old_row JSONB, new_row JSONB)
+RETURNS BOOLEAN AS $$
+    SELECT (old_row - 'metadata') = (new_row - 'metadata')
+       AND (CASE WHEN jsonb_typeof(old_row->'metadata') = 'object'
+                 THEN (old_row->'metadata') - 'openwebui' ELSE '{}'::jsonb END)
+         = (CASE WHEN jsonb_typeof(new_row->'metadata') = 'object'
+                 THEN (new_row->'metadata') - 'openwebui' ELSE '{}'::jsonb END);
+$$ LANGUAGE sql IMMUTABLE;
+
 -- Function to sync users to Open WebUI users
 CREATE OR REPLACE FUNCTION sync_user_to_openwebui()
 RETURNS TRIGGER AS $$
 DECLARE 
-    target_conn_str TEXT := 'host=localhost port=5432 dbname=webui user=webui password=webui';
+    target_conn_str TEXT := COALESCE(sync_target_conn_override(),
+                                      'host=localhost port=5432 dbname=webui user=webui password=webui');
     user_id_mapped TEXT;
     display_name TEXT;
     user_role_mapped VARCHAR;
     team_alias_val VARCHAR;
+    source_version_val TEXT;
+    settings_val JSONB;
+    effective_models_val TEXT[];
+    remote_statements TEXT[];
+    batch_result RECORD;
 BEGIN
+    -- Changes written by reverse_sync_openwebui_activity() are not pushed back
+    IF TG_OP = 'UPDATE' THEN
+        IF OLD.metadata IS DISTINCT FROM NEW.metadata
+           AND sync_is_reverse_only_update(to_jsonb(OLD), to_jsonb(NEW)) THEN
+            RETURN NEW;
+        END IF;
+    END IF;
+    
     -- Generate mapped user ID with prefix
     user_id_mapped := 'usr_' || NEW.user_id;
+    source_version_val := sync_source_version(NEW.updated_at);
     
     -- Get team alias for name mapping
     IF NEW.team_id IS NOT NULL THEN
@@ -149,9 +411,28 @@ BEGIN
         ELSE 'user'
     END;
     
+    settings_val := json_build_object(
+        'max_budget', NEW.max_budget,
+        'spend', NEW.spend,
+        'models', NEW.models,
+        'metadata', NEW.metadata,
+        'model_spend', NEW.model_spend,
+        'model_max_budget', NEW.model_max_budget
+    )::jsonb;
+    
+    -- Include the effective model set when effective-models.sql is installed
+    IF to_regclass('sync_effective_models') IS NOT NULL THEN
+        SELECT em.models INTO effective_models_val
+        FROM sync_effective_models em
+        WHERE em.user_id = NEW.user_id;
+        IF FOUND THEN
+            settings_val := settings_val || jsonb_build_object('effective_models', to_jsonb(effective_models_val));
+        END IF;
+    END IF;
+    
     BEGIN
-        -- Sync to target database user table
-        PERFORM dblink_exec(target_conn_str, format('
+        -- User upsert, pgcrypto and auth upsert go out as one remote transaction in one round trip
+        remote_statements := ARRAY[format('
             INSERT INTO "user" (id, email, name, role, oauth_sub, settings, info, profile_image_url, last_active_at, created_at, updated_at)
             VALUES (%L, %L, %L, %L, %L, %L, %L, %L, %L, %L, %L)
             ON CONFLICT (id) DO UPDATE SET
@@ -159,59 +440,66 @@ BEGIN
                 name = EXCLUDED.name,
                 role = EXCLUDED.role,
                 oauth_sub = EXCLUDED.oauth_sub,
-                settings = EXCLUDED.settings,
-                info = EXCLUDED.info,
+                -- Keep the pushed effective_models unless the new settings carry their own
+                settings = (jsonb_strip_nulls(jsonb_build_object(''effective_models'', "user".settings::jsonb->''effective_models''))
+                            || EXCLUDED.settings::jsonb)::json,
+                -- Keep the usage summary pushed by push_usage_rollups()
+                info = (jsonb_strip_nulls(jsonb_build_object(''usage'', "user".info::jsonb->''usage''))
+                        || EXCLUDED.info::jsonb)::json,
                 updated_at = EXCLUDED.updated_at
+            WHERE ("user".info::jsonb->>''source_version'') IS NULL
+               OR ("user".info::jsonb->>''source_version'') COLLATE "C" < (EXCLUDED.info::jsonb->>''source_version'')
         ', user_id_mapped, NEW.user_email, display_name, user_role_mapped, NEW.sso_user_id,
-           json_build_object(
-               'max_budget', NEW.max_budget,
-               'spend', NEW.spend,
-               'models', NEW.models,
-               'metadata', NEW.metadata,
-               'model_spend', NEW.model_spend,
-               'model_max_budget', NEW.model_max_budget
-           )::text,
+           settings_val::text,
            json_build_object(
                'organization_id', NEW.organization_id,
                'team_id', NEW.team_id,
                'original_user_id', NEW.user_id,
-               'user_role', NEW.user_role
+               'user_role', NEW.user_role,
+               'source_version', source_version_val
            )::text,
            '/static/profile-user.png',
            EXTRACT(EPOCH FROM CURRENT_TIMESTAMP)::bigint,
-           EXTRACT(EPOCH FROM NEW.created_at)::bigint, EXTRACT(EPOCH FROM COALESCE(NEW.updated_at, CURRENT_TIMESTAMP))::bigint));
+           EXTRACT(EPOCH FROM NEW.created_at)::bigint, EXTRACT(EPOCH FROM COALESCE(NEW.updated_at, CURRENT_TIMESTAMP))::bigint)];
         
-        -- Create authentication record with email as initial password (if user has email)
+        -- Create authentication record with email as initial password (if user has email).
+        -- Only applied when the user upsert above won (the row carries this version),
+        -- so a stale change cannot move auth.email away from "user".email.
         IF NEW.user_email IS NOT NULL AND NEW.user_email != '' THEN
-            BEGIN
-                -- First ensure pgcrypto extension is available
-                PERFORM dblink_exec(target_conn_str, 'CREATE EXTENSION IF NOT EXISTS pgcrypto;');
-                
-                -- Create auth record
-                PERFORM dblink_exec(target_conn_str, format('
+            remote_statements := remote_statements || ARRAY[
+                'CREATE EXTENSION IF NOT EXISTS pgcrypto;',
+                format('
                     INSERT INTO auth (id, email, password, active)
-                    VALUES (%L, %L, crypt(%L, gen_salt(''bf'', 12)), true)
+                    SELECT %L, %L, crypt(%L, gen_salt(''bf'', 12)), true
+                    WHERE EXISTS (SELECT 1 FROM "user" WHERE id = %L AND info::jsonb->>''source_version'' = %L)
                     ON CONFLICT (id) DO UPDATE SET
                         email = EXCLUDED.email,
                         active = EXCLUDED.active
-                ', user_id_mapped, NEW.user_email, NEW.user_email));
-                
-            EXCEPTION WHEN OTHERS THEN
-                -- Log auth creation failure but continue with user sync
-                INSERT INTO sync_audit (operation, record_id, sync_result, error_message)
-                VALUES ('AUTH_CREATE', NEW.user_id, 'WARNING', 
-                        'Auth record creation failed: ' || SQLERRM);
-            END;
+                ', user_id_mapped, NEW.user_email, NEW.user_email, user_id_mapped, source_version_val)
+            ];
         END IF;
         
+        FOR batch_result IN
+            SELECT * FROM sync_remote_batch(target_conn_str, remote_statements)
+            WHERE NOT succeeded
+            ORDER BY stmt_index
+            LIMIT 1
+        LOOP
+            IF batch_result.stmt_index = 0 THEN
+                -- The user upsert itself failed: handled as a failed user sync below
+                RAISE EXCEPTION '%', batch_result.error_message;
+            END IF;
+            
+            -- Log auth creation failure but continue with user sync
+            INSERT INTO sync_audit (operation, record_id, sync_result, error_message)
+            VALUES ('AUTH_CREATE', NEW.user_id, 'WARNING', 
+                    'Auth record creation failed: ' || batch_result.error_message);
+        END LOOP;
+        
         -- Update mapping table
-        INSERT INTO sync_mapping (litellm_type, litellm_id, openwebui_type, openwebui_id, sync_data)
-        VALUES ('user', NEW.user_id, 'user', user_id_mapped, 
-               json_build_object('display_name', display_name, 'original_role', NEW.user_role))
-        ON CONFLICT (litellm_type, litellm_id) 
-        DO UPDATE SET 
-            sync_data = EXCLUDED.sync_data,
-            updated_at = CURRENT_TIMESTAMP;
+        PERFORM sync_record_mapping('user', NEW.user_id, 'user', user_id_mapped,
+               jsonb_build_object('display_name', display_name, 'original_role', NEW.user_role,
+                                  'source_version', source_version_val));
         
         -- Log success
         INSERT INTO sync_audit (operation, record_id, sync_result, new_data)
@@ -231,7 +519,8 @@ $$ LANGUAGE plpgsql;
 CREATE OR REPLACE FUNCTION handle_organization_deletion()
 RETURNS TRIGGER AS $$
 DECLARE 
-    target_conn_str TEXT := 'host=localhost port=5432 dbname=webui user=webui password=webui';
+    target_conn_str TEXT := COALESCE(sync_target_conn_override(),
+                                      'host=localhost port=5432 dbname=webui user=webui password=webui');
     group_id TEXT;
 BEGIN
     group_id := 'grp_' || OLD.organization_id;
@@ -261,14 +550,18 @@ $$ LANGUAGE plpgsql;
 CREATE OR REPLACE FUNCTION handle_user_deletion()
 RETURNS TRIGGER AS $$
 DECLARE 
-    target_conn_str TEXT := 'host=localhost port=5432 dbname=webui user=webui password=webui';
+    target_conn_str TEXT := COALESCE(sync_target_conn_override(),
+                                      'host=localhost port=5432 dbname=webui user=webui password=webui');
     user_id_mapped TEXT;
 BEGIN
     user_id_mapped := 'usr_' || OLD.user_id;
     
     BEGIN
-        -- Delete from target database
-        PERFORM dblink_exec(target_conn_str, format('DELETE FROM "user" WHERE id = %L', user_id_mapped));
+        -- Delete the user and its auth record from target database in one remote transaction
+        PERFORM dblink_exec(target_conn_str, format('
+            DELETE FROM "user" WHERE id = %L;
+            DELETE FROM auth WHERE id = %L;
+        ', user_id_mapped, user_id_mapped));
         
         -- Remove mapping
         DELETE FROM sync_mapping WHERE litellm_type = 'user' AND litellm_id = OLD.user_id;
@@ -335,15 +628,377 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Function to query the audit log, newest first, with keyset pagination.
+-- Pass the created_at and id of the last row of a page as p_after_created_at /
+-- p_after_id to get the next page; each page costs the same regardless of depth.
+-- Only the filters that are set are added to the query. The scan is led by
+-- one index, in this order of preference:
+--   p_operations  idx_sync_audit_operation_created_id
+--   p_record_id   idx_sync_audit_record_created_id
+--   p_results     idx_sync_audit_result_created_id
+--   (none)        idx_sync_audit_created_id
+-- and the remaining filters are checked along the scan. With several
+-- operations (or results) each value gets its own ordered scan limited to one
+-- page, and the branches are merged with UNION ALL; a single "= ANY(...)" scan
+-- cannot return rows in (created_at, id) order and would sort every match.
+-- Time bounds alone narrow the (created_at, id) scan.
+CREATE OR REPLACE FUNCTION query_sync_audit(
+    p_operations TEXT[] DEFAULT NULL,
+    p_results TEXT[] DEFAULT NULL,
+    p_record_id TEXT DEFAULT NULL,
+    p_from TIMESTAMP DEFAULT NULL,
+    p_to TIMESTAMP DEFAULT NULL,
+    p_after_created_at TIMESTAMP DEFAULT NULL,
+    p_after_id INTEGER DEFAULT NULL,
+    p_limit INTEGER DEFAULT 50
+)
+RETURNS TABLE(
+    id INTEGER,
+    operation VARCHAR(20),
+    record_id TEXT,
+    sync_result VARCHAR(20),
+    error_message TEXT,
+    old_data JSONB,
+    new_data JSONB,
+    created_at TIMESTAMP
+) AS $$
+DECLARE
+    select_sql TEXT := 'SELECT sa.id, sa.operation, sa.record_id, sa.sync_result, sa.error_message,
+                               sa.old_data, sa.new_data, sa.created_at
+                        FROM sync_audit sa
+                        WHERE true';
+    filter_sql TEXT := '';
+    order_sql TEXT := ' ORDER BY created_at DESC, id DESC LIMIT $8';
+    query_sql TEXT;
+    split_column TEXT;
+    split_param TEXT;
+    split_count INTEGER;
+BEGIN
+    IF p_operations IS NOT NULL THEN
+        -- A repeated value would otherwise produce duplicate branches
+        p_operations := ARRAY(SELECT DISTINCT unnest(p_operations));
+        split_column := 'sa.operation';
+        split_param := '$1';
+        split_count := COALESCE(array_length(p_operations, 1), 0);
+    ELSIF p_results IS NOT NULL AND p_record_id IS NULL THEN
+        p_results := ARRAY(SELECT DISTINCT unnest(p_results));
+        split_column := 'sa.sync_result';
+        split_param := '$2';
+        split_count := COALESCE(array_length(p_results, 1), 0);
+    END IF;
+
+    IF p_results IS NOT NULL AND split_param IS DISTINCT FROM '$2' THEN
+        filter_sql := filter_sql || ' AND sa.sync_result = ANY($2)';
+    END IF;
+    IF p_record_id IS NOT NULL THEN
+        filter_sql := filter_sql || ' AND sa.record_id = $3';
+    END IF;
+    IF p_from IS NOT NULL THEN
+        filter_sql := filter_sql || ' AND sa.created_at >= $4';
+    END IF;
+    IF p_to IS NOT NULL THEN
+        filter_sql := filter_sql || ' AND sa.created_at < $5';
+    END IF;
+    IF p_after_created_at IS NOT NULL THEN
+        filter_sql := filter_sql || ' AND (sa.created_at, sa.id) < ($6, $7)';
+    END IF;
+
+    IF split_column IS NULL THEN
+        query_sql := select_sql || filter_sql || order_sql;
+    ELSIF split_count <= 1 THEN
+        query_sql := select_sql || ' AND ' || split_column || ' = ' || split_param || '[1]' || filter_sql || order_sql;
+    ELSE
+        -- One keyset scan per value, merged by the outer ORDER BY/LIMIT
+        SELECT string_agg('(' || select_sql || ' AND ' || split_column || ' = ' || split_param || '[' || i || ']'
+                          || filter_sql || order_sql || ')', ' UNION ALL ')
+        INTO query_sql
+        FROM generate_series(1, split_count) AS i;
+        query_sql := 'SELECT * FROM (' || query_sql || ') merged' || order_sql;
+    END IF;
+
+    RETURN QUERY EXECUTE query_sql
+    USING p_operations, p_results, p_record_id, p_from, p_to,
+          p_after_created_at, COALESCE(p_after_id, 2147483647), GREATEST(COALESCE(p_limit, 50), 1);
+END;
+$$ LANGUAGE plpgsql;
+
 -- Function to get recent sync activities
 CREATE OR REPLACE FUNCTION get_recent_sync_activities(limit_count INTEGER DEFAULT 10)
 RETURNS TABLE(operation TEXT, record_id TEXT, result TEXT, created_at TIMESTAMP) AS $$
 BEGIN
     RETURN QUERY 
-    SELECT sa.operation, sa.record_id, sa.sync_result, sa.created_at
-    FROM sync_audit sa
-    ORDER BY sa.created_at DESC
-    LIMIT limit_count;
+    SELECT q.operation::TEXT, q.record_id, q.sync_result::TEXT, q.created_at
+    FROM query_sync_audit(p_limit := limit_count) q;
+END;
+$$ LANGUAGE plpgsql;
+
+-- The per-row audit NOTIFY used by the test harness is not part of the
+-- production install: NOTIFY takes a global queue lock at commit, which would
+-- serialize every audited LiteLLM write. It lives in sql/test-audit-notify.sql;
+-- remove it where an earlier version of this script installed it.
+DROP TRIGGER IF EXISTS sync_audit_notify_trigger ON sync_audit;
+DROP FUNCTION IF EXISTS notify_sync_audit();
+
+-- =============================================================================
+-- REVERSE SYNC
+-- =============================================================================
+
+-- High-water marks of incremental pulls from Open WebUI
+CREATE TABLE IF NOT EXISTS sync_reverse_state (
+    source_name VARCHAR(64) PRIMARY KEY,
+    high_water BIGINT NOT NULL DEFAULT 0,     -- Open WebUI epoch seconds
+    last_applied INTEGER NOT NULL DEFAULT 0,
+    last_run_at TIMESTAMP
+);
+
+-- Function to pull Open WebUI activity (last_active_at, name, profile image)
+-- back into LiteLLM_UserTable.metadata->'openwebui'.
+-- Only users whose updated_at or last_active_at reached the stored high-water
+-- mark are fetched (one dblink round trip), and all of them are applied with
+-- one UPDATE. Open WebUI timestamps have second precision, so the boundary
+-- second is fetched again; unchanged rows are skipped, so that is harmless.
+-- The update only touches metadata->'openwebui', which the forward sync
+-- triggers recognize (sync_is_reverse_only_update) and do not push back.
+-- Returns the number of LiteLLM users updated. Run it periodically.
+CREATE OR REPLACE FUNCTION reverse_sync_openwebui_activity()
+RETURNS INTEGER AS $$
+DECLARE
+    target_conn_str TEXT := COALESCE(sync_target_conn_override(),
+                                      'host=localhost port=5432 dbname=webui user=webui password=webui');
+    high_water_val BIGINT;
+    new_high_water BIGINT;
+    applied_count INTEGER;
+BEGIN
+    INSERT INTO sync_reverse_state (source_name) VALUES ('openwebui_user')
+    ON CONFLICT (source_name) DO NOTHING;
+
+    -- Locks the state row: concurrent runs queue instead of racing on the mark
+    SELECT high_water INTO high_water_val
+    FROM sync_reverse_state
+    WHERE source_name = 'openwebui_user'
+    FOR UPDATE;
+
+    CREATE TEMP TABLE IF NOT EXISTS reverse_sync_batch (
+        user_id TEXT PRIMARY KEY,
+        name TEXT,
+        profile_image_url TEXT,
+        last_active_at BIGINT,
+        changed_at BIGINT
+    ) ON COMMIT DROP;
+    TRUNCATE reverse_sync_batch;
+
+    INSERT INTO reverse_sync_batch
+    SELECT substr(r.id, 5), r.name, r.profile_image_url, r.last_active_at, r.changed_at
+    FROM dblink(target_conn_str, format('
+        SELECT id, name, profile_image_url, last_active_at,
+               GREATEST(COALESCE(updated_at, 0), COALESCE(last_active_at, 0))
+        FROM "user"
+        WHERE id LIKE ''usr\_%%''
+          AND GREATEST(COALESCE(updated_at, 0), COALESCE(last_active_at, 0)) >= %s
+    ', high_water_val)) AS r(id TEXT, name TEXT, profile_image_url TEXT, last_active_at BIGINT, changed_at BIGINT);
+
+    SELECT MAX(changed_at) INTO new_high_water FROM reverse_sync_batch;
+
+    UPDATE "LiteLLM_UserTable" u SET
+        metadata = COALESCE(u.metadata, '{}'::jsonb) || jsonb_build_object('openwebui', jsonb_build_object(
+            'name', b.name,
+            'profile_image_url', b.profile_image_url,
+            'last_active_at', to_timestamp(b.last_active_at)
+        ))
+    FROM reverse_sync_batch b
+    WHERE u.user_id = b.user_id
+      AND (u.metadata->'openwebui') IS DISTINCT FROM jsonb_build_object(
+            'name', b.name,
+            'profile_image_url', b.profile_image_url,
+            'last_active_at', to_timestamp(b.last_active_at)
+          );
+    GET DIAGNOSTICS applied_count = ROW_COUNT;
+
+    UPDATE sync_reverse_state SET
+        high_water = GREATEST(high_water, COALESCE(new_high_water, high_water)),
+        last_applied = applied_count,
+        last_run_at = CURRENT_TIMESTAMP
+    WHERE source_name = 'openwebui_user';
+
+    IF applied_count > 0 THEN
+        INSERT INTO sync_audit (operation, record_id, sync_result, new_data)
+        VALUES ('REVERSE_SYNC', 'openwebui_user', 'SUCCESS',
+                json_build_object('applied', applied_count, 'high_water', new_high_water)::jsonb);
+    END IF;
+
+    RETURN applied_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================================================
+-- MAINTENANCE
+-- =============================================================================
+
+-- Function to find and remove orphans left behind by failed deletes.
+-- Takes one bulk snapshot of the bridge-owned Open WebUI ids ("user", auth,
+-- "group" and synced api keys) in a single dblink round trip, finds orphans
+-- with set-based anti-joins against LiteLLM and sync_mapping, and removes them
+-- with one remote statement per batch_size ids. Orphan kinds:
+--   user      usr_ user whose LiteLLM user no longer exists
+--   auth      usr_ auth row without a "user" row (or whose user is an orphan)
+--   group     grp_ group whose LiteLLM organization no longer exists
+--   api_key   synced key still set in Open WebUI after the LiteLLM key was deleted
+--   mapping   sync_mapping row whose LiteLLM entity no longer exists
+-- dry_run (the default) only counts.
+-- p_conn_str / p_organization_filter sweep another target instead of the
+-- default one (see sweep_sync_target_orphans() in multi-target-sync.sql): users
+-- and groups outside the filter count as orphans there, and sync_mapping, which
+-- is local, is only swept together with the default target.
+DROP FUNCTION IF EXISTS sweep_sync_orphans(BOOLEAN, INTEGER);
+CREATE OR REPLACE FUNCTION sweep_sync_orphans(
+    dry_run BOOLEAN DEFAULT true,
+    batch_size INTEGER DEFAULT 500,
+    p_conn_str TEXT DEFAULT NULL,
+    p_organization_filter TEXT[] DEFAULT NULL
+)
+RETURNS TABLE(orphan_type TEXT, orphan_count INTEGER, removed_count INTEGER) AS $$
+DECLARE
+    target_conn_str TEXT := COALESCE(p_conn_str, sync_target_conn_override(),
+                                      'host=localhost port=5432 dbname=webui user=webui password=webui');
+    orphan_users TEXT[];
+    orphan_auth TEXT[];
+    orphan_groups TEXT[];
+    orphan_key_users TEXT[];
+    orphan_key_tokens TEXT[];
+    orphan_mappings INTEGER[];
+    batch_ids TEXT[];
+    batch_tokens TEXT[];
+    command_status TEXT;
+    removed_users INTEGER := 0;
+    removed_auth INTEGER := 0;
+    removed_groups INTEGER := 0;
+    removed_keys INTEGER := 0;
+    removed_mappings INTEGER := 0;
+    i INTEGER;
+BEGIN
+    -- One bulk snapshot of the remote ids
+    DROP TABLE IF EXISTS pg_temp.sweep_remote_ids;
+    CREATE TEMP TABLE sweep_remote_ids ON COMMIT DROP AS
+    SELECT * FROM dblink(target_conn_str, '
+        SELECT ''user'', id, api_key FROM "user" WHERE id LIKE ''usr\_%''
+        UNION ALL
+        SELECT ''auth'', id, NULL FROM auth WHERE id LIKE ''usr\_%''
+        UNION ALL
+        SELECT ''group'', id, NULL FROM "group" WHERE id LIKE ''grp\_%''
+    ') AS r(kind TEXT, id TEXT, api_key TEXT);
+    CREATE INDEX ON sweep_remote_ids (kind, id);
+    ANALYZE sweep_remote_ids;
+
+    SELECT COALESCE(array_agg(r.id ORDER BY r.id), '{}') INTO orphan_users
+    FROM sweep_remote_ids r
+    WHERE r.kind = 'user'
+      AND NOT EXISTS (SELECT 1 FROM "LiteLLM_UserTable" u
+                      WHERE u.user_id = substr(r.id, 5)
+                        AND (p_organization_filter IS NULL OR u.organization_id = ANY(p_organization_filter)));
+
+    SELECT COALESCE(array_agg(a.id ORDER BY a.id), '{}') INTO orphan_auth
+    FROM sweep_remote_ids a
+    WHERE a.kind = 'auth'
+      AND (a.id = ANY(orphan_users)
+           OR NOT EXISTS (SELECT 1 FROM sweep_remote_ids r WHERE r.kind = 'user' AND r.id = a.id));
+
+    SELECT COALESCE(array_agg(r.id ORDER BY r.id), '{}') INTO orphan_groups
+    FROM sweep_remote_ids r
+    WHERE r.kind = 'group'
+      AND NOT EXISTS (SELECT 1 FROM "LiteLLM_OrganizationTable" o
+                      WHERE o.organization_id = substr(r.id, 5)
+                        AND (p_organization_filter IS NULL OR o.organization_id = ANY(p_organization_filter)));
+
+    SELECT COALESCE(array_agg(r.id ORDER BY r.id), '{}'), COALESCE(array_agg(r.api_key ORDER BY r.id), '{}')
+    INTO orphan_key_users, orphan_key_tokens
+    FROM sweep_remote_ids r
+    JOIN sync_mapping m ON m.litellm_type = 'api_key' AND m.litellm_id = r.api_key
+    WHERE r.kind = 'user'
+      AND NOT (r.id = ANY(orphan_users))
+      AND NOT EXISTS (SELECT 1 FROM "LiteLLM_VerificationToken" t WHERE t.token = r.api_key);
+
+    SELECT COALESCE(array_agg(m.id ORDER BY m.id), '{}') INTO orphan_mappings
+    FROM sync_mapping m
+    WHERE p_conn_str IS NULL
+      AND ((m.litellm_type = 'user'
+           AND NOT EXISTS (SELECT 1 FROM "LiteLLM_UserTable" u WHERE u.user_id = m.litellm_id))
+       OR (m.litellm_type = 'organization'
+           AND NOT EXISTS (SELECT 1 FROM "LiteLLM_OrganizationTable" o WHERE o.organization_id = m.litellm_id))
+       OR (m.litellm_type = 'api_key'
+           AND NOT EXISTS (SELECT 1 FROM "LiteLLM_VerificationToken" t WHERE t.token = m.litellm_id)));
+
+    IF NOT dry_run THEN
+        -- Users first (their auth rows are in orphan_auth); re-check LiteLLM per batch so
+        -- a user created again since the snapshot is never deleted
+        FOR i IN 1 .. cardinality(orphan_users) BY batch_size LOOP
+            SELECT COALESCE(array_agg(b.id), '{}') INTO batch_ids
+            FROM unnest(orphan_users[i : i + batch_size - 1]) AS b(id)
+            WHERE NOT EXISTS (SELECT 1 FROM "LiteLLM_UserTable" u
+                              WHERE u.user_id = substr(b.id, 5)
+                                AND (p_organization_filter IS NULL OR u.organization_id = ANY(p_organization_filter)));
+            IF cardinality(batch_ids) > 0 THEN
+                command_status := dblink_exec(target_conn_str, format(
+                    'DELETE FROM "user" WHERE id = ANY(%L::text[])', batch_ids));
+                removed_users := removed_users + split_part(command_status, ' ', 2)::INTEGER;
+            END IF;
+        END LOOP;
+
+        FOR i IN 1 .. cardinality(orphan_auth) BY batch_size LOOP
+            batch_ids := orphan_auth[i : i + batch_size - 1];
+            command_status := dblink_exec(target_conn_str, format('
+                DELETE FROM auth a WHERE a.id = ANY(%L::text[])
+                  AND NOT EXISTS (SELECT 1 FROM "user" u WHERE u.id = a.id)
+            ', batch_ids));
+            removed_auth := removed_auth + split_part(command_status, ' ', 2)::INTEGER;
+        END LOOP;
+
+        FOR i IN 1 .. cardinality(orphan_groups) BY batch_size LOOP
+            SELECT COALESCE(array_agg(b.id), '{}') INTO batch_ids
+            FROM unnest(orphan_groups[i : i + batch_size - 1]) AS b(id)
+            WHERE NOT EXISTS (SELECT 1 FROM "LiteLLM_OrganizationTable" o
+                              WHERE o.organization_id = substr(b.id, 5)
+                                AND (p_organization_filter IS NULL OR o.organization_id = ANY(p_organization_filter)));
+            IF cardinality(batch_ids) > 0 THEN
+                command_status := dblink_exec(target_conn_str, format(
+                    'DELETE FROM "group" WHERE id = ANY(%L::text[])', batch_ids));
+                removed_groups := removed_groups + split_part(command_status, ' ', 2)::INTEGER;
+            END IF;
+        END LOOP;
+
+        -- Only clear a key that is still the orphaned one
+        FOR i IN 1 .. cardinality(orphan_key_users) BY batch_size LOOP
+            batch_ids := orphan_key_users[i : i + batch_size - 1];
+            batch_tokens := orphan_key_tokens[i : i + batch_size - 1];
+            command_status := dblink_exec(target_conn_str, format('
+                UPDATE "user" u SET api_key = NULL
+                FROM unnest(%L::text[], %L::text[]) AS k(id, token)
+                WHERE u.id = k.id AND u.api_key = k.token
+            ', batch_ids, batch_tokens));
+            removed_keys := removed_keys + split_part(command_status, ' ', 2)::INTEGER;
+        END LOOP;
+
+        DELETE FROM sync_mapping WHERE id = ANY(orphan_mappings);
+        GET DIAGNOSTICS removed_mappings = ROW_COUNT;
+    END IF;
+
+    INSERT INTO sync_audit (operation, record_id, sync_result, new_data)
+    VALUES ('SWEEP_ORPHANS', 'sweep_sync_orphans', 'SUCCESS',
+            json_build_object(
+                'dry_run', dry_run,
+                'default_target', p_conn_str IS NULL,
+                'users', cardinality(orphan_users),
+                'auth', cardinality(orphan_auth),
+                'groups', cardinality(orphan_groups),
+                'api_keys', cardinality(orphan_key_users),
+                'mappings', cardinality(orphan_mappings)
+            )::jsonb);
+
+    RETURN QUERY VALUES
+        ('user', cardinality(orphan_users), removed_users),
+        ('auth', cardinality(orphan_auth), removed_auth),
+        ('group', cardinality(orphan_groups), removed_groups),
+        ('api_key', cardinality(orphan_key_users), removed_keys),
+        ('mapping', cardinality(orphan_mappings), removed_mappings);
 END;
 $$ LANGUAGE plpgsql;
 
@@ -361,4 +1016,6 @@ SELECT 'LiteLLM WebUI Bridge Installation Complete!' AS message;
 SELECT 'Next Steps:' AS info;
 SELECT '1. Update target_conn_str in all functions above' AS step1;
 SELECT '2. Test with: SELECT * FROM check_sync_status();' AS step2;
-SELECT '3. Monitor with: SELECT * FROM get_recent_sync_activities();' AS step3;
\ No newline at end of file
+SELECT '3. Monitor with: SELECT * FROM get_recent_sync_activities();' AS step3;
+SELECT '4. Page through history with: SELECT * FROM query_sync_audit(p_results := ARRAY[''FAILED'']);' AS step4;
+SELECT '5. Find orphans with: SELECT * FROM sweep_sync_orphans(dry_run := true);' AS step5;
\ No newline at end of file
@@ -32,12 +32,16 @@ RETURNS TABLE(
     error_message TEXT
 ) AS $$
 DECLARE 
-    target_conn_str TEXT := 'host=localhost port=5432 dbname=webui user=webui password=webui';
+    target_conn_str TEXT := COALESCE(sync_target_conn_override(),
+                                      'host=localhost port=5432 dbname=webui user=webui password=webui');
     user_record RECORD;
     user_id_mapped TEXT;
     display_name TEXT;
     user_role_mapped VARCHAR;
     team_alias_val VARCHAR;
+    source_version_val TEXT;
+    remote_statements TEXT[];
+    batch_error TEXT;
     migration_count INTEGER := 0;
     skipped_count INTEGER := 0;
     error_count INTEGER := 0;
@@ -93,14 +97,19 @@ BEGIN
                 );
             END IF;
             
+            batch_error := NULL;
+            
+            -- Version the pushed row so a live trigger with newer data always wins
+            source_version_val := sync_source_version(user_record.updated_at);
+            
             -- Map user roles  
             user_role_mapped := CASE 
                 WHEN user_record.user_role IN ('proxy_admin', 'proxy_admin_viewer') THEN 'admin'
                 ELSE 'user'
             END;
             
-            -- Sync to target database user table
-            PERFORM dblink_exec(target_conn_str, format('
+            -- User upsert and auth record go out as one remote transaction in one round trip
+            remote_statements := ARRAY[format('
                 INSERT INTO "user" (id, email, name, role, oauth_sub, settings, info, profile_image_url, last_active_at, created_at, updated_at)
                 VALUES (%L, %L, %L, %L, %L, %L, %L, %L, %L, %L, %L)
                 ON CONFLICT (id) DO UPDATE SET
@@ -108,9 +117,15 @@ BEGIN
                     name = EXCLUDED.name,
                     role = EXCLUDED.role,
                     oauth_sub = EXCLUDED.oauth_sub,
-                    settings = EXCLUDED.settings,
-                    info = EXCLUDED.info,
+                    -- Keep the pushed effective_models (see effective-models.sql)
+                    settings = (jsonb_strip_nulls(jsonb_build_object(''effective_models'', "user".settings::jsonb->''effective_models''))
+                                || EXCLUDED.settings::jsonb)::json,
+                    -- Keep the pushed usage summary (see usage-rollups.sql)
+                    info = (jsonb_strip_nulls(jsonb_build_object(''usage'', "user".info::jsonb->''usage''))
+                            || EXCLUDED.info::jsonb)::json,
                     updated_at = EXCLUDED.updated_at
+                WHERE ("user".info::jsonb->>''source_version'') IS NULL
+                   OR ("user".info::jsonb->>''source_version'') COLLATE "C" < (EXCLUDED.info::jsonb->>''source_version'')
             ', user_id_mapped, user_record.user_email, display_name, user_role_mapped, user_record.sso_user_id,
                json_build_object(
                    'max_budget', user_record.max_budget,
@@ -124,35 +139,44 @@ BEGIN
                    'organization_id', user_record.organization_id,
                    'team_id', user_record.team_id,
                    'original_user_id', user_record.user_id,
-                   'user_role', user_record.user_role
+                   'user_role', user_record.user_role,
+                   'source_version', source_version_val
                )::text,
                '/static/profile-user.png',
                EXTRACT(EPOCH FROM CURRENT_TIMESTAMP)::bigint,
                EXTRACT(EPOCH FROM user_record.created_at)::bigint, 
-               EXTRACT(EPOCH FROM COALESCE(user_record.updated_at, CURRENT_TIMESTAMP))::bigint));
-            
-            -- Create authentication record with email as initial password
-            PERFORM dblink_exec(target_conn_str, format('
+               EXTRACT(EPOCH FROM COALESCE(user_record.updated_at, CURRENT_TIMESTAMP))::bigint),
+               -- Create authentication record with email as initial password, only
+               -- when the user upsert above won (the row carries this version)
+               format('
                 INSERT INTO auth (id, email, password, active)
-                VALUES (%L, %L, crypt(%L, gen_salt(''bf'', 12)), true)
+                SELECT %L, %L, crypt(%L, gen_salt(''bf'', 12)), true
+                WHERE EXISTS (SELECT 1 FROM "user" WHERE id = %L AND info::jsonb->>''source_version'' = %L)
                 ON CONFLICT (id) DO UPDATE SET
                     email = EXCLUDED.email,
                     active = EXCLUDED.active
-            ', user_id_mapped, user_record.user_email, user_record.user_email));
+            ', user_id_mapped, user_record.user_email, user_record.user_email, user_id_mapped, source_version_val)];
+            
+            -- Any failed statement marks this user as failed (the auth step is skipped if the upsert failed)
+            SELECT r.error_message INTO batch_error
+            FROM sync_remote_batch(target_conn_str, remote_statements) r
+            WHERE NOT r.succeeded
+            ORDER BY r.stmt_index
+            LIMIT 1;
+            
+            IF batch_error IS NOT NULL THEN
+                RAISE EXCEPTION '%', batch_error;
+            END IF;
             
             -- Update mapping table
-            INSERT INTO sync_mapping (litellm_type, litellm_id, openwebui_type, openwebui_id, sync_data)
-            VALUES ('user', user_record.user_id, 'user', user_id_mapped, 
-                   json_build_object(
+            PERFORM sync_record_mapping('user', user_record.user_id, 'user', user_id_mapped,
+                   jsonb_build_object(
                        'display_name', display_name, 
                        'original_role', user_record.user_role,
                        'migrated_at', CURRENT_TIMESTAMP,
-                       'migration_type', 'batch_existing'
-                   ))
-            ON CONFLICT (litellm_type, litellm_id) 
-            DO UPDATE SET 
-                sync_data = EXCLUDED.sync_data,
-                updated_at = CURRENT_TIMESTAMP;
+                       'migration_type', 'batch_existing',
+                       'source_version', source_version_val
+                   ));
             
             -- Log success
             INSERT INTO sync_audit (operation, record_id, sync_result, new_data)
@@ -227,7 +251,8 @@ BEGIN
     RETURN QUERY SELECT 'Open WebUI Users (usr_ prefix)'::TEXT, 
                  (SELECT COUNT(*) FROM dblink('host=localhost port=5432 dbname=webui user=webui password=webui',
                                               'SELECT id FROM "user" WHERE id LIKE ''usr_%''') AS t(id TEXT));
-    RETURN QUERY SELECT 'Migration Operations'::TEXT, COUNT(*) FROM sync_audit WHERE operation LIKE 'MIGRATE_%';
+    RETURN QUERY SELECT 'Migration Operations'::TEXT, COUNT(*) FROM sync_audit
+                 WHERE operation IN ('MIGRATE_START', 'MIGRATE_USER', 'MIGRATE_WARNING', 'MIGRATE_COMPLETE');
 END;
 $$ LANGUAGE plpgsql;
 
@@ -242,11 +267,9 @@ RETURNS TABLE(
 ) AS $$
 BEGIN
     RETURN QUERY 
-    SELECT sa.operation::VARCHAR, sa.record_id::VARCHAR, sa.sync_result::VARCHAR, sa.error_message, sa.created_at
-    FROM sync_audit sa
-    WHERE sa.operation LIKE 'MIGRATE_%'
-    ORDER BY sa.created_at DESC
-    LIMIT limit_count;
+    SELECT q.operation::VARCHAR, q.record_id::VARCHAR, q.sync_result::VARCHAR, q.error_message, q.created_at
+    FROM query_sync_audit(ARRAY['MIGRATE_START', 'MIGRATE_USER', 'MIGRATE_WARNING', 'MIGRATE_COMPLETE'],
+                          p_limit := limit_count) q;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -0,0 +1,399 @@
+-- LiteLLM WebUI Bridge - Multi-Target Fan-out Extension
+-- Version: 1.3.0
+-- Compatible with: LiteLLM Latest + Open WebUI Latest
+--
+-- This script adds a registry of Open WebUI target databases (for example one
+-- per region) and a change log that captures every LiteLLM change once. The
+-- delivery engine (src/sync_delivery.py) pushes each captured change to all
+-- matching targets concurrently and tracks progress per target, so a slow or
+-- failed region never delays the others.
+--
+-- Each change is classified when captured. Deletes, role changes and
+-- organization moves go to a high-priority lane that delivery drains before
+-- anything else. Updates that only touch spend counters are marked bulk and can
+-- be rate-limited per target.
+--
+-- PREREQUISITE: Run litellm-webui-sync.sql first
+--
+-- BEFORE RUNNING:
+-- 1. Ensure basic user sync is working (run litellm-webui-sync.sql first)
+-- 2. Run this script on your LiteLLM database
+-- 3. Register each Open WebUI target with register_sync_target()
+
+-- =============================================================================
+-- TARGET REGISTRY AND CHANGE LOG TABLES
+-- =============================================================================
+
+-- Registry of Open WebUI target databases
+CREATE TABLE IF NOT EXISTS sync_target (
+    id SERIAL PRIMARY KEY,
+    target_name VARCHAR(64) NOT NULL UNIQUE,
+    conn_str TEXT NOT NULL,
+    organization_filter TEXT[],            -- NULL means every organization
+    enabled BOOLEAN NOT NULL DEFAULT true,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Every captured LiteLLM change, in insert order. Ids come from the sequence
+-- when the row is inserted, not when it commits, so a lower id can become
+-- visible after a higher one. Delivery only reads up to a visibility horizon
+-- (CaptureHorizon in src/sync_delivery.py) so such rows are never skipped.
+CREATE TABLE IF NOT EXISTS sync_change_log (
+    id BIGSERIAL PRIMARY KEY,
+    entity_type VARCHAR(20) NOT NULL,      -- organization / user / api_key
+    entity_id TEXT NOT NULL,
+    operation VARCHAR(10) NOT NULL,        -- UPSERT / DELETE
+    organization_id TEXT,
+    old_organization_id TEXT,              -- set when an UPDATE moved the row to another organization
+    source_version TEXT,                   -- see sync_source_version(); guards remote upserts
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Upgrade change logs created before source versioning
+ALTER TABLE sync_change_log ADD COLUMN IF NOT EXISTS source_version TEXT;
+
+-- Priority class, see classify_sync_change(): 0 = high, 1 = normal, 2 = bulk
+ALTER TABLE sync_change_log ADD COLUMN IF NOT EXISTS priority SMALLINT NOT NULL DEFAULT 1;
+
+-- The high lane reads only high-priority rows, and the main lane checks whether
+-- a later high-priority change for the same entity was already delivered
+CREATE INDEX IF NOT EXISTS idx_sync_change_log_high
+    ON sync_change_log (id) WHERE priority = 0;
+CREATE INDEX IF NOT EXISTS idx_sync_change_log_high_entity
+    ON sync_change_log (entity_type, entity_id, id) WHERE priority = 0;
+
+-- Delivery progress per target (high-water mark into sync_change_log)
+CREATE TABLE IF NOT EXISTS sync_target_progress (
+    target_name VARCHAR(64) PRIMARY KEY REFERENCES sync_target(target_name) ON DELETE CASCADE,
+    last_change_id BIGINT NOT NULL DEFAULT 0,
+    last_high_change_id BIGINT NOT NULL DEFAULT 0,  -- high lane position, may run ahead of last_change_id
+    delivered_count BIGINT NOT NULL DEFAULT 0,
+    failed_attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    last_delivered_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Upgrade progress tables created before priority lanes
+ALTER TABLE sync_target_progress ADD COLUMN IF NOT EXISTS last_high_change_id BIGINT NOT NULL DEFAULT 0;
+
+-- =============================================================================
+-- CHANGE CAPTURE
+-- =============================================================================
+
+-- Function to classify a captured change into a delivery priority
+--   0 (high):   deletes, user role changes (e.g. proxy_admin -> user) and
+--               organization moves; these revoke access in Open WebUI
+--   2 (bulk):   updates that only touch spend counters and timestamps
+--   1 (normal): everything else
+CREATE OR REPLACE FUNCTION classify_sync_change(
+    p_entity_type TEXT,
+    p_operation TEXT,
+    p_row JSONB,
+    p_old_row JSONB
+)
+RETURNS SMALLINT AS $$
+DECLARE
+    bulk_columns TEXT[] := ARRAY['spend', 'model_spend', 'budget_reset_at', 'last_active', 'updated_at'];
+BEGIN
+    IF p_operation = 'DELETE' THEN
+        RETURN 0;
+    END IF;
+
+    IF p_old_row IS NULL THEN
+        RETURN 1;
+    END IF;
+
+    IF p_entity_type = 'user'
+       AND (p_row->>'user_role' IS DISTINCT FROM p_old_row->>'user_role'
+            OR p_row->>'organization_id' IS DISTINCT FROM p_old_row->>'organization_id') THEN
+        RETURN 0;
+    END IF;
+
+    IF (p_row - bulk_columns) = (p_old_row - bulk_columns) THEN
+        RETURN 2;
+    END IF;
+
+    RETURN 1;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- Function to capture organization, user and API key changes into the change log
+CREATE OR REPLACE FUNCTION capture_sync_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    row_data JSONB;
+    old_row_data JSONB;
+    entity_type_val VARCHAR(20);
+    entity_id_val TEXT;
+    org_id_val TEXT;
+    old_org_id_val TEXT;
+BEGIN
+    -- Changes written by reverse_sync_openwebui_activity() are not pushed back
+    IF TG_OP = 'UPDATE' AND TG_TABLE_NAME = 'LiteLLM_UserTable' THEN
+        IF OLD.metadata IS DISTINCT FROM NEW.metadata
+           AND sync_is_reverse_only_update(to_jsonb(OLD), to_jsonb(NEW)) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        row_data := to_jsonb(OLD);
+    ELSE
+        row_data := to_jsonb(NEW);
+        IF TG_OP = 'UPDATE' THEN
+            old_row_data := to_jsonb(OLD);
+        END IF;
+    END IF;
+
+    IF TG_TABLE_NAME = 'LiteLLM_OrganizationTable' THEN
+        entity_type_val := 'organization';
+        entity_id_val := row_data->>'organization_id';
+        org_id_val := entity_id_val;
+    ELSIF TG_TABLE_NAME = 'LiteLLM_UserTable' THEN
+        entity_type_val := 'user';
+        entity_id_val := row_data->>'user_id';
+        org_id_val := row_data->>'organization_id';
+        old_org_id_val := old_row_data->>'organization_id';
+    ELSE
+        entity_type_val := 'api_key';
+        entity_id_val := row_data->>'token';
+        -- Keys inherit the organization of their owner for target filtering
+        SELECT u.organization_id INTO org_id_val
+        FROM "LiteLLM_UserTable" u
+        WHERE u.user_id = row_data->>'user_id';
+    END IF;
+
+    INSERT INTO sync_change_log (entity_type, entity_id, operation, organization_id, old_organization_id,
+                                 source_version, priority, payload)
+    VALUES (entity_type_val, entity_id_val,
+            CASE WHEN TG_OP = 'DELETE' THEN 'DELETE' ELSE 'UPSERT' END,
+            org_id_val,
+            CASE WHEN old_org_id_val IS DISTINCT FROM org_id_val THEN old_org_id_val END,
+            sync_source_version((row_data->>'updated_at')::timestamp),
+            classify_sync_change(entity_type_val, TG_OP, row_data, old_row_data),
+            row_data);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================================================
+-- TRIGGERS
+-- =============================================================================
+
+DROP TRIGGER IF EXISTS organization_capture_trigger ON "LiteLLM_OrganizationTable";
+CREATE TRIGGER organization_capture_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON "LiteLLM_OrganizationTable"
+    FOR EACH ROW EXECUTE FUNCTION capture_sync_change();
+
+DROP TRIGGER IF EXISTS user_capture_trigger ON "LiteLLM_UserTable";
+CREATE TRIGGER user_capture_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON "LiteLLM_UserTable"
+    FOR EACH ROW EXECUTE FUNCTION capture_sync_change();
+
+-- Only keys that belong to a user are synced (skip system tokens)
+DROP TRIGGER IF EXISTS api_key_capture_trigger ON "LiteLLM_VerificationToken";
+CREATE TRIGGER api_key_capture_trigger
+    AFTER INSERT OR UPDATE ON "LiteLLM_VerificationToken"
+    FOR EACH ROW
+    WHEN (NEW.user_id IS NOT NULL AND NEW.user_id != '')
+    EXECUTE FUNCTION capture_sync_change();
+
+DROP TRIGGER IF EXISTS api_key_delete_capture_trigger ON "LiteLLM_VerificationToken";
+CREATE TRIGGER api_key_delete_capture_trigger
+    AFTER DELETE ON "LiteLLM_VerificationToken"
+    FOR EACH ROW
+    WHEN (OLD.user_id IS NOT NULL AND OLD.user_id != '')
+    EXECUTE FUNCTION capture_sync_change();
+
+-- =============================================================================
+-- LOOKUP CACHE INVALIDATION
+-- =============================================================================
+
+-- Function to tell delivery engines that a cached team changed (see
+-- src/lookup_cache.py). Only columns the delivery path reads trigger it, so
+-- frequent spend updates do not flush the cache. Organizations are not cached:
+-- delivery takes their attributes from the captured row.
+CREATE OR REPLACE FUNCTION notify_lookup_invalidation()
+RETURNS TRIGGER AS $$
+DECLARE
+    kind_val TEXT := 'team';
+    id_column TEXT := 'team_id';
+    changed_ids TEXT[];
+    changed_id TEXT;
+BEGIN
+    -- An UPDATE that changes the id invalidates both the old and the new id
+    IF TG_OP = 'INSERT' THEN
+        changed_ids := ARRAY[to_jsonb(NEW)->>id_column];
+    ELSIF TG_OP = 'DELETE' THEN
+        changed_ids := ARRAY[to_jsonb(OLD)->>id_column];
+    ELSE
+        changed_ids := ARRAY(SELECT DISTINCT unnest(ARRAY[to_jsonb(OLD)->>id_column, to_jsonb(NEW)->>id_column]));
+    END IF;
+
+    FOREACH changed_id IN ARRAY changed_ids LOOP
+        PERFORM pg_notify('bridge_lookup_invalidate',
+                          json_build_object('kind', kind_val, 'id', changed_id)::text);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS team_lookup_invalidate_trigger ON "LiteLLM_TeamTable";
+CREATE TRIGGER team_lookup_invalidate_trigger
+    AFTER INSERT OR DELETE ON "LiteLLM_TeamTable"
+    FOR EACH ROW EXECUTE FUNCTION notify_lookup_invalidation();
+
+DROP TRIGGER IF EXISTS team_lookup_update_invalidate_trigger ON "LiteLLM_TeamTable";
+CREATE TRIGGER team_lookup_update_invalidate_trigger
+    AFTER UPDATE ON "LiteLLM_TeamTable"
+    FOR EACH ROW
+    WHEN (OLD.team_alias IS DISTINCT FROM NEW.team_alias
+          OR OLD.team_id IS DISTINCT FROM NEW.team_id)
+    EXECUTE FUNCTION notify_lookup_invalidation();
+
+-- Earlier versions also cached organizations; nothing reads that lookup
+DROP TRIGGER IF EXISTS organization_lookup_invalidate_trigger ON "LiteLLM_OrganizationTable";
+DROP TRIGGER IF EXISTS organization_lookup_update_invalidate_trigger ON "LiteLLM_OrganizationTable";
+
+-- =============================================================================
+-- TARGET MANAGEMENT AND MONITORING FUNCTIONS
+-- =============================================================================
+
+-- Function to register (or update) an Open WebUI target
+-- New targets start at the current end of the change log; backfill them separately.
+CREATE OR REPLACE FUNCTION register_sync_target(
+    p_target_name TEXT,
+    p_conn_str TEXT,
+    p_organization_filter TEXT[] DEFAULT NULL,
+    p_enabled BOOLEAN DEFAULT true
+)
+RETURNS TEXT AS $$
+BEGIN
+    INSERT INTO sync_target (target_name, conn_str, organization_filter, enabled)
+    VALUES (p_target_name, p_conn_str, p_organization_filter, p_enabled)
+    ON CONFLICT (target_name) DO UPDATE SET
+        conn_str = EXCLUDED.conn_str,
+        organization_filter = EXCLUDED.organization_filter,
+        enabled = EXCLUDED.enabled,
+        updated_at = CURRENT_TIMESTAMP;
+
+    INSERT INTO sync_target_progress (target_name, last_change_id)
+    VALUES (p_target_name, COALESCE((SELECT MAX(id) FROM sync_change_log), 0))
+    ON CONFLICT (target_name) DO NOTHING;
+
+    INSERT INTO sync_audit (operation, record_id, sync_result, new_data)
+    VALUES ('REGISTER_TARGET', p_target_name, 'SUCCESS',
+            json_build_object('organization_filter', p_organization_filter, 'enabled', p_enabled));
+
+    RETURN p_target_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to check delivery progress of every target
+-- (dropped first because priority lanes added output columns)
+DROP FUNCTION IF EXISTS check_sync_target_status();
+CREATE OR REPLACE FUNCTION check_sync_target_status()
+RETURNS TABLE(
+    target_name TEXT,
+    enabled BOOLEAN,
+    last_change_id BIGINT,
+    pending_changes BIGINT,
+    pending_high_changes BIGINT,
+    oldest_pending_high TIMESTAMP,
+    delivered_count BIGINT,
+    failed_attempts INTEGER,
+    last_error TEXT,
+    last_delivered_at TIMESTAMP
+) AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        t.target_name::TEXT,
+        t.enabled,
+        p.last_change_id,
+        (SELECT COUNT(*) FROM sync_change_log cl WHERE cl.id > p.last_change_id) AS pending_changes,
+        h.pending_high_changes,
+        h.oldest_pending_high,
+        p.delivered_count,
+        p.failed_attempts,
+        p.last_error,
+        p.last_delivered_at
+    FROM sync_target t
+    JOIN sync_target_progress p ON p.target_name = t.target_name
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) AS pending_high_changes, MIN(cl.created_at) AS oldest_pending_high
+        FROM sync_change_log cl
+        WHERE cl.priority = 0 AND cl.id > GREATEST(p.last_change_id, p.last_high_change_id)
+    ) h
+    ORDER BY t.target_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to remove change log rows already delivered to every enabled target
+CREATE OR REPLACE FUNCTION prune_sync_change_log()
+RETURNS BIGINT AS $$
+DECLARE
+    safe_id BIGINT;
+    deleted_count BIGINT;
+BEGIN
+    SELECT MIN(p.last_change_id) INTO safe_id
+    FROM sync_target_progress p
+    JOIN sync_target t ON t.target_name = p.target_name
+    WHERE t.enabled;
+
+    IF safe_id IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    DELETE FROM sync_change_log WHERE id <= safe_id;
+    GET DIAGNOSTICS deleted_count = ROW_COUNT;
+
+    RETURN deleted_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to run sweep_sync_orphans() against every enabled registered target
+-- with that target's organization filter. A target that cannot be reached is
+-- recorded as FAILED in sync_audit and skipped; the others are still swept.
+CREATE OR REPLACE FUNCTION sweep_sync_target_orphans(dry_run BOOLEAN DEFAULT true, batch_size INTEGER DEFAULT 500)
+RETURNS TABLE(target_name TEXT, orphan_type TEXT, orphan_count INTEGER, removed_count INTEGER) AS $$
+DECLARE
+    target RECORD;
+BEGIN
+    FOR target IN
+        SELECT t.target_name, t.conn_str, t.organization_filter
+        FROM sync_target t
+        WHERE t.enabled
+        ORDER BY t.target_name
+    LOOP
+        BEGIN
+            RETURN QUERY
+            SELECT target.target_name::TEXT, s.orphan_type, s.orphan_count, s.removed_count
+            FROM sweep_sync_orphans(dry_run, batch_size, target.conn_str, target.organization_filter) s;
+        EXCEPTION WHEN OTHERS THEN
+            INSERT INTO sync_audit (operation, record_id, sync_result, error_message)
+            VALUES ('SWEEP_ORPHANS', target.target_name, 'FAILED', SQLERRM);
+        END;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================================================
+-- INSTALLATION COMPLETE
+-- =============================================================================
+
+INSERT INTO sync_audit (operation, record_id, sync_result, new_data)
+VALUES ('INSTALL', 'multi-target-sync', 'SUCCESS',
+        json_build_object('version', '1.3.0', 'installed_at', CURRENT_TIMESTAMP));
+
+SELECT 'LiteLLM WebUI Multi-Target Extension Installed!' AS message;
+SELECT 'Next Steps:' AS info;
+SELECT '1. Register targets: SELECT register_sync_target(''eu'', ''host=... dbname=webui ...'', ARRAY[''org_eu'']);' AS step1;
+SELECT '2. Start delivery: python src/sync_delivery.py' AS step2;
+SELECT '3. Monitor with: SELECT * FROM check_sync_target_status();' AS step3;
+SELECT '4. Optional: rate-limit bulk spend updates: python src/sync_delivery.py --bulk-rate 200' AS step4;
+SELECT '5. Find orphans on every target with: SELECT * FROM sweep_sync_target_orphans(dry_run := true);' AS step5;
@@ -0,0 +1,30 @@
+-- LiteLLM WebUI Bridge - Audit Notifications for the Test Harness
+-- Version: 1.0.0
+--
+-- TEST DATABASES ONLY. Announces every sync_audit row on the
+-- bridge_sync_audit channel so src/sync_waiter.py can wake up as soon as a
+-- sync step finishes instead of polling. NOTIFY takes a global queue lock at
+-- commit, which serializes every audited write; never install this on a
+-- production LiteLLM database.
+--
+-- src/real_experiment_runner.py installs it after setup and removes it at the
+-- end of the run (install_audit_notify() / remove_audit_notify() in
+-- src/sync_waiter.py). Without it the waiter falls back to polling.
+
+CREATE OR REPLACE FUNCTION notify_sync_audit()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('bridge_sync_audit', json_build_object(
+        'id', NEW.id,
+        'operation', NEW.operation,
+        'record_id', NEW.record_id,
+        'sync_result', NEW.sync_result
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS sync_audit_notify_trigger ON sync_audit;
+CREATE TRIGGER sync_audit_notify_trigger
+    AFTER INSERT ON sync_audit
+    FOR EACH ROW EXECUTE FUNCTION notify_sync_audit();
@@ -0,0 +1,384 @@
+-- LiteLLM WebUI Bridge - Usage Rollups Extension
+-- Version: 1.4.0
+-- Compatible with: LiteLLM Latest + Open WebUI Latest
+--
+-- Keeps hourly and daily spend / token rollups per user and model, built
+-- incrementally from "LiteLLM_SpendLogs", and pushes a per-user summary to
+-- "user".info->'usage' in Open WebUI in batches.
+--
+-- Spend logs have no sequential id, so progress is a keyset high-water mark
+-- on ("endTime", request_id). A row is written only after its request ends,
+-- so keying on "startTime" would leave long requests behind the mark for good.
+-- LiteLLM also buffers spend logs and writes them in batches, so a row can
+-- still land after rows with a later "endTime". Each run therefore only
+-- consumes rows that ended before a grace period; it must be longer than
+-- LiteLLM's spend-log flush interval (the default of 10 minutes is well above
+-- it). Each run reads only the new rows through an ("endTime", request_id)
+-- index and never rescans the log. Rows are still bucketed by "startTime".
+--
+-- PREREQUISITE: Run litellm-webui-sync.sql first
+--
+-- BEFORE RUNNING:
+-- 1. Ensure basic user sync is working (run litellm-webui-sync.sql first)
+-- 2. Run this script on your LiteLLM database
+-- 3. Schedule SELECT rollup_spend_logs(); and SELECT push_usage_rollups();
+--    (for example with pg_cron every 5 minutes)
+
+-- =============================================================================
+-- ROLLUP TABLES
+-- =============================================================================
+
+CREATE TABLE IF NOT EXISTS sync_usage_hourly (
+    user_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    bucket TIMESTAMP NOT NULL,             -- start of the hour
+    requests BIGINT NOT NULL DEFAULT 0,
+    spend DOUBLE PRECISION NOT NULL DEFAULT 0,
+    prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    completion_tokens BIGINT NOT NULL DEFAULT 0,
+    total_tokens BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, bucket, model)
+);
+
+CREATE TABLE IF NOT EXISTS sync_usage_daily (
+    user_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    bucket DATE NOT NULL,
+    requests BIGINT NOT NULL DEFAULT 0,
+    spend DOUBLE PRECISION NOT NULL DEFAULT 0,
+    prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    completion_tokens BIGINT NOT NULL DEFAULT 0,
+    total_tokens BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, bucket, model)
+);
+
+-- Position in "LiteLLM_SpendLogs" (single row)
+CREATE TABLE IF NOT EXISTS sync_usage_state (
+    source_name TEXT PRIMARY KEY,
+    high_water_time TIMESTAMP NOT NULL DEFAULT '-infinity',
+    high_water_request_id TEXT NOT NULL DEFAULT '',
+    rows_applied BIGINT NOT NULL DEFAULT 0,
+    last_run_at TIMESTAMP
+);
+
+-- Hour up to which aged summaries were re-queued (row 'usage_push', see push_usage_rollups)
+ALTER TABLE sync_usage_state ADD COLUMN IF NOT EXISTS aged_through TIMESTAMP;
+
+INSERT INTO sync_usage_state (source_name) VALUES ('spend_logs') ON CONFLICT DO NOTHING;
+INSERT INTO sync_usage_state (source_name) VALUES ('usage_push') ON CONFLICT DO NOTHING;
+
+-- Users whose rollups changed since their last push
+CREATE TABLE IF NOT EXISTS sync_usage_pending (
+    user_id TEXT PRIMARY KEY,
+    marked_at TIMESTAMP NOT NULL DEFAULT clock_timestamp()
+);
+
+-- Buckets leaving the summary window, for re-queueing aged summaries
+CREATE INDEX IF NOT EXISTS idx_sync_usage_hourly_bucket ON sync_usage_hourly (bucket);
+CREATE INDEX IF NOT EXISTS idx_sync_usage_daily_bucket ON sync_usage_daily (bucket);
+
+-- Keyset scan of new spend logs. LiteLLM only indexes "startTime"; the index is
+-- additive and safe for its migrations.
+CREATE INDEX IF NOT EXISTS idx_bridge_spend_logs_end_time
+    ON "LiteLLM_SpendLogs" ("endTime", request_id);
+
+-- =============================================================================
+-- INCREMENTAL ROLLUP
+-- =============================================================================
+
+-- Function to fold spend-log rows past the high-water mark into the rollups.
+-- Each batch is one statement: read the next batch_size rows in keyset order,
+-- add them to the hourly and daily buckets, mark their users for push and
+-- advance the high-water mark. Rows without a user still advance it.
+-- Returns the number of spend-log rows consumed.
+CREATE OR REPLACE FUNCTION rollup_spend_logs(
+    batch_size INTEGER DEFAULT 10000,
+    grace INTERVAL DEFAULT '10 minutes'
+)
+RETURNS BIGINT AS $$
+DECLARE
+    cutoff TIMESTAMP := LOCALTIMESTAMP - grace;
+    state_row sync_usage_state%ROWTYPE;
+    batch_rows INTEGER;
+    last_time TIMESTAMP;
+    last_request_id TEXT;
+    consumed BIGINT := 0;
+BEGIN
+    -- Serializes concurrent runs
+    SELECT * INTO state_row FROM sync_usage_state WHERE source_name = 'spend_logs' FOR UPDATE;
+
+    LOOP
+        WITH batch AS MATERIALIZED (
+            SELECT s.request_id,
+                   s."startTime" AS started_at,
+                   s."endTime" AS ended_at,
+                   NULLIF(s."user", '') AS user_id,
+                   COALESCE(NULLIF(s.model, ''), 'unknown') AS model,
+                   COALESCE(s.spend, 0) AS spend,
+                   COALESCE(s.prompt_tokens, 0) AS prompt_tokens,
+                   COALESCE(s.completion_tokens, 0) AS completion_tokens,
+                   COALESCE(s.total_tokens, 0) AS total_tokens
+            FROM "LiteLLM_SpendLogs" s
+            WHERE s."endTime" >= state_row.high_water_time
+              AND (s."endTime", s.request_id) > (state_row.high_water_time, state_row.high_water_request_id)
+              AND s."endTime" < cutoff
+            ORDER BY s."endTime", s.request_id
+            LIMIT batch_size
+        ),
+        hourly AS (
+            INSERT INTO sync_usage_hourly AS h
+                (user_id, model, bucket, requests, spend, prompt_tokens, completion_tokens, total_tokens)
+            SELECT user_id, model, date_trunc('hour', started_at), COUNT(*), SUM(spend),
+                   SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens)
+            FROM batch
+            WHERE user_id IS NOT NULL
+            GROUP BY 1, 2, 3
+            ON CONFLICT (user_id, bucket, model) DO UPDATE SET
+                requests = h.requests + EXCLUDED.requests,
+                spend = h.spend + EXCLUDED.spend,
+                prompt_tokens = h.prompt_tokens + EXCLUDED.prompt_tokens,
+                completion_tokens = h.completion_tokens + EXCLUDED.completion_tokens,
+                total_tokens = h.total_tokens + EXCLUDED.total_tokens
+        ),
+        daily AS (
+            INSERT INTO sync_usage_daily AS d
+                (user_id, model, bucket, requests, spend, prompt_tokens, completion_tokens, total_tokens)
+            SELECT user_id, model, started_at::date, COUNT(*), SUM(spend),
+                   SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens)
+            FROM batch
+            WHERE user_id IS NOT NULL
+            GROUP BY 1, 2, 3
+            ON CONFLICT (user_id, bucket, model) DO UPDATE SET
+                requests = d.requests + EXCLUDED.requests,
+                spend = d.spend + EXCLUDED.spend,
+                prompt_tokens = d.prompt_tokens + EXCLUDED.prompt_tokens,
+                completion_tokens = d.completion_tokens + EXCLUDED.completion_tokens,
+                total_tokens = d.total_tokens + EXCLUDED.total_tokens
+        ),
+        pending AS (
+            INSERT INTO sync_usage_pending (user_id)
+            SELECT DISTINCT user_id FROM batch WHERE user_id IS NOT NULL
+            -- DO UPDATE waits for a push that holds the row, so the mark is never lost
+            ON CONFLICT (user_id) DO UPDATE SET marked_at = EXCLUDED.marked_at
+        )
+        SELECT COUNT(*)::INTEGER,
+               (array_agg(ended_at ORDER BY ended_at DESC, request_id DESC))[1],
+               (array_agg(request_id ORDER BY ended_at DESC, request_id DESC))[1]
+        INTO batch_rows, last_time, last_request_id
+        FROM batch;
+
+        EXIT WHEN batch_rows = 0;
+
+        state_row.high_water_time := last_time;
+        state_row.high_water_request_id := last_request_id;
+        consumed := consumed + batch_rows;
+
+        EXIT WHEN batch_rows < batch_size;
+    END LOOP;
+
+    UPDATE sync_usage_state SET
+        high_water_time = state_row.high_water_time,
+        high_water_request_id = state_row.high_water_request_id,
+        rows_applied = rows_applied + consumed,
+        last_run_at = clock_timestamp()
+    WHERE source_name = 'spend_logs';
+
+    IF consumed > 0 THEN
+        INSERT INTO sync_audit (operation, record_id, sync_result, new_data)
+        VALUES ('ROLLUP_USAGE', 'spend_logs', 'SUCCESS',
+                json_build_object('rows', consumed, 'high_water_time', state_row.high_water_time)::jsonb);
+    END IF;
+
+    RETURN consumed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================================================
+-- BATCHED PUSH TO OPEN WEBUI
+-- =============================================================================
+
+-- Function to build the usage summary stored in "user".info->'usage'
+CREATE OR REPLACE FUNCTION build_usage_summary(p_user_id TEXT, p_days INTEGER DEFAULT 30)
+RETURNS JSONB AS $$
+DECLARE
+    since_day DATE := CURRENT_DATE - (p_days - 1);
+BEGIN
+    RETURN jsonb_build_object(
+        'as_of', (SELECT high_water_time FROM sync_usage_state WHERE source_name = 'spend_logs'),
+        'last_24h', (
+            SELECT jsonb_build_object('requests', COALESCE(SUM(requests), 0),
+                                      'spend', COALESCE(SUM(spend), 0),
+                                      'total_tokens', COALESCE(SUM(total_tokens), 0))
+            FROM sync_usage_hourly
+            WHERE user_id = p_user_id AND bucket >= date_trunc('hour', LOCALTIMESTAMP) - INTERVAL '23 hours'
+        ),
+        'days', p_days,
+        'daily', (
+            SELECT COALESCE(jsonb_agg(jsonb_build_object('date', bucket, 'requests', requests, 'spend', spend,
+                                                         'total_tokens', total_tokens) ORDER BY bucket), '[]')
+            FROM (
+                SELECT bucket, SUM(requests) AS requests, SUM(spend) AS spend, SUM(total_tokens) AS total_tokens
+                FROM sync_usage_daily
+                WHERE user_id = p_user_id AND bucket >= since_day
+                GROUP BY bucket
+            ) days
+        ),
+        'models', (
+            SELECT COALESCE(jsonb_object_agg(model, jsonb_build_object('requests', requests, 'spend', spend,
+                                                                       'prompt_tokens', prompt_tokens,
+                                                                       'completion_tokens', completion_tokens)), '{}')
+            FROM (
+                SELECT model, SUM(requests) AS requests, SUM(spend) AS spend,
+                       SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens
+                FROM sync_usage_daily
+                WHERE user_id = p_user_id AND bucket >= since_day
+                GROUP BY model
+            ) models
+        )
+    );
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Function to re-queue users whose pushed summary aged without new usage.
+-- The summary is relative to the current hour (last_24h) and day (daily
+-- window), so when those boundaries pass, users with an hourly or daily bucket
+-- that just left the window are marked again. Returns the number of users marked.
+CREATE OR REPLACE FUNCTION requeue_aged_usage(days INTEGER DEFAULT 30)
+RETURNS INTEGER AS $$
+DECLARE
+    current_hour TIMESTAMP := date_trunc('hour', LOCALTIMESTAMP);
+    previous_hour TIMESTAMP;
+    marked INTEGER := 0;
+BEGIN
+    -- Serializes concurrent pushes without waiting on rollup_spend_logs()
+    SELECT aged_through INTO previous_hour FROM sync_usage_state WHERE source_name = 'usage_push' FOR UPDATE;
+
+    IF previous_hour IS NOT NULL AND current_hour > previous_hour THEN
+        INSERT INTO sync_usage_pending (user_id)
+        SELECT h.user_id FROM sync_usage_hourly h
+        WHERE h.bucket >= previous_hour - INTERVAL '23 hours'
+          AND h.bucket < current_hour - INTERVAL '23 hours'
+        UNION
+        SELECT d.user_id FROM sync_usage_daily d
+        WHERE d.bucket >= previous_hour::date - (days - 1)
+          AND d.bucket < current_hour::date - (days - 1)
+        ON CONFLICT (user_id) DO NOTHING;
+        GET DIAGNOSTICS marked = ROW_COUNT;
+    END IF;
+
+    UPDATE sync_usage_state SET aged_through = current_hour WHERE source_name = 'usage_push';
+    RETURN marked;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to push the summaries of users with new or aged usage to Open WebUI.
+-- Each batch is one remote UPDATE ... FROM (VALUES ...) statement. A failed
+-- batch stays pending and is retried on the next call. Only users the remote
+-- UPDATE matched (RETURNING id) are cleared; a LiteLLM user that is not in
+-- Open WebUI yet stays pending, and pending rows for users no longer in
+-- LiteLLM are dropped. Each call walks the pending rows once in user_id
+-- order. Returns the number of users pushed.
+CREATE OR REPLACE FUNCTION push_usage_rollups(batch_size INTEGER DEFAULT 500, days INTEGER DEFAULT 30)
+RETURNS INTEGER AS $$
+DECLARE
+    target_conn_str TEXT := COALESCE(sync_target_conn_override(),
+                                      'host=localhost port=5432 dbname=webui user=webui password=webui');
+    batch_user_ids TEXT[];
+    batch_values TEXT;
+    pushed_ids TEXT[];
+    last_user_id TEXT := '';
+    pushed_total INTEGER := 0;
+BEGIN
+    PERFORM requeue_aged_usage(days);
+
+    LOOP
+        SELECT array_agg(b.user_id),
+               string_agg(format('(%L, %L::jsonb)', 'usr_' || b.user_id, build_usage_summary(b.user_id, days)::text),
+                          ', ')
+        INTO batch_user_ids, batch_values
+        FROM (
+            SELECT p.user_id
+            FROM sync_usage_pending p
+            WHERE p.user_id > last_user_id
+            ORDER BY p.user_id
+            LIMIT batch_size
+            FOR UPDATE SKIP LOCKED
+        ) b;
+
+        EXIT WHEN batch_user_ids IS NULL;
+        SELECT MAX(b) INTO last_user_id FROM unnest(batch_user_ids) AS b;
+
+        BEGIN
+            -- Only info->'usage' changes; updated_at and the source_version guard are untouched
+            SELECT COALESCE(array_agg(substr(r.id, 5)), '{}') INTO pushed_ids
+            FROM dblink(target_conn_str, format('
+                UPDATE "user" u SET
+                    info = (COALESCE(u.info::jsonb, ''{}''::jsonb) || jsonb_build_object(''usage'', v.usage))::json
+                FROM (VALUES %s) AS v(id, usage)
+                WHERE u.id = v.id
+                RETURNING u.id
+            ', batch_values)) AS r(id TEXT);
+        EXCEPTION WHEN OTHERS THEN
+            INSERT INTO sync_audit (operation, record_id, sync_result, error_message, new_data)
+            VALUES ('PUSH_USAGE', 'usage_rollups', 'FAILED', SQLERRM,
+                    json_build_object('users', cardinality(batch_user_ids))::jsonb);
+            RETURN pushed_total;
+        END;
+
+        DELETE FROM sync_usage_pending p
+        WHERE p.user_id = ANY(batch_user_ids)
+          AND (p.user_id = ANY(pushed_ids)
+               OR NOT EXISTS (SELECT 1 FROM "LiteLLM_UserTable" u WHERE u.user_id = p.user_id));
+
+        INSERT INTO sync_audit (operation, record_id, sync_result, new_data)
+        VALUES ('PUSH_USAGE', 'usage_rollups', 'SUCCESS',
+                json_build_object('users', cardinality(pushed_ids),
+                                  'not_in_target', cardinality(batch_user_ids) - cardinality(pushed_ids))::jsonb);
+
+        pushed_total := pushed_total + cardinality(pushed_ids);
+    END LOOP;
+
+    RETURN pushed_total;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to drop hourly buckets older than the retention window (daily
+-- buckets are small and kept). Returns the number of rows removed.
+CREATE OR REPLACE FUNCTION prune_usage_rollups(hourly_retention INTERVAL DEFAULT '7 days')
+RETURNS INTEGER AS $$
+DECLARE
+    removed INTEGER;
+BEGIN
+    DELETE FROM sync_usage_hourly WHERE bucket < date_trunc('hour', LOCALTIMESTAMP - hourly_retention);
+    GET DIAGNOSTICS removed = ROW_COUNT;
+    RETURN removed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to check usage rollup status
+CREATE OR REPLACE FUNCTION check_usage_rollups_status()
+RETURNS TABLE(metric TEXT, value TEXT) AS $$
+BEGIN
+    RETURN QUERY SELECT 'High-Water Mark', high_water_time::TEXT FROM sync_usage_state WHERE source_name = 'spend_logs';
+    RETURN QUERY SELECT 'Rows Applied', rows_applied::TEXT FROM sync_usage_state WHERE source_name = 'spend_logs';
+    RETURN QUERY SELECT 'Last Rollup', COALESCE(last_run_at::TEXT, 'never') FROM sync_usage_state
+                 WHERE source_name = 'spend_logs';
+    RETURN QUERY SELECT 'Hourly Buckets', COUNT(*)::TEXT FROM sync_usage_hourly;
+    RETURN QUERY SELECT 'Daily Buckets', COUNT(*)::TEXT FROM sync_usage_daily;
+    RETURN QUERY SELECT 'Pending Push', COUNT(*)::TEXT FROM sync_usage_pending;
+END;
+$$ LANGUAGE plpgsql;
+
+-- =============================================================================
+-- INSTALLATION
+-- =============================================================================
+
+INSERT INTO sync_audit (operation, record_id, sync_result, new_data)
+VALUES ('INSTALL', 'usage-rollups', 'SUCCESS',
+        json_build_object('version', '1.4.0', 'installed_at', CURRENT_TIMESTAMP));
+
+SELECT 'LiteLLM WebUI Usage Rollups Extension Installed!' AS message;
+SELECT 'Next Steps:' AS info;
+SELECT '1. Build the initial rollups: SELECT rollup_spend_logs();' AS step1;
+SELECT '2. Schedule rollup_spend_logs() and push_usage_rollups() to run periodically' AS step2;
+SELECT '3. Monitor with: SELECT * FROM check_usage_rollups_status();' AS step3;
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+异步投递引擎 - 基于 psycopg2 异步连接模式，在少量连接上保持多个流水线批次同时在途
+
+与 sync_delivery.py 的线程引擎语义一致（路由、语句构建、版本守卫、审计、进度表都复用），
+区别在于等待网络往返时不占用线程：
+- 每个目标库把变更按实体键哈希分配到 N 条车道（lane），车道内严格按变更顺序执行
+- 车道共享一个小连接池，每个子批次用一次往返发送（见 remote_batch.py）
+- 车道队列有界，生产者在目标库跟不上时自动阻塞（背压）
+- 投递进度只推进到连续完成的批次，重启后从未确认的位置重放（upsert 带版本守卫，可安全重放）
+"""
+
+import psycopg2
+import psycopg2.extensions
+import sys
+import argparse
+import asyncio
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from lookup_cache import LookupCache
+from partitioned_delivery import partition_key, partition_of
+from remote_batch import build_pipeline_script, parse_failures
+from sync_delivery import (
+    SOURCE_DSN, DEFAULT_BATCH_SIZE, DEFAULT_POLL_INTERVAL, MAX_RETRY_DELAY,
+    CaptureHorizon, load_targets, fetch_changes, route_change, resolve_team_aliases, build_statements, record_progress,
+)
+
+DEFAULT_LANES = 8
+DEFAULT_POOL_SIZE = 4
+DEFAULT_QUEUE_DEPTH = 4
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+async def wait_ready(conn):
+    """等待异步连接完成当前操作（用事件循环监听套接字，而不是阻塞线程）"""
+    loop = asyncio.get_running_loop()
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+
+        ready = loop.create_future()
+        wake = functools.partial(_wake, ready)
+        fd = conn.fileno()
+        if state == psycopg2.extensions.POLL_READ:
+            loop.add_reader(fd, wake)
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            loop.add_writer(fd, wake)
+            try:
+                await ready
+            finally:
+                loop.remove_writer(fd)
+        else:
+            raise psycopg2.OperationalError(f"poll() 返回未知状态: {state}")
+
+
+async def async_connect(dsn):
+    """建立异步模式连接"""
+    conn = psycopg2.connect(dsn, async_=True)
+    await wait_ready(conn)
+    return conn
+
+
+async def execute_pipelined_async(conn, grouped_statements):
+    """
+    execute_pipelined() 的异步版本
+
+    异步连接始终处于自动提交模式，多语句脚本在一个隐式事务中执行，语义与同步版本相同。
+    返回 {group_index: error_message}；连接级错误直接抛出。
+    """
+    cursor = conn.cursor()
+    try:
+        script, count = build_pipeline_script(cursor, grouped_statements)
+        if count == 0:
+            return {}
+        cursor.execute(script)
+        await wait_ready(conn)
+        return parse_failures(cursor.fetchone()[0])
+    finally:
+        cursor.close()
+
+
+class AsyncConnectionPool:
+    """固定槽位的异步连接池：槽位数即目标库上同时在途的往返数上限，连接按需建立、损坏后丢弃"""
+
+    def __init__(self, dsn, size):
+        self.dsn = dsn
+        self.slots = asyncio.Queue()
+        for _ in range(size):
+            self.slots.put_nowait(None)
+
+    async def acquire(self):
+        conn = await self.slots.get()
+        if conn is None or conn.closed:
+            try:
+                conn = await async_connect(self.dsn)
+            except Exception:
+                self.slots.put_nowait(None)
+                raise
+        return conn
+
+    def release(self, conn, broken=False):
+        if broken:
+            if not conn.closed:
+                conn.close()
+            conn = None
+        self.slots.put_nowait(conn)
+
+    async def close(self):
+        while not self.slots.empty():
+            conn = self.slots.get_nowait()
+            if conn is not None and not conn.closed:
+                conn.close()
+
+
+class AsyncTargetEngine:
+    """单个目标库的异步投递：一个生产者、N 条车道、一个共享连接池"""
+
+    def __init__(self, target, batch_size, poll_interval, stop_event, once=False,
+                 lanes=DEFAULT_LANES, pool_size=DEFAULT_POOL_SIZE, queue_depth=DEFAULT_QUEUE_DEPTH, cache=None):
+        self.target = target
+        self.cache = cache
+        self.name = target['target_name']
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.stop_event = stop_event
+        self.once = once
+        self.lanes = lanes
+        self.pool = AsyncConnectionPool(target['conn_str'], min(pool_size, lanes))
+        self.queues = [asyncio.Queue(maxsize=queue_depth) for _ in range(lanes)]
+        # 已分发但尚未写入进度的批次，按变更 id 顺序排列
+        self.chunks = deque()
+        self.flush_lock = asyncio.Lock()
+        # 源库连接只在这个单线程执行器中使用（源库查询很少，不值得另起异步连接）
+        self.source_executor = ThreadPoolExecutor(max_workers=1)
+        self.source_conn = None
+        self.horizon = CaptureHorizon()
+        self.totals = {'target': self.name, 'delivered': 0, 'batches': 0, 'errors': 0}
+
+    def _call_source(self, fn, *args, **kwargs):
+        if self.source_conn is None or self.source_conn.closed:
+            self.source_conn = psycopg2.connect(SOURCE_DSN)
+        try:
+            return fn(self.source_conn, *args, **kwargs)
+        except psycopg2.Error:
+            # 源库连接可能已损坏，下次重新建立
+            if not self.source_conn.closed:
+                self.source_conn.close()
+            self.source_conn = None
+            raise
+
+    async def _source(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.source_executor,
+                                          functools.partial(self._call_source, fn, *args, **kwargs))
+
+    async def _sleep(self, seconds):
+        """可被停止信号打断的等待"""
+        try:
+            await asyncio.wait_for(self.stop_event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _produce(self):
+        """读取变更、按车道拆分并入队；车道队列满时在此阻塞"""
+        after_id = self.target['last_change_id']
+        failures = 0
+
+        while not self.stop_event.is_set():
+            try:
+                # 只读到可见性水位（见 CaptureHorizon）；本引擎没有高优先级通道，
+                # 但要跳过线程引擎的高优先级通道已投递（或已取代）的变更
+                upto_id = await self._source(self.horizon.advance)
+                changes = await self._source(fetch_changes, after_id, self.batch_size,
+                                             self.target.get('last_high_change_id') or 0, upto_id)
+                if not changes:
+                    if self.once:
+                        break
+                    await self._sleep(self.poll_interval)
+                    continue
+                team_aliases = await self._source(resolve_team_aliases, changes, self.cache)
+                failures = 0
+            except Exception as e:
+                failures += 1
+                self.totals['errors'] += 1
+                print(f"   ❌ [{self.name}] 读取变更失败 (第{failures}次): {e}")
+                if self.once:
+                    break
+                await self._sleep(min(self.poll_interval * (2 ** failures), MAX_RETRY_DELAY))
+                continue
+
+            buckets = {}
+            for change in changes:
+                if change['delivered_early']:
+                    continue
+                action = route_change(self.target, change)
+                if action is None:
+                    continue
+                statements = build_statements(change, action, team_aliases)
+                if statements:
+                    lane = partition_of(partition_key(change), self.lanes)
+                    buckets.setdefault(lane, []).append((change, statements))
+
+            chunk = {
+                'range': (changes[0]['id'], changes[-1]['id']),
+                'size': len(changes),
+                'remaining': len(buckets),
+                'delivered': 0,
+                'failed_changes': [],
+            }
+            self.chunks.append(chunk)
+            for lane, items in buckets.items():
+                await self.queues[lane].put((chunk, items))
+
+            if not buckets:
+                await self._flush()
+            after_id = chunk['range'][1]
+
+    async def _apply_with_retry(self, items):
+        """在池中的某个连接上一次往返执行子批次；连接级错误退避后原样重试，保证车道内顺序"""
+        attempts = 0
+        while True:
+            conn = None
+            try:
+                conn = await self.pool.acquire()
+                failures = await execute_pipelined_async(conn, [statements for _, statements in items])
+            except Exception as e:
+                if conn is not None:
+                    self.pool.release(conn, broken=True)
+                attempts += 1
+                self.totals['errors'] += 1
+                print(f"   ❌ [{self.name}] 子批次投递失败 (第{attempts}次): {e}")
+                try:
+                    await self._source(record_progress, self.name, None, 0, error=str(e),
+                                       batch_range=(items[0][0]['id'], items[-1][0]['id']))
+                except Exception:
+                    pass
+                if self.stop_event.is_set() or self.once:
+                    raise
+                await self._sleep(min(self.poll_interval * (2 ** attempts), MAX_RETRY_DELAY))
+                continue
+
+            self.pool.release(conn)
+            return failures
+
+    async def _run_lane(self, queue):
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                chunk, items = item
+                failures = await self._apply_with_retry(items)
+                chunk['failed_changes'].extend((items[i][0], err) for i, err in sorted(failures.items()))
+                chunk['delivered'] += len(items) - len(failures)
+                chunk['remaining'] -= 1
+                if chunk['remaining'] == 0:
+                    await self._flush()
+            finally:
+                queue.task_done()
+
+    async def _flush(self):
+        """把队首连续完成的批次写入投递进度"""
+        async with self.flush_lock:
+            while self.chunks and self.chunks[0]['remaining'] == 0:
+                chunk = self.chunks[0]
+                chunk['failed_changes'].sort(key=lambda failure: failure[0]['id'])
+                try:
+                    await self._source(record_progress, self.name, chunk['range'][1], chunk['delivered'],
+                                       batch_range=chunk['range'], failed_changes=chunk['failed_changes'])
+                except Exception as e:
+                    # 下一个批次完成时再试；进度落后只会导致重放
+                    self.totals['errors'] += 1
+                    print(f"   ❌ [{self.name}] 记录投递进度失败: {e}")
+                    return
+                self.chunks.popleft()
+                self.target['last_change_id'] = chunk['range'][1]
+                self.totals['delivered'] += chunk['size']
+                self.totals['batches'] += 1
+
+    async def run(self):
+        lane_tasks = [asyncio.create_task(self._run_lane(queue)) for queue in self.queues]
+        producer = asyncio.create_task(self._produce())
+        try:
+            # 车道异常退出时生产者可能正阻塞在满队列上，因此同时监视两者
+            pending = {producer, *lane_tasks}
+            while not producer.done():
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+
+            for queue in self.queues:
+                await queue.put(None)
+            await asyncio.gather(*lane_tasks)
+            await self._flush()
+        except Exception as e:
+            self.totals['errors'] += 1
+            print(f"   ❌ [{self.name}] 投递中止: {e}")
+            for task in (producer, *lane_tasks):
+                task.cancel()
+            await asyncio.gather(producer, *lane_tasks, return_exceptions=True)
+        finally:
+            await self.pool.close()
+            await self._source_close()
+
+        return self.totals
+
+    async def _source_close(self):
+        def close():
+            if self.source_conn is not None and not self.source_conn.closed:
+                self.source_conn.close()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.source_executor, close)
+        self.source_executor.shutdown(wait=True)
+
+
+async def run_async_delivery(target_names=None, batch_size=DEFAULT_BATCH_SIZE, poll_interval=DEFAULT_POLL_INTERVAL,
+                             once=False, lanes=DEFAULT_LANES, pool_size=DEFAULT_POOL_SIZE,
+                             queue_depth=DEFAULT_QUEUE_DEPTH):
+    """在一个事件循环中为每个已启用的目标库运行异步投递"""
+    source_conn = psycopg2.connect(SOURCE_DSN)
+    try:
+        targets = load_targets(source_conn, target_names)
+    finally:
+        source_conn.close()
+
+    if not targets:
+        print("❌ 没有已启用的目标库，请先执行 register_sync_target()")
+        return False
+
+    print(f"🚀 启动异步多目标投递: {', '.join(t['target_name'] for t in targets)} "
+          f"(车道 {lanes}, 连接 {min(pool_size, lanes)}, 队列深度 {queue_depth})")
+
+    stop_event = asyncio.Event()
+    # 所有目标库共享一个团队 / 组织查找缓存（在各引擎的源库线程中调用，自带锁）
+    cache = LookupCache(SOURCE_DSN)
+    engines = [
+        AsyncTargetEngine(target, batch_size, poll_interval, stop_event, once, lanes, pool_size, queue_depth, cache)
+        for target in targets
+    ]
+    try:
+        results = await asyncio.gather(*(engine.run() for engine in engines))
+    except asyncio.CancelledError:
+        stop_event.set()
+        raise
+    finally:
+        cache.close()
+
+    print("\n📊 投递总结:")
+    for r in results:
+        status = "✅" if r['errors'] == 0 else "⚠️"
+        print(f"   {status} {r['target']}: {r['delivered']} 条变更, {r['batches']} 批, {r['errors']} 次错误")
+
+    return all(r['errors'] == 0 for r in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LiteLLM → Open WebUI 异步多目标投递引擎')
+    parser.add_argument('--target', action='append', help='只投递指定目标库（可重复）')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--interval', type=float, default=DEFAULT_POLL_INTERVAL, help='空闲时的轮询间隔（秒）')
+    parser.add_argument('--once', action='store_true', help='每个目标库追平后退出')
+    parser.add_argument('--lanes', type=int, default=DEFAULT_LANES,
+                        help='每个目标库的车道数（按实体键哈希，车道内保序）')
+    parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE,
+                        help='每个目标库的连接数（同时在途的往返数上限）')
+    parser.add_argument('--queue-depth', type=int, default=DEFAULT_QUEUE_DEPTH,
+                        help='每条车道最多排队的子批次数（背压）')
+    args = parser.parse_args()
+
+    try:
+        return asyncio.run(run_async_delivery(args.target, args.batch_size, args.interval, args.once,
+                                              args.lanes, args.pool_size, args.queue_depth))
+    except KeyboardInterrupt:
+        print("\n⏹️ 已停止")
+        return False
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+sync_audit 归档 - 把旧的审计记录流式导出为按天分片的 gzip JSON Lines 文件，再从热库中删除
+
+文件布局（每天一组）:
+    <dir>/YYYY/MM/sync_audit-YYYY-MM-DD.jsonl.gz   多成员 gzip，每个成员最多 --member-rows 行
+    <dir>/YYYY/MM/sync_audit-YYYY-MM-DD.index.json 成员的 (offset, length) 以及 record_id → 成员 的索引
+
+每个 gzip 成员可以单独解压，因此查询某条记录的历史只需 seek 到索引给出的几个成员，
+不必解压整个文件。整个文件仍是合法的 gzip，可以直接用 zcat 读取。
+
+导出使用服务器端游标（不会把整张表读进内存），导出范围在开始时按 (created_at < cutoff, id <= max_id)
+固定下来；只有数据文件和索引都已落盘后才分批删除同一范围。
+"""
+
+import psycopg2
+import os
+import sys
+import gzip
+import json
+import argparse
+from datetime import datetime, timedelta
+
+from bridge_client import connection, close_all
+
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_MEMBER_ROWS = 500
+DEFAULT_FETCH_SIZE = 2000
+DEFAULT_DELETE_BATCH = 5000
+INDEX_VERSION = 1
+
+AUDIT_COLUMNS = ('id', 'operation', 'record_id', 'sync_result', 'error_message',
+                 'old_data', 'new_data', 'created_at')
+
+
+def shard_paths(archive_dir, day):
+    """某一天的数据文件和索引文件路径"""
+    folder = os.path.join(archive_dir, day[:4], day[5:7])
+    base = os.path.join(folder, f'sync_audit-{day}')
+    return base + '.jsonl.gz', base + '.index.json'
+
+
+def _load_index(index_path, day):
+    if os.path.exists(index_path):
+        with open(index_path, encoding='utf-8') as f:
+            return json.load(f)
+    return {'version': INDEX_VERSION, 'day': day, 'size': 0, 'rows': 0,
+            'min_id': None, 'max_id': None, 'members': [], 'records': {}}
+
+
+def _write_index(index_path, index):
+    """先写临时文件再原子替换，索引不会处于半写状态"""
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, index_path)
+
+
+class DayShard:
+    """一天的归档分片；追加写入新的 gzip 成员并维护索引"""
+
+    def __init__(self, archive_dir, day, member_rows):
+        self.day = day
+        self.member_rows = member_rows
+        self.data_path, self.index_path = shard_paths(archive_dir, day)
+        os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
+        self.index = _load_index(self.index_path, day)
+
+        # 上次运行若在写索引前中断，数据文件尾部会有未被索引的字节，截掉后再追加
+        self.file = open(self.data_path, 'ab')
+        if self.file.tell() != self.index['size']:
+            self.file.truncate(self.index['size'])
+            self.file.seek(self.index['size'])
+            self.file.flush()
+
+        self.pending = []
+        self.rows_written = 0
+        self.rows_skipped = 0
+        self.archived_ids = self._existing_ids() if self.index['size'] else set()
+
+    def _existing_ids(self):
+        """已归档行的 id；只在重新运行（上次导出后删除失败或中断）、分片已存在时读取一次"""
+        ids = set()
+        with open(self.data_path, 'rb') as data:
+            for line in gzip.GzipFile(fileobj=data):
+                ids.add(json.loads(line)['id'])
+        return ids
+
+    def add(self, row):
+        # 跳过已经归档的行，重新运行不会在归档中产生重复
+        if row['id'] in self.archived_ids:
+            self.rows_skipped += 1
+            return
+        self.pending.append(row)
+        if len(self.pending) >= self.member_rows:
+            self._flush_member()
+
+    def _flush_member(self):
+        if not self.pending:
+            return
+        payload = ''.join(json.dumps(row, ensure_ascii=False, default=str) + '\n' for row in self.pending)
+        compressed = gzip.compress(payload.encode('utf-8'))
+
+        offset = self.index['size']
+        self.file.write(compressed)
+        member_no = len(self.index['members'])
+        first_id, last_id = self.pending[0]['id'], self.pending[-1]['id']
+        self.index['members'].append([offset, len(compressed), first_id, last_id])
+        self.index['size'] = offset + len(compressed)
+        self.index['rows'] += len(self.pending)
+        self.index['min_id'] = first_id if self.index['min_id'] is None else min(self.index['min_id'], first_id)
+        self.index['max_id'] = last_id if self.index['max_id'] is None else max(self.index['max_id'], last_id)
+
+        for record_id in {row['record_id'] for row in self.pending}:
+            members = self.index['records'].setdefault(record_id or '', [])
+            if not members or members[-1] != member_no:
+                members.append(member_no)
+
+        self.rows_written += len(self.pending)
+        self.pending = []
+
+    def close(self):
+        """写完剩余行，数据落盘后再写索引"""
+        self._flush_member()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        _write_index(self.index_path, self.index)
+
+
+def archive_range(cutoff):
+    """确定本次导出范围: created_at < cutoff 的最大 id；没有可归档记录时返回 None"""
+    with connection('source') as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT MAX(id), COUNT(*) FROM sync_audit WHERE created_at < %s;', (cutoff,))
+            max_id, total = cursor.fetchone()
+        conn.rollback()
+    return (max_id, total) if max_id is not None else None
+
+
+def export_audit(archive_dir, cutoff, max_id, member_rows=DEFAULT_MEMBER_ROWS, fetch_size=DEFAULT_FETCH_SIZE):
+    """用服务器端游标按 (created_at, id) 顺序导出，同一天的行写入同一个分片；返回 ({day: 行数}, 跳过行数)"""
+    written = {}
+    skipped = 0
+    shard = None
+    with connection('source') as conn:
+        with conn.cursor(name='sync_audit_archive') as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute(f"""
+                SELECT {', '.join(AUDIT_COLUMNS)}
+                FROM sync_audit
+                WHERE created_at < %s AND id <= %s
+                ORDER BY created_at, id;
+            """, (cutoff, max_id))
+
+            try:
+                for values in cursor:
+                    row = dict(zip(AUDIT_COLUMNS, values))
+                    day = row['created_at'].strftime('%Y-%m-%d')
+                    if shard is None or shard.day != day:
+                        if shard is not None:
+                            shard.close()
+                            written[shard.day] = shard.rows_written
+                            skipped += shard.rows_skipped
+                        shard = DayShard(archive_dir, day, member_rows)
+                    shard.add(row)
+            finally:
+                if shard is not None:
+                    shard.close()
+                    written[shard.day] = shard.rows_written
+                    skipped += shard.rows_skipped
+        conn.rollback()
+    return written, skipped
+
+
+def delete_archived(cutoff, max_id, batch_size=DEFAULT_DELETE_BATCH):
+    """分批删除已归档范围，避免长事务和大量行锁；返回删除行数"""
+    deleted = 0
+    with connection('source') as conn:
+        with conn.cursor() as cursor:
+            while True:
+                cursor.execute("""
+                    DELETE FROM sync_audit
+                    WHERE id IN (
+                        SELECT id FROM sync_audit
+                        WHERE created_at < %s AND id <= %s
+                        LIMIT %s
+                    );
+                """, (cutoff, max_id, batch_size))
+                count = cursor.rowcount
+                conn.commit()
+                deleted += count
+                if count < batch_size:
+                    break
+    return deleted
+
+
+def read_history(archive_dir, record_id, day_from=None, day_to=None):
+    """
+    从归档中读取某个 record_id 的审计历史（按时间升序）
+
+    只解压索引中包含该 record_id 的 gzip 成员。day_from / day_to 为 'YYYY-MM-DD'，含两端。
+    """
+    for root, _, files in sorted(os.walk(archive_dir)):
+        for name in sorted(files):
+            if not name.endswith('.index.json'):
+                continue
+            day = name[len('sync_audit-'):-len('.index.json')]
+            if (day_from and day < day_from) or (day_to and day > day_to):
+                continue
+
+            with open(os.path.join(root, name), encoding='utf-8') as f:
+                index = json.load(f)
+            members = index['records'].get(record_id)
+            if not members:
+                continue
+
+            data_path, _ = shard_paths(archive_dir, day)
+            with open(data_path, 'rb') as data:
+                for member_no in members:
+                    offset, length = index['members'][member_no][:2]
+                    data.seek(offset)
+                    for line in gzip.decompress(data.read(length)).decode('utf-8').splitlines():
+                        row = json.loads(line)
+                        if row['record_id'] == record_id:
+                            yield row
+
+
+def run_archive(archive_dir, retention_days=DEFAULT_RETENTION_DAYS, member_rows=DEFAULT_MEMBER_ROWS,
+                fetch_size=DEFAULT_FETCH_SIZE, delete=True):
+    cutoff = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=retention_days)
+    print(f"🚀 归档 {cutoff:%Y-%m-%d} 之前的 sync_audit 记录 → {archive_dir}")
+
+    found = archive_range(cutoff)
+    if found is None:
+        print("✅ 没有需要归档的记录")
+        return True
+    max_id, total = found
+    print(f"   待归档: {total} 条 (id <= {max_id})")
+
+    written, skipped = export_audit(archive_dir, cutoff, max_id, member_rows, fetch_size)
+    exported = sum(written.values())
+    print(f"   已写入 {len(written)} 个日分片, 共 {exported} 条" + (f", 已在归档中跳过 {skipped} 条" if skipped else ''))
+
+    if exported + skipped != total:
+        print(f"❌ 导出行数 {exported + skipped} 与待归档行数 {total} 不一致，保留热库中的记录")
+        return False
+
+    if delete:
+        deleted = delete_archived(cutoff, max_id)
+        print(f"   已从 sync_audit 删除 {deleted} 条")
+    else:
+        print("   --keep: 未删除热库中的记录")
+
+    print("✅ 归档完成")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='sync_audit 归档工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='导出并删除旧的审计记录')
+    export_parser.add_argument('--dir', required=True, help='归档目录')
+    export_parser.add_argument('--retention-days', type=int, default=DEFAULT_RETENTION_DAYS,
+                               help='热库中保留的天数')
+    export_parser.add_argument('--member-rows', type=int, default=DEFAULT_MEMBER_ROWS,
+                               help='每个 gzip 成员的行数（越小查询越快，压缩率越低）')
+    export_parser.add_argument('--fetch-size', type=int, default=DEFAULT_FETCH_SIZE, help='服务器端游标每次取回的行数')
+    export_parser.add_argument('--keep', action='store_true', help='只导出，不删除热库中的记录')
+
+    lookup_parser = subparsers.add_parser('lookup', help='从归档中查询某条记录的历史')
+    lookup_parser.add_argument('record_id')
+    lookup_parser.add_argument('--dir', required=True, help='归档目录')
+    lookup_parser.add_argument('--from', dest='day_from', help='起始日期 YYYY-MM-DD')
+    lookup_parser.add_argument('--to', dest='day_to', help='结束日期 YYYY-MM-DD')
+
+    args = parser.parse_args()
+
+    if args.command == 'lookup':
+        found = 0
+        for row in read_history(args.dir, args.record_id, args.day_from, args.day_to):
+            print(json.dumps(row, ensure_ascii=False))
+            found += 1
+        print(f"📊 共 {found} 条", file=sys.stderr)
+        return True
+
+    try:
+        return run_archive(args.dir, args.retention_days, args.member_rows, args.fetch_size, not args.keep)
+    except psycopg2.Error as e:
+        print(f"❌ 数据库错误: {e}")
+        return False
+    finally:
+        close_all()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
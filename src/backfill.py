@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+依赖有序的并行回填 - 把已有的 LiteLLM 组织、用户和 API key 一次性同步到 Open WebUI
+
+migrate-existing-users.sql 只回填用户；安装桥接前已存在的组织和 key 在被修改之前不会出现在 Open WebUI 中。
+本工具按 组织 → 用户 → API key 的依赖顺序回填，但不按阶段整体等待:
+
+- 用户在其组织完成后即可开始，API key 在其所属用户完成后即可开始
+- 就绪的实体按批次分发给多个工作线程，每批在目标库上一个远端事务、一次往返执行（remote_batch）
+- 依赖失败的实体不执行，记为 blocked
+- 读取 id 之后、批次执行之前被删除的实体记为 missing，其下游照常放行
+
+远端语句与投递引擎相同（sync_delivery.build_statements），带 source_version 守卫，
+因此可以在触发器或投递引擎运行时执行，也可以重复执行。成功的实体通过 sync_record_mapping() 记录映射。
+"""
+
+import psycopg2
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from bridge_client import connection, dsn_for, ensure_pool_capacity, close_all
+from remote_batch import execute_pipelined
+from sync_delivery import build_statements, resolve_team_aliases, user_display_name
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_WORKERS = 4
+STAGES = ('organization', 'user', 'api_key')
+
+# 阶段 → 按 id 读取整行及 source_version 的查询
+LOAD_SQL = {
+    'organization': """
+        SELECT o.organization_id, to_jsonb(o), sync_source_version(o.updated_at)
+        FROM "LiteLLM_OrganizationTable" o
+        WHERE o.organization_id = ANY(%s);
+    """,
+    'user': """
+        SELECT u.user_id, to_jsonb(u), sync_source_version(u.updated_at)
+        FROM "LiteLLM_UserTable" u
+        WHERE u.user_id = ANY(%s);
+    """,
+    'api_key': """
+        SELECT t.token, to_jsonb(t), NULL
+        FROM "LiteLLM_VerificationToken" t
+        WHERE t.token = ANY(%s);
+    """,
+}
+
+# 每个工作线程独占的目标库连接；同时登记在 _worker_conns 中，线程池结束后统一关闭
+_worker_local = threading.local()
+_worker_conns = []
+_worker_conns_lock = threading.Lock()
+
+
+def _init_worker(conn_str):
+    _worker_local.conn_str = conn_str
+    _worker_local.conn = None
+
+
+def _worker_conn():
+    conn = _worker_local.conn
+    if conn is None or conn.closed:
+        conn = _worker_local.conn = psycopg2.connect(_worker_local.conn_str)
+        with _worker_conns_lock:
+            _worker_conns.append(conn)
+    return conn
+
+
+def _close_worker_conns():
+    with _worker_conns_lock:
+        for conn in _worker_conns:
+            if not conn.closed:
+                conn.close()
+        _worker_conns.clear()
+
+
+def load_entities(source_conn, stages):
+    """读取所有待回填实体的 id 及其依赖（只有 id，整行在批次执行时再读）"""
+    entities = {stage: {} for stage in STAGES}
+    with source_conn.cursor() as cursor:
+        if 'organization' in stages:
+            cursor.execute('SELECT organization_id FROM "LiteLLM_OrganizationTable" ORDER BY organization_id;')
+            entities['organization'] = {org_id: None for org_id, in cursor.fetchall()}
+
+        if 'user' in stages:
+            # 与 migrate_existing_users_to_openwebui() 相同: 没有邮箱的用户跳过
+            cursor.execute("""
+                SELECT user_id, organization_id FROM "LiteLLM_UserTable"
+                WHERE user_email IS NOT NULL AND user_email != ''
+                ORDER BY user_id;
+            """)
+            entities['user'] = {user_id: org_id for user_id, org_id in cursor.fetchall()}
+
+        if 'api_key' in stages:
+            cursor.execute("SELECT to_regclass('\"LiteLLM_VerificationToken\"') IS NOT NULL;")
+            if cursor.fetchone()[0]:
+                cursor.execute("""
+                    SELECT token, user_id FROM "LiteLLM_VerificationToken"
+                    WHERE user_id IS NOT NULL AND user_id != ''
+                    ORDER BY token;
+                """)
+                entities['api_key'] = {token: user_id for token, user_id in cursor.fetchall()}
+    source_conn.rollback()
+    return entities
+
+
+class DependencyScheduler:
+    """
+    跟踪每个实体的状态，依赖完成时把下游实体放入就绪队列
+
+    只有本次回填范围内的依赖才需要等待: 组织不在 LiteLLM 中（或未选择该阶段）的用户直接就绪；
+    所属用户不在范围内的 key 也直接就绪（远端 UPDATE 在用户不存在时不产生影响）。
+    执行时已不存在的实体按同样的规则放行下游，因此 total = done + failed + blocked + missing。
+    """
+
+    def __init__(self, entities):
+        self.ready = {stage: deque() for stage in STAGES}
+        self.waiting = {stage: defaultdict(list) for stage in STAGES}   # 上游 id → 下游 id 列表
+        self.counts = {stage: {'total': len(entities[stage]), 'done': 0, 'failed': 0, 'blocked': 0, 'missing': 0}
+                       for stage in STAGES}
+        self.errors = []
+
+        self.ready['organization'].extend(entities['organization'])
+        for user_id, org_id in entities['user'].items():
+            if org_id and org_id in entities['organization']:
+                self.waiting['organization'][org_id].append(user_id)
+            else:
+                self.ready['user'].append(user_id)
+        for token, user_id in entities['api_key'].items():
+            if user_id in entities['user']:
+                self.waiting['user'][user_id].append(token)
+            else:
+                self.ready['api_key'].append(token)
+
+    def next_batch(self, batch_size):
+        """按阶段顺序取下一批就绪实体；没有时返回 None"""
+        for stage in STAGES:
+            queue = self.ready[stage]
+            if queue:
+                return stage, [queue.popleft() for _ in range(min(batch_size, len(queue)))]
+        return None
+
+    def _downstream(self, stage):
+        index = STAGES.index(stage)
+        return STAGES[index + 1] if index + 1 < len(STAGES) else None
+
+    def _block(self, stage, entity_id):
+        downstream = self._downstream(stage)
+        if downstream is None:
+            return
+        for child in self.waiting[stage].pop(entity_id, []):
+            self.counts[downstream]['blocked'] += 1
+            self._block(downstream, child)
+
+    def complete(self, stage, done_ids, failures, missing_ids=()):
+        downstream = self._downstream(stage)
+        self.counts[stage]['done'] += len(done_ids)
+        self.counts[stage]['failed'] += len(failures)
+        self.counts[stage]['missing'] += len(missing_ids)
+        for entity_id in [*done_ids, *missing_ids]:
+            if downstream:
+                self.ready[downstream].extend(self.waiting[stage].pop(entity_id, []))
+        for entity_id, error in failures.items():
+            if len(self.errors) < 20:
+                self.errors.append(f"{stage} {entity_id}: {error}")
+            self._block(stage, entity_id)
+
+
+def mapping_row(stage, entity_id, payload, source_version, display_name):
+    """(litellm_type, litellm_id, openwebui_type, openwebui_id, sync_data)，与触发器写入的映射一致"""
+    if stage == 'organization':
+        return ('organization', entity_id, 'group', 'grp_' + entity_id,
+                {'organization_alias': payload.get('organization_alias'), 'source_version': source_version})
+    if stage == 'user':
+        return ('user', entity_id, 'user', 'usr_' + entity_id,
+                {'display_name': display_name, 'original_role': payload.get('user_role'),
+                 'migration_type': 'backfill', 'source_version': source_version})
+    return ('api_key', entity_id, 'user_api_key', 'usr_' + payload['user_id'],
+            {'models': payload.get('models'), 'key_alias': payload.get('key_alias')})
+
+
+def run_batch(stage, ids):
+    """读取整行 → 一个远端事务执行 → 记录映射和审计；返回 (完成的 id 列表, {id: 错误}, 已不存在的 id 列表)"""
+    with connection('source') as source_conn:
+        with source_conn.cursor() as cursor:
+            cursor.execute(LOAD_SQL[stage], (ids,))
+            rows = cursor.fetchall()
+        source_conn.commit()
+
+        changes = [{'entity_type': stage, 'entity_id': entity_id, 'operation': 'UPSERT',
+                    'payload': payload, 'source_version': source_version}
+                   for entity_id, payload, source_version in rows]
+        team_aliases = resolve_team_aliases(source_conn, changes) if stage == 'user' else {}
+
+        conn = _worker_conn()
+        try:
+            failures = execute_pipelined(conn, [build_statements(c, 'UPSERT', team_aliases) for c in changes])
+        except Exception:
+            if not conn.closed:
+                conn.close()
+            raise
+
+        failed = {changes[i]['entity_id']: error for i, error in failures.items()}
+        # 读取时已被删除的实体不算失败，单独计数并放行其下游
+        found = {c['entity_id'] for c in changes}
+        missing = [entity_id for entity_id in ids if entity_id not in found]
+        done_changes = [c for c in changes if c['entity_id'] not in failed]
+
+        mappings = []
+        for change in done_changes:
+            display_name = user_display_name(change['payload'], team_aliases) if stage == 'user' else None
+            mappings.append(mapping_row(stage, change['entity_id'], change['payload'],
+                                        change['source_version'], display_name))
+
+        with source_conn.cursor() as cursor:
+            if mappings:
+                cursor.execute("""
+                    SELECT sync_record_mapping(m.litellm_type::sync_entity_type, m.litellm_id,
+                                               m.openwebui_type::sync_entity_type, m.openwebui_id, m.sync_data)
+                    FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[], %s::jsonb[])
+                         AS m(litellm_type, litellm_id, openwebui_type, openwebui_id, sync_data);
+                """, tuple(list(column) for column in zip(*[
+                    (t, lid, ot, oid, json.dumps(data, default=str)) for t, lid, ot, oid, data in mappings])))
+            cursor.execute("""
+                INSERT INTO sync_audit (operation, record_id, sync_result, error_message, new_data)
+                VALUES ('BACKFILL', %s, %s, %s, %s);
+            """, (stage, 'FAILED' if failed else 'SUCCESS',
+                  '; '.join(f"{k}: {v}" for k, v in list(failed.items())[:5]) or None,
+                  json.dumps({'requested': len(ids), 'found': len(found), 'done': len(done_changes),
+                              'failed': len(failed), 'missing': len(missing)})))
+        source_conn.commit()
+
+    return [c['entity_id'] for c in done_changes], failed, missing
+
+
+def run_backfill(stages=STAGES, workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE, target_dsn=None):
+    """执行回填并返回各阶段的计数"""
+    ensure_pool_capacity(workers + 2)
+    with connection('source') as source_conn:
+        entities = load_entities(source_conn, stages)
+
+    scheduler = DependencyScheduler(entities)
+    for stage in STAGES:
+        if stage in stages:
+            print(f"   {stage}: {scheduler.counts[stage]['total']} 个")
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(target_dsn or dsn_for('target'),)) as executor:
+            _dispatch(executor, scheduler, workers, batch_size)
+    finally:
+        _close_worker_conns()
+
+    elapsed = time.perf_counter() - started
+    return {'elapsed': elapsed, 'counts': scheduler.counts, 'errors': scheduler.errors}
+
+
+def _dispatch(executor, scheduler, workers, batch_size):
+    """按依赖分发批次直到所有实体都有结果"""
+    in_flight = {}
+    while True:
+        # 每个工作者最多同时有一个批次，其余实体留在就绪队列里等待更多依赖完成
+        while len(in_flight) < workers:
+            batch = scheduler.next_batch(batch_size)
+            if batch is None:
+                break
+            in_flight[executor.submit(run_batch, *batch)] = batch
+
+        if not in_flight:
+            break
+
+        finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in finished:
+            stage, ids = in_flight.pop(future)
+            try:
+                done_ids, failures, missing_ids = future.result()
+            except Exception as e:
+                done_ids, failures, missing_ids = [], {entity_id: f"批次失败: {e}" for entity_id in ids}, []
+            scheduler.complete(stage, done_ids, failures, missing_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按依赖顺序并行回填组织、用户和 API key 到 Open WebUI')
+    parser.add_argument('--stage', action='append', choices=STAGES, help='只回填指定阶段（可重复，默认全部）')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='并行工作线程数')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='每个远端事务的实体数')
+    parser.add_argument('--target-dsn', help='目标库连接串（默认使用 target 连接）')
+    args = parser.parse_args()
+
+    print("🚀 开始回填现有 LiteLLM 数据...")
+    try:
+        result = run_backfill(args.stage or STAGES, args.workers, args.batch_size, args.target_dsn)
+    except psycopg2.Error as e:
+        print(f"❌ 数据库错误: {e}")
+        return False
+    finally:
+        close_all()
+
+    print(f"\n📊 回填总结 ({result['elapsed']:.1f}s):")
+    for stage in STAGES:
+        counts = result['counts'][stage]
+        if counts['total']:
+            status = "✅" if counts['failed'] == 0 and counts['blocked'] == 0 else "⚠️"
+            print(f"   {status} {stage}: {counts['done']}/{counts['total']} 完成, "
+                  f"{counts['failed']} 失败, {counts['blocked']} 因依赖失败未执行, "
+                  f"{counts['missing']} 执行时已删除")
+    for error in result['errors']:
+        print(f"      错误示例: {error}")
+
+    return all(c['failed'] == 0 and c['blocked'] == 0 for c in result['counts'].values())
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+桥接客户端 - Python 工具共用的数据库配置与连接池
+
+每个逻辑数据库（admin / source / target）一个 ThreadedConnectionPool，借出连接前做健康检查，
+坏连接直接丢弃并换新的。配置优先级（高 → 低）:
+1. 环境变量 BRIDGE_<NAME>_DSN，例如 BRIDGE_SOURCE_DSN
+2. BRIDGE_CONFIG 指向的 JSON 文件，例如
+   {"host": "db", "port": 5432, "user": "webui", "password": "...",
+    "databases": {"source": "litellm", "target": "openwebui"},
+    "dsn": {"admin": "host=db dbname=postgres user=postgres"}}
+3. 环境变量 BRIDGE_DB_HOST / BRIDGE_DB_PORT / BRIDGE_DB_USER / BRIDGE_DB_PASSWORD
+4. 实验环境默认值
+"""
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import os
+import json
+import threading
+from contextlib import contextmanager
+
+DEFAULT_SETTINGS = {
+    'host': '172.21.0.4',
+    'port': 5432,
+    'user': 'webui',
+    'password': 'webui',
+    'databases': {
+        'admin': 'postgres',
+        'source': 'litellm_real',
+        'target': 'openwebui_real',
+    },
+    'dsn': {},
+    'pool_min': 0,
+    'pool_max': 8,
+}
+
+_settings = None
+_pools = {}
+_inherited_pools = []   # fork 继承的连接池，只保留引用，见 reset_after_fork()
+_lock = threading.Lock()
+
+
+def load_settings(path=None):
+    """读取配置（默认值 ← 配置文件 ← 环境变量），结果缓存到进程内"""
+    global _settings
+    if _settings is not None and path is None:
+        return _settings
+
+    settings = json.loads(json.dumps(DEFAULT_SETTINGS))
+
+    path = path or os.environ.get('BRIDGE_CONFIG')
+    if path:
+        with open(path, encoding='utf-8') as f:
+            file_settings = json.load(f)
+        for key, value in file_settings.items():
+            if isinstance(value, dict):
+                settings.setdefault(key, {}).update(value)
+            else:
+                settings[key] = value
+
+    for key in ('host', 'port', 'user', 'password'):
+        env_value = os.environ.get(f'BRIDGE_DB_{key.upper()}')
+        if env_value:
+            settings[key] = env_value
+    if os.environ.get('BRIDGE_POOL_MAX'):
+        settings['pool_max'] = int(os.environ['BRIDGE_POOL_MAX'])
+
+    _settings = settings
+    return settings
+
+
+def dsn_for(name):
+    """逻辑数据库名 → libpq 连接串"""
+    env_dsn = os.environ.get(f'BRIDGE_{name.upper()}_DSN')
+    if env_dsn:
+        return env_dsn
+
+    settings = load_settings()
+    if name in settings['dsn']:
+        return settings['dsn'][name]
+    if name not in settings['databases']:
+        raise KeyError(f"未配置的数据库: {name}")
+
+    return (f"host={settings['host']} port={settings['port']} dbname={settings['databases'][name]} "
+            f"user={settings['user']} password={settings['password']}")
+
+
+def get_pool(name):
+    """按逻辑数据库名懒加载连接池（线程安全）"""
+    with _lock:
+        pool = _pools.get(name)
+        if pool is None or pool.closed:
+            settings = load_settings()
+            pool = _pools[name] = psycopg2.pool.ThreadedConnectionPool(
+                settings['pool_min'], settings['pool_max'], dsn_for(name))
+        return pool
+
+
+def _is_healthy(conn):
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1;')
+        conn.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+def checkout(name, autocommit=False):
+    """从连接池借出一个健康的连接；用完必须 release()"""
+    pool = get_pool(name)
+    attempts = load_settings()['pool_max'] + 1
+
+    for _ in range(attempts):
+        conn = pool.getconn()
+        if _is_healthy(conn):
+            conn.autocommit = autocommit
+            return conn
+        # 服务器重启或网络中断后的坏连接：丢弃，换一个
+        pool.putconn(conn, close=True)
+
+    raise psycopg2.OperationalError(f"无法从连接池 {name} 获得可用连接")
+
+
+def release(name, conn):
+    """归还连接：回滚未提交的事务，坏连接直接关闭"""
+    pool = get_pool(name)
+    broken = conn.closed != 0
+    if not broken:
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            conn.autocommit = False
+        except psycopg2.Error:
+            broken = True
+    pool.putconn(conn, close=broken)
+
+
+@contextmanager
+def connection(name, autocommit=False):
+    """with connection('source') as conn: ..."""
+    conn = checkout(name, autocommit)
+    try:
+        yield conn
+    finally:
+        release(name, conn)
+
+
+def ensure_pool_capacity(max_connections):
+    """把每个连接池的上限提高到至少 max_connections（已建立的池会重建）"""
+    settings = load_settings()
+    if settings['pool_max'] >= max_connections:
+        return
+    settings['pool_max'] = max_connections
+    close_all()
+
+
+def reset_after_fork():
+    """
+    在 fork 出的子进程中丢弃从父进程继承的连接池（作为 ProcessPoolExecutor 的 initializer）
+
+    继承的连接与父进程共用 socket，子进程不能使用也不能关闭它们（关闭会向父进程的会话发送终止消息），
+    因此只把连接池移出 _pools 并保留引用防止被回收；之后的 checkout() 在子进程中新建连接池。
+    """
+    global _lock
+    _lock = threading.Lock()
+    _inherited_pools.extend(_pools.values())
+    _pools.clear()
+
+
+def close_all():
+    """关闭所有连接池（进程退出前调用）"""
+    with _lock:
+        for pool in _pools.values():
+            if not pool.closed:
+                pool.closeall()
+        _pools.clear()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+桥接快照 - 用二进制 COPY 导出 / 导入 Open WebUI 中由桥接维护的全部状态，快速搭建或重建目标库
+
+导出（export）:
+- 在目标库的一个 REPEATABLE READ 只读事务中，用 COPY (SELECT ...) TO STDOUT (FORMAT binary) 导出
+  usr_ 用户（含 api_key）、usr_ auth（含密码哈希，导入时无需重新 bcrypt）和 grp_ 组，
+  以及源库中对应的 sync_mapping 行
+- 水位线 = 导出前该目标库在 sync_target_progress 中的 last_change_id：
+  水位线及之前的变更在读取它之前都已提交到目标库，因此一定包含在快照中
+- 打包为一个 tar.gz：manifest.json + 每张表一个二进制 COPY 文件
+
+导入（import）:
+- 在新目标库的一个事务中按 manifest 的列顺序 COPY FROM STDIN (FORMAT binary)，列类型不一致时拒绝导入
+- 指定 --register-as 时把新目标库注册到 sync_target，进度设为快照水位线，
+  然后只重放水位线之后的变更（upsert / delete 带版本守卫，与快照重叠的部分可安全重放）
+"""
+
+import psycopg2
+import psycopg2.extras
+import os
+import sys
+import json
+import tarfile
+import tempfile
+import threading
+import argparse
+from datetime import datetime
+
+from bridge_client import connection, dsn_for, close_all
+
+SNAPSHOT_VERSION = 1
+
+# (快照中的名称, 所在库, 表名, 过滤条件)
+SNAPSHOT_TABLES = (
+    ('user', 'target', '"user"', "id LIKE 'usr\\_%'"),
+    ('auth', 'target', 'auth', "id LIKE 'usr\\_%'"),
+    ('group', 'target', '"group"', "id LIKE 'grp\\_%'"),
+    ('sync_mapping', 'source', 'sync_mapping_detail', "litellm_type IN ('user', 'organization', 'api_key')"),
+)
+
+
+def table_columns(conn, table):
+    """[(列名, 类型)]，按表定义顺序；二进制 COPY 要求两端列类型完全一致"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+            FROM pg_attribute a
+            WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+            ORDER BY a.attnum;
+        """, (table,))
+        return [list(row) for row in cursor.fetchall()]
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def load_source_target(source_conn, target_name):
+    """读取已注册目标库的连接串、组织过滤和水位线"""
+    with source_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute("""
+            SELECT t.conn_str, t.organization_filter, p.last_change_id
+            FROM sync_target t
+            JOIN sync_target_progress p ON p.target_name = t.target_name
+            WHERE t.target_name = %s;
+        """, (target_name,))
+        row = cursor.fetchone()
+    source_conn.rollback()
+    if row is None:
+        raise ValueError(f"未注册的目标库: {target_name}")
+    return dict(row)
+
+
+def open_private(path):
+    """以 0600 权限创建（或截断）文件并返回二进制写句柄；已存在的文件同样收紧为 0600"""
+    fd = os.open(path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)
+    return os.fdopen(fd, 'wb')
+
+
+def export_snapshot(path, from_target=None):
+    """
+    导出快照，返回 manifest
+
+    归档内含 bcrypt 密码哈希和 API Key，相当于一份凭据转储，因此以 0600 权限创建，
+    请按凭据的要求保管和传输。
+    """
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'created_at': datetime.now().isoformat(),
+        'from_target': from_target,
+        'organization_filter': None,
+        'watermark': None,
+        'tables': {},
+    }
+
+    with connection('source') as source_conn:
+        if from_target:
+            source_target = load_source_target(source_conn, from_target)
+            target_dsn = source_target['conn_str']
+            manifest['organization_filter'] = source_target['organization_filter']
+            # 先读水位线再开始快照事务
+            manifest['watermark'] = source_target['last_change_id']
+        else:
+            target_dsn = dsn_for('target')
+
+        target_conn = psycopg2.connect(target_dsn)
+        target_conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        source_conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        conns = {'target': target_conn, 'source': source_conn}
+
+        try:
+            with tempfile.TemporaryDirectory() as workdir, open_private(path) as archive_file, \
+                    tarfile.open(fileobj=archive_file, mode='w:gz') as archive:
+                for name, db, table, condition in SNAPSHOT_TABLES:
+                    conn = conns[db]
+                    columns = table_columns(conn, table)
+                    file_name = f'{name}.copy'
+                    file_path = os.path.join(workdir, file_name)
+
+                    with open(file_path, 'wb') as f, conn.cursor() as cursor:
+                        cursor.copy_expert(
+                            f"COPY (SELECT {', '.join(_quote(c) for c, _ in columns)} FROM {table} "
+                            f"WHERE {condition}) TO STDOUT (FORMAT binary)", f)
+                        rows = cursor.rowcount
+
+                    archive.add(file_path, arcname=file_name)
+                    manifest['tables'][name] = {'file': file_name, 'table': table, 'columns': columns,
+                                                'rows': rows, 'bytes': os.path.getsize(file_path)}
+                    print(f"   📦 {name}: {rows} 行, {os.path.getsize(file_path)} 字节")
+
+                manifest_path = os.path.join(workdir, 'manifest.json')
+                with open(manifest_path, 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f, ensure_ascii=False, indent=2)
+                archive.add(manifest_path, arcname='manifest.json')
+        finally:
+            target_conn.close()
+            source_conn.rollback()
+            source_conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT')
+
+    return manifest
+
+
+def import_snapshot(path, target_dsn, restore_mapping=False):
+    """在一个事务中把快照批量导入目标库，返回 manifest"""
+    with tarfile.open(path, 'r:gz') as archive:
+        manifest = json.load(archive.extractfile('manifest.json'))
+        if manifest['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f"不支持的快照版本: {manifest['version']}")
+
+        target_conn = psycopg2.connect(target_dsn)
+        try:
+            for name, db, table, _ in SNAPSHOT_TABLES:
+                if db != 'target':
+                    continue
+                info = manifest['tables'][name]
+                actual = {column: column_type for column, column_type in table_columns(target_conn, table)}
+                mismatched = [c for c, t in info['columns'] if actual.get(c) != t]
+                if mismatched:
+                    raise ValueError(f"{table} 的列与快照不一致（Open WebUI 版本不同？）: {mismatched}")
+
+                with target_conn.cursor() as cursor:
+                    cursor.copy_expert(
+                        f"COPY {table} ({', '.join(_quote(c) for c, _ in info['columns'])}) "
+                        f"FROM STDIN (FORMAT binary)", archive.extractfile(info['file']))
+                print(f"   📥 {name}: {info['rows']} 行")
+            target_conn.commit()
+        except Exception:
+            target_conn.rollback()
+            raise
+        finally:
+            target_conn.close()
+
+        if restore_mapping:
+            info = manifest['tables']['sync_mapping']
+            with connection('source') as source_conn:
+                with source_conn.cursor() as cursor:
+                    cursor.execute('CREATE TEMP TABLE snapshot_mapping ON COMMIT DROP AS '
+                                   'SELECT * FROM sync_mapping_detail WITH NO DATA;')
+                    cursor.copy_expert(
+                        f"COPY snapshot_mapping ({', '.join(_quote(c) for c, _ in info['columns'])}) "
+                        f"FROM STDIN (FORMAT binary)", archive.extractfile(info['file']))
+                    cursor.execute("""
+                        INSERT INTO sync_mapping (litellm_type, litellm_id, openwebui_type, openwebui_id, created_at)
+                        SELECT litellm_type, litellm_id, openwebui_type, openwebui_id, created_at
+                        FROM snapshot_mapping
+                        ON CONFLICT (litellm_type, litellm_id) DO NOTHING;
+                    """)
+                    restored = cursor.rowcount
+                    cursor.execute("""
+                        INSERT INTO sync_mapping_state (mapping_id, sync_data, updated_at)
+                        SELECT m.id, COALESCE(s.sync_data, '{}'), COALESCE(s.updated_at, CURRENT_TIMESTAMP)
+                        FROM snapshot_mapping s
+                        JOIN sync_mapping m ON m.litellm_type = s.litellm_type AND m.litellm_id = s.litellm_id
+                        ON CONFLICT (mapping_id) DO NOTHING;
+                    """)
+                source_conn.commit()
+            print(f"   📥 sync_mapping: 恢复 {restored} 行（已存在的保留）")
+
+    return manifest
+
+
+def register_and_replay(manifest, target_name, target_dsn, batch_size):
+    """把新目标库注册为投递目标，进度设为快照水位线，然后重放之后的变更直到追平"""
+    # 延迟导入：只有重放时才需要投递引擎
+    from sync_delivery import load_targets, run_target_worker
+
+    with connection('source') as source_conn:
+        with source_conn.cursor() as cursor:
+            cursor.execute('SELECT register_sync_target(%s, %s, %s);',
+                           (target_name, target_dsn, manifest['organization_filter']))
+            cursor.execute("""
+                UPDATE sync_target_progress
+                SET last_change_id = %s, last_high_change_id = 0,
+                    failed_attempts = 0, last_error = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE target_name = %s;
+            """, (manifest['watermark'], target_name))
+        source_conn.commit()
+        targets = load_targets(source_conn, [target_name])
+
+    print(f"🔄 从水位线 {manifest['watermark']} 开始重放 {target_name} 的后续变更...")
+    totals = run_target_worker(targets[0], batch_size, 1.0, threading.Event(), once=True)
+    print(f"   重放 {totals['delivered']} 条变更, {totals['batches']} 批, {totals['errors']} 次错误")
+    return totals['errors'] == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='桥接快照导出 / 导入')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='导出快照')
+    export_parser.add_argument('path', help='快照文件（.tar.gz）')
+    export_parser.add_argument('--from-target',
+                               help='从已注册的目标库导出并记录其水位线（否则使用 target 连接，且不能重放）')
+
+    import_parser = subparsers.add_parser('import', help='导入快照到新的 Open WebUI 数据库')
+    import_parser.add_argument('path', help='快照文件（.tar.gz）')
+    import_parser.add_argument('--target-dsn', help='新目标库连接串（默认使用 target 连接）')
+    import_parser.add_argument('--register-as', help='导入后注册为投递目标并重放水位线之后的变更')
+    import_parser.add_argument('--restore-mapping', action='store_true',
+                               help='同时把快照中的 sync_mapping 行补回源库（已存在的行保留）')
+    import_parser.add_argument('--batch-size', type=int, default=500)
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'export':
+            print(f"🚀 导出桥接快照 → {args.path}")
+            manifest = export_snapshot(args.path, args.from_target)
+            print(f"✅ 快照完成, 水位线: {manifest['watermark']}")
+            return True
+
+        target_dsn = args.target_dsn or dsn_for('target')
+        print(f"🚀 导入桥接快照 {args.path}")
+        manifest = import_snapshot(args.path, target_dsn, args.restore_mapping)
+        print("✅ 快照已导入")
+
+        if args.register_as:
+            if manifest['watermark'] is None:
+                print("⚠️ 快照没有水位线（导出时未指定 --from-target），无法重放后续变更")
+                return False
+            return register_and_replay(manifest, args.register_as, target_dsn, args.batch_size)
+        return True
+    except (psycopg2.Error, ValueError) as e:
+        print(f"❌ {e}")
+        return False
+    finally:
+        close_all()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
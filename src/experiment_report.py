@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+实验报告数据采集 - 为 real_experiment_runner 生成机器可读的 JSON 报告
+
+同步延迟 = sync_audit.created_at（审计写入时刻，clock_timestamp）− 源记录 updated_at（new_data 中）。
+只统计本次运行期间写入的审计记录（按 sync_audit.id 区间划分到各阶段）。
+"""
+
+import psycopg2
+import psycopg2.extensions
+import os
+import sys
+import json
+import socket
+import platform
+from datetime import datetime
+
+from bridge_client import connection, dsn_for
+
+REPORT_SCHEMA_VERSION = 1
+
+
+def audit_mark():
+    """当前 sync_audit 的最大 id；数据库尚不可用时返回 None"""
+    try:
+        with connection('source') as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT COALESCE(MAX(id), 0) FROM sync_audit;')
+                mark = cursor.fetchone()[0]
+            conn.rollback()
+        return mark
+    except psycopg2.Error:
+        return None
+
+
+def collect_operation_stats(after_id, until_id=None):
+    """按操作类型统计审计记录数量和同步延迟百分位（毫秒）"""
+    with connection('source') as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                WITH audit AS (
+                    SELECT operation, sync_result,
+                           EXTRACT(EPOCH FROM (created_at - (new_data->>'updated_at')::timestamp)) * 1000
+                               AS latency_ms
+                    FROM sync_audit
+                    WHERE id > %s AND (%s::integer IS NULL OR id <= %s)
+                )
+                SELECT operation,
+                       COUNT(*),
+                       COUNT(*) FILTER (WHERE sync_result = 'SUCCESS'),
+                       COUNT(*) FILTER (WHERE sync_result = 'FAILED'),
+                       COUNT(*) FILTER (WHERE sync_result = 'WARNING'),
+                       COUNT(latency_ms),
+                       percentile_cont(0.50) WITHIN GROUP (ORDER BY latency_ms),
+                       percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms),
+                       percentile_cont(0.99) WITHIN GROUP (ORDER BY latency_ms),
+                       MAX(latency_ms)
+                FROM audit
+                GROUP BY operation
+                ORDER BY operation;
+            """, (after_id, until_id, until_id))
+            rows = cursor.fetchall()
+        conn.rollback()
+
+    def ms(value):
+        return round(float(value), 3) if value is not None else None
+
+    stats = {}
+    for op, total, success, failed, warning, samples, p50, p95, p99, max_ms in rows:
+        stats[op] = {
+            'total': total,
+            'success': success,
+            'failed': failed,
+            'warning': warning,
+            'latency_ms': {
+                'samples': samples,
+                'p50': ms(p50),
+                'p95': ms(p95),
+                'p99': ms(p99),
+                'max': ms(max_ms),
+            },
+        }
+    return stats
+
+
+def _server_version(name):
+    try:
+        with connection(name) as conn:
+            version = conn.server_version
+            conn.rollback()
+        return version
+    except psycopg2.Error:
+        return None
+
+
+def _safe_dsn(name):
+    """连接信息去掉密码"""
+    params = psycopg2.extensions.parse_dsn(dsn_for(name))
+    params.pop('password', None)
+    return params
+
+
+def collect_environment():
+    return {
+        'hostname': socket.gethostname(),
+        'platform': platform.platform(),
+        'python': sys.version.split()[0],
+        'psycopg2': psycopg2.__version__.split()[0],
+        'source': dict(_safe_dsn('source'), server_version=_server_version('source')),
+        'target': dict(_safe_dsn('target'), server_version=_server_version('target')),
+        'bridge_config': os.environ.get('BRIDGE_CONFIG'),
+    }
+
+
+def build_report(results, run_started):
+    """
+    results: {步骤名: {'success', 'duration', 'timestamp', 'audit_range': (before, after), 'error'?}}
+    """
+    marks = [r['audit_range'][0] for r in results.values() if r.get('audit_range') and r['audit_range'][0] is not None]
+    run_after_id = min(marks) if marks else 0
+
+    phases = []
+    for name, result in results.items():
+        before, after = result.get('audit_range') or (None, None)
+        phase = {
+            'name': name,
+            'success': bool(result['success']),
+            'duration_s': round(result.get('duration', 0), 3),
+            'error': result.get('error'),
+            'audit_records': None,
+            'throughput_ops_per_s': None,
+        }
+        if before is not None and after is not None:
+            phase['operations'] = collect_operation_stats(before, after) if after > before else {}
+            phase['audit_records'] = sum(op['total'] for op in phase['operations'].values())
+            if phase['duration_s'] > 0:
+                phase['throughput_ops_per_s'] = round(phase['audit_records'] / phase['duration_s'], 2)
+        phases.append(phase)
+
+    operations = collect_operation_stats(run_after_id)
+    total = sum(op['total'] for op in operations.values())
+    success = sum(op['success'] for op in operations.values())
+
+    return {
+        'schema_version': REPORT_SCHEMA_VERSION,
+        'run_started_at': run_started.isoformat(),
+        'generated_at': datetime.now().isoformat(),
+        'environment': collect_environment(),
+        'phases': phases,
+        'operations': operations,
+        'overall': {
+            'audit_records': total,
+            'success': success,
+            'success_rate': round(success * 100.0 / total, 2) if total else None,
+            'all_phases_passed': all(p['success'] for p in phases),
+        },
+    }
+
+
+def write_json_report(path, report):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+故障注入 TCP 代理 - 架在桥接与 Open WebUI PostgreSQL 之间，模拟慢速、窄带宽和不稳定的目标库
+
+支持的故障（可在运行中切换配置）:
+- latency_ms / jitter_ms: 每个数据块在每个方向上的附加延迟
+- bandwidth_kbps: 每个方向的带宽上限
+- reset_probability: 新连接在传输若干字节后被 RST 的概率
+- blackhole: 接受连接但从不转发也从不应答
+"""
+
+import sys
+import socket
+import struct
+import random
+import asyncio
+import argparse
+import threading
+
+
+class FaultProfile:
+    """一组故障参数"""
+
+    def __init__(self, name, latency_ms=0, jitter_ms=0, bandwidth_kbps=0, reset_probability=0.0, blackhole=False):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.bandwidth_kbps = bandwidth_kbps
+        self.reset_probability = reset_probability
+        self.blackhole = blackhole
+
+    def delay_for(self, size, rng):
+        """一个数据块需要额外等待的秒数"""
+        delay = 0.0
+        if self.latency_ms or self.jitter_ms:
+            delay += max(0.0, self.latency_ms + rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0
+        if self.bandwidth_kbps:
+            delay += size / (self.bandwidth_kbps * 1024.0)
+        return delay
+
+    def describe(self):
+        parts = []
+        if self.latency_ms:
+            parts.append(f"延迟 {self.latency_ms}±{self.jitter_ms}ms")
+        if self.bandwidth_kbps:
+            parts.append(f"带宽 {self.bandwidth_kbps}KB/s")
+        if self.reset_probability:
+            parts.append(f"重置概率 {self.reset_probability:.0%}")
+        if self.blackhole:
+            parts.append("黑洞")
+        return ', '.join(parts) or '无故障'
+
+
+PROFILES = {
+    'clean': FaultProfile('clean'),
+    'slow': FaultProfile('slow', latency_ms=50, jitter_ms=10),
+    'very_slow': FaultProfile('very_slow', latency_ms=250, jitter_ms=50),
+    'narrow': FaultProfile('narrow', latency_ms=20, bandwidth_kbps=32),
+    'flaky': FaultProfile('flaky', latency_ms=10, reset_probability=0.2),
+    'blackhole': FaultProfile('blackhole', blackhole=True),
+}
+
+
+def _reset(writer):
+    """SO_LINGER=0 后关闭，对端收到 RST 而不是正常的 FIN"""
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        except OSError:
+            pass
+    writer.transport.abort()
+
+
+class FaultProxy:
+    """asyncio TCP 代理；start_background() 在独立线程的事件循环中运行，便于从同步代码控制"""
+
+    def __init__(self, listen_host, listen_port, upstream_host, upstream_port, profile=None, seed=None):
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.upstream_host = upstream_host
+        self.upstream_port = upstream_port
+        self.profile = profile or PROFILES['clean']
+        self.rng = random.Random(seed)
+        self.stats = {'connections': 0, 'resets': 0, 'blackholed': 0, 'bytes': 0}
+        self.server = None
+        self.loop = None
+        self.thread = None
+        self.blackholed_writers = set()
+
+    def set_profile(self, profile):
+        """切换故障配置；只影响之后建立的连接（正在黑洞中的连接会被断开）"""
+        self.profile = profile
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._release_blackholed)
+
+    def _release_blackholed(self):
+        for writer in list(self.blackholed_writers):
+            _reset(writer)
+        self.blackholed_writers.clear()
+
+    async def _handle(self, client_reader, client_writer):
+        profile = self.profile
+        self.stats['connections'] += 1
+
+        if profile.blackhole:
+            self.stats['blackholed'] += 1
+            self.blackholed_writers.add(client_writer)
+            try:
+                while await client_reader.read(65536):
+                    pass
+            except (ConnectionError, OSError):
+                pass
+            finally:
+                self.blackholed_writers.discard(client_writer)
+            return
+
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(self.upstream_host, self.upstream_port)
+        except OSError:
+            _reset(client_writer)
+            return
+
+        # 每个连接一个重置点: 在该连接累计转发这么多字节后双向 RST
+        reset_after = None
+        if self.rng.random() < profile.reset_probability:
+            reset_after = self.rng.randint(0, 8192)
+        state = {'bytes': 0, 'reset_after': reset_after, 'done': False}
+
+        await asyncio.gather(
+            self._pump(client_reader, upstream_writer, client_writer, profile, state),
+            self._pump(upstream_reader, client_writer, upstream_writer, profile, state),
+            return_exceptions=True,
+        )
+
+    async def _pump(self, reader, writer, peer_writer, profile, state):
+        try:
+            while not state['done']:
+                data = await reader.read(65536)
+                if not data:
+                    break
+
+                delay = profile.delay_for(len(data), self.rng)
+                if delay:
+                    await asyncio.sleep(delay)
+
+                state['bytes'] += len(data)
+                self.stats['bytes'] += len(data)
+                if state['reset_after'] is not None and state['bytes'] >= state['reset_after']:
+                    state['done'] = True
+                    self.stats['resets'] += 1
+                    _reset(writer)
+                    _reset(peer_writer)
+                    return
+
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if not writer.is_closing():
+                writer.close()
+
+    async def serve(self):
+        self.server = await asyncio.start_server(self._handle, self.listen_host, self.listen_port)
+        # listen_port=0 时使用系统分配的端口
+        self.listen_port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    def start_background(self):
+        """在后台线程中启动代理，返回实际监听端口"""
+        started = threading.Event()
+        errors = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            try:
+                self.loop.run_until_complete(self.serve())
+            except Exception as e:
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        return self.listen_port
+
+    def stop(self):
+        if self.loop is None:
+            return
+
+        async def shutdown():
+            self._release_blackholed()
+            self.server.close()
+            await self.server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PostgreSQL 故障注入代理')
+    parser.add_argument('--listen-host', default='0.0.0.0')
+    parser.add_argument('--listen-port', type=int, default=6543)
+    parser.add_argument('--upstream-host', required=True, help='真实 Open WebUI 数据库地址')
+    parser.add_argument('--upstream-port', type=int, default=5432)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='slow')
+    parser.add_argument('--latency-ms', type=int, help='覆盖配置中的延迟')
+    parser.add_argument('--bandwidth-kbps', type=int, help='覆盖配置中的带宽')
+    parser.add_argument('--reset-probability', type=float, help='覆盖配置中的重置概率')
+    args = parser.parse_args()
+
+    base = PROFILES[args.profile]
+    profile = FaultProfile(
+        base.name,
+        latency_ms=args.latency_ms if args.latency_ms is not None else base.latency_ms,
+        jitter_ms=base.jitter_ms,
+        bandwidth_kbps=args.bandwidth_kbps if args.bandwidth_kbps is not None else base.bandwidth_kbps,
+        reset_probability=args.reset_probability if args.reset_probability is not None else base.reset_probability,
+        blackhole=base.blackhole,
+    )
+
+    proxy = FaultProxy(args.listen_host, args.listen_port, args.upstream_host, args.upstream_port, profile)
+    print(f"🚀 故障代理 {args.listen_host}:{args.listen_port} → {args.upstream_host}:{args.upstream_port} "
+          f"[{profile.name}: {profile.describe()}]")
+
+    async def run():
+        server = await proxy.serve()
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print(f"\n📊 连接 {proxy.stats['connections']}, 重置 {proxy.stats['resets']}, "
+              f"黑洞 {proxy.stats['blackholed']}, 转发 {proxy.stats['bytes']} 字节")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
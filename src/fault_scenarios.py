@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+故障场景执行器 - 让桥接经由 fault_proxy 访问 Open WebUI，测量各故障配置下的 LiteLLM 写入延迟和同步滞后
+
+桥接函数通过 sync_target_override 表改走代理，该表只有安装脚本的角色能写，
+因此本工具需以该角色连接；重定向对整个测试库生效，运行期间不要有其它同步流量。
+注意 dblink 连接是从 PostgreSQL 服务器发起的，--advertise-host 必须是数据库服务器能访问到的本机地址。
+"""
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import sys
+import json
+import time
+import argparse
+
+from bridge_client import connection, dsn_for, close_all
+from fault_proxy import FaultProxy, PROFILES
+
+PROBE_USER_ID = 'fault_probe_user'
+DEFAULT_WRITES = 20
+DEFAULT_STATEMENT_TIMEOUT_MS = 5000
+DEFAULT_CONNECT_TIMEOUT = 3
+LAG_DEADLINE = 10.0
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def proxied_target_dsn(advertise_host, proxy_port, connect_timeout):
+    """把目标库连接串改写为经由代理"""
+    params = psycopg2.extensions.parse_dsn(dsn_for('target'))
+    params.update(host=advertise_host, port=str(proxy_port), connect_timeout=str(connect_timeout))
+    return psycopg2.extensions.make_dsn(**params)
+
+
+def ensure_probe_user():
+    """在无故障条件下创建探针用户"""
+    with connection('source', autocommit=True) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO "LiteLLM_UserTable"
+                (user_id, user_alias, user_email, user_role, teams, max_budget, spend, models, metadata)
+                VALUES (%s, 'fault-probe', 'fault-probe@bridge.test', 'internal_user', '{}', 0, 0, '{}', '{}')
+                ON CONFLICT (user_id) DO NOTHING;
+            """, (PROBE_USER_ID,))
+
+
+def wait_for_target_name(target_cursor, expected_name, started):
+    """直接（不经代理）读取目标库，直到探针用户名称变为 expected_name；返回滞后秒数或 None"""
+    delay = 0.005
+    while time.monotonic() - started < LAG_DEADLINE:
+        target_cursor.execute('SELECT name FROM "user" WHERE id = %s;', ('usr_' + PROBE_USER_ID,))
+        row = target_cursor.fetchone()
+        if row and row[0] == expected_name:
+            return time.monotonic() - started
+        time.sleep(delay)
+        delay = min(delay * 2, 0.2)
+    return None
+
+
+def run_scenario(profile, proxy, proxied_dsn, writes, statement_timeout_ms):
+    """在一个故障配置下执行 writes 次探针更新"""
+    proxy.set_profile(profile)
+    stats_before = dict(proxy.stats)
+    write_latencies = []
+    lags = []
+    timeouts = 0
+    unsynced = 0
+
+    with connection('source', autocommit=True) as source_conn, \
+            connection('target', autocommit=True) as target_conn:
+        source_cursor = source_conn.cursor()
+        target_cursor = target_conn.cursor()
+        source_cursor.execute("""
+            INSERT INTO sync_target_override (id, conn_str) VALUES (true, %s)
+            ON CONFLICT (id) DO UPDATE SET conn_str = EXCLUDED.conn_str,
+                set_by = current_user, created_at = CURRENT_TIMESTAMP;
+        """, (proxied_dsn,))
+        source_cursor.execute("SELECT set_config('statement_timeout', %s, false);", (str(statement_timeout_ms),))
+        source_cursor.execute('SELECT COALESCE(MAX(id), 0) FROM sync_audit;')
+        audit_mark = source_cursor.fetchone()[0]
+
+        try:
+            for i in range(writes):
+                marker = f'probe-{profile.name}-{i}-{time.time_ns()}'
+                started = time.monotonic()
+                try:
+                    source_cursor.execute("""
+                        UPDATE "LiteLLM_UserTable" SET user_alias = %s, updated_at = CURRENT_TIMESTAMP
+                        WHERE user_id = %s;
+                    """, (marker, PROBE_USER_ID))
+                except psycopg2.errors.QueryCanceled:
+                    # 触发器卡在目标库上，LiteLLM 的写入被 statement_timeout 取消
+                    timeouts += 1
+                    continue
+                write_latencies.append(time.monotonic() - started)
+
+                lag = wait_for_target_name(target_cursor, marker, started)
+                if lag is None:
+                    unsynced += 1
+                else:
+                    lags.append(lag)
+        finally:
+            source_cursor.execute('DELETE FROM sync_target_override;')
+            source_cursor.execute('RESET statement_timeout;')
+
+        source_cursor.execute("""
+            SELECT COUNT(*) FROM sync_audit
+            WHERE id > %s AND operation = 'SYNC_USER' AND record_id = %s AND sync_result = 'FAILED';
+        """, (audit_mark, PROBE_USER_ID))
+        sync_failures = source_cursor.fetchone()[0]
+        source_cursor.close()
+        target_cursor.close()
+
+    return {
+        'profile': profile.name,
+        'description': profile.describe(),
+        'writes': writes,
+        'write_p50_ms': _ms(percentile(write_latencies, 0.50)),
+        'write_p95_ms': _ms(percentile(write_latencies, 0.95)),
+        'write_max_ms': _ms(max(write_latencies) if write_latencies else None),
+        'lag_p50_ms': _ms(percentile(lags, 0.50)),
+        'lag_p95_ms': _ms(percentile(lags, 0.95)),
+        'write_timeouts': timeouts,
+        'sync_failures': sync_failures,
+        'unsynced': unsynced,
+        'proxy_connections': proxy.stats['connections'] - stats_before['connections'],
+        'proxy_resets': proxy.stats['resets'] - stats_before['resets'],
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def _fmt(value):
+    return f"{value:.1f}" if value is not None else '-'
+
+
+def run_fault_scenarios(profile_names, advertise_host, listen_host='0.0.0.0', listen_port=0,
+                        writes=DEFAULT_WRITES, statement_timeout_ms=DEFAULT_STATEMENT_TIMEOUT_MS,
+                        connect_timeout=DEFAULT_CONNECT_TIMEOUT, output=None):
+    target_params = psycopg2.extensions.parse_dsn(dsn_for('target'))
+    proxy = FaultProxy(listen_host, listen_port, target_params.get('host', 'localhost'),
+                       int(target_params.get('port', 5432)), seed=42)
+    port = proxy.start_background()
+    proxied_dsn = proxied_target_dsn(advertise_host, port, connect_timeout)
+
+    print(f"🚀 故障代理已启动: {listen_host}:{port} → {target_params.get('host')}:{target_params.get('port', 5432)}")
+    print(f"   桥接经由: {advertise_host}:{port}")
+
+    results = []
+    try:
+        ensure_probe_user()
+        for name in profile_names:
+            profile = PROFILES[name]
+            print(f"\n🔄 场景 {name}: {profile.describe()}")
+            result = run_scenario(profile, proxy, proxied_dsn, writes, statement_timeout_ms)
+            results.append(result)
+            print(f"   写入延迟 p50/p95/max: {_fmt(result['write_p50_ms'])}/{_fmt(result['write_p95_ms'])}/"
+                  f"{_fmt(result['write_max_ms'])}ms, 同步滞后 p50/p95: "
+                  f"{_fmt(result['lag_p50_ms'])}/{_fmt(result['lag_p95_ms'])}ms")
+            print(f"   写入超时 {result['write_timeouts']}, 同步失败 {result['sync_failures']}, "
+                  f"未收敛 {result['unsynced']}, 连接 {result['proxy_connections']}, 重置 {result['proxy_resets']}")
+    finally:
+        proxy.stop()
+        close_all()
+
+    print("\n📊 场景汇总:")
+    print(f"   {'场景':<10} {'写入p95(ms)':>12} {'滞后p95(ms)':>12} {'超时':>6} {'失败':>6}")
+    for r in results:
+        print(f"   {r['profile']:<10} {_fmt(r['write_p95_ms']):>12} {_fmt(r['lag_p95_ms']):>12} "
+              f"{r['write_timeouts']:>6} {r['sync_failures']:>6}")
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump({'writes_per_profile': writes, 'statement_timeout_ms': statement_timeout_ms,
+                       'connect_timeout': connect_timeout, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 结果已写入: {output}")
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='桥接故障场景执行器')
+    parser.add_argument('--advertise-host', required=True,
+                        help='数据库服务器访问本代理使用的地址（dblink 从服务器端发起连接）')
+    parser.add_argument('--listen-host', default='0.0.0.0')
+    parser.add_argument('--listen-port', type=int, default=0, help='0 表示自动分配')
+    parser.add_argument('--profile', action='append', choices=sorted(PROFILES),
+                        help='要执行的故障配置（可重复，默认全部）')
+    parser.add_argument('--writes', type=int, default=DEFAULT_WRITES, help='每个场景的探针写入次数')
+    parser.add_argument('--statement-timeout-ms', type=int, default=DEFAULT_STATEMENT_TIMEOUT_MS)
+    parser.add_argument('--connect-timeout', type=int, default=DEFAULT_CONNECT_TIMEOUT,
+                        help='桥接连接目标库的超时（秒）')
+    parser.add_argument('--output', help='把结果写成 JSON 文件')
+    args = parser.parse_args()
+
+    profiles = args.profile or list(PROFILES)
+    return run_fault_scenarios(profiles, args.advertise_host, args.listen_host, args.listen_port,
+                               args.writes, args.statement_timeout_ms, args.connect_timeout, args.output)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
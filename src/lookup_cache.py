@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+团队属性的进程内查找缓存 - 投递路径解析显示名称时不再每批查询源库
+
+缓存按 id 保存团队的 team_alias，LRU 限制条目数。组织不缓存: 投递路径直接使用变更日志中捕获的整行。
+失效是精确的: multi-target-sync.sql 中的触发器在团队插入、删除或相关列变化时
+NOTIFY bridge_lookup_invalidate，缓存在每次查找前先做一次同步点:
+
+    在监听连接上执行 SELECT 1 → 此前已提交的所有失效通知都会在该语句返回前送达
+
+因此每批变更使用的属性至少与同步点一样新。监听连接断开时无法得知漏掉了哪些通知，
+缓存整体清空，并在重新连上之前直接查询源库、不做缓存。
+"""
+
+import psycopg2
+import json
+import threading
+from collections import OrderedDict
+
+INVALIDATION_CHANNEL = 'bridge_lookup_invalidate'
+DEFAULT_MAX_ENTRIES = 10000
+
+# kind → (按 id 批量读取的查询, 属性列名)；查询结果第一列是 id
+LOOKUPS = {
+    'team': ('SELECT team_id, team_alias FROM "LiteLLM_TeamTable" WHERE team_id = ANY(%s);',
+             ('team_alias',)),
+}
+
+_MISSING = object()
+
+
+class LookupCache:
+    """线程安全；多个投递线程 / 目标库可以共享一个实例"""
+
+    def __init__(self, dsn, max_entries=DEFAULT_MAX_ENTRIES):
+        self.dsn = dsn
+        self.max_entries = max_entries
+        # (kind, id) → 属性字典；源库中不存在的 id 缓存为 None，插入时同样会收到失效通知
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.listener = None
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0, 'resets': 0}
+
+    def _listen(self):
+        try:
+            conn = psycopg2.connect(self.dsn)
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN {INVALIDATION_CHANNEL};')
+            self.listener = conn
+        except psycopg2.Error as e:
+            print(f"   ⚠️ 查找缓存监听连接失败，暂时直接查询: {e}")
+            self.listener = None
+
+    def _reset(self):
+        self.entries.clear()
+        self.stats['resets'] += 1
+        if self.listener is not None and not self.listener.closed:
+            self.listener.close()
+        self.listener = None
+
+    def _sync(self):
+        """同步点: 处理此前已提交的所有失效通知；返回缓存当前是否可用"""
+        if self.listener is None or self.listener.closed:
+            # 断开期间可能漏掉通知，从空缓存重新开始
+            self.entries.clear()
+            self._listen()
+            if self.listener is None:
+                return False
+
+        try:
+            with self.listener.cursor() as cursor:
+                cursor.execute('SELECT 1;')
+        except psycopg2.Error:
+            self._reset()
+            return False
+
+        for notify in self.listener.notifies:
+            try:
+                payload = json.loads(notify.payload)
+                key = (payload['kind'], payload['id'])
+            except (ValueError, KeyError, TypeError):
+                # 无法识别的通知: 保守起见整体清空
+                self.entries.clear()
+                continue
+            if self.entries.pop(key, _MISSING) is not _MISSING:
+                self.stats['invalidations'] += 1
+        del self.listener.notifies[:]
+        return True
+
+    @staticmethod
+    def _load(source_conn, kind, ids):
+        query, columns = LOOKUPS[kind]
+        with source_conn.cursor() as cursor:
+            cursor.execute(query, (list(ids),))
+            rows = cursor.fetchall()
+        source_conn.commit()
+        return {row[0]: dict(zip(columns, row[1:])) for row in rows}
+
+    def get_many(self, source_conn, kind, ids):
+        """返回 {id: 属性字典}，不存在的 id 不出现在结果中；未命中的 id 用一次查询从 source_conn 读取"""
+        ids = {i for i in ids if i}
+        if not ids:
+            return {}
+
+        with self.lock:
+            if not self._sync():
+                return self._load(source_conn, kind, ids)
+
+            result = {}
+            missing = []
+            for entity_id in ids:
+                value = self.entries.get((kind, entity_id), _MISSING)
+                if value is _MISSING:
+                    missing.append(entity_id)
+                    continue
+                self.entries.move_to_end((kind, entity_id))
+                self.stats['hits'] += 1
+                if value is not None:
+                    result[entity_id] = value
+
+            if missing:
+                self.stats['misses'] += len(missing)
+                loaded = self._load(source_conn, kind, missing)
+                for entity_id in missing:
+                    value = loaded.get(entity_id)
+                    self.entries[(kind, entity_id)] = value
+                    if value is not None:
+                        result[entity_id] = value
+
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.stats['evictions'] += 1
+
+            return result
+
+    def close(self):
+        with self.lock:
+            if self.listener is not None and not self.listener.closed:
+                self.listener.close()
+            self.listener = None
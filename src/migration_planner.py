@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+迁移 / 重同步预演 - 在不写入任何数据的前提下，计算 migrate_existing_users_to_openwebui() 会做什么
+
+两个库各用一个服务器端游标按相同顺序（id，COLLATE "C"）流式读取，单次归并得出每个 LiteLLM 用户的动作:
+- create:   Open WebUI 中不存在，将被创建
+- update:   已存在且字段不同，列出变化的字段
+- skip:     没有邮箱 / 已同步（migrate 模式）/ 内容相同 / 目标上的版本更新
+- conflict: 邮箱与一个非桥接创建的 Open WebUI 用户冲突
+- orphan:   Open WebUI 中有 usr_ 用户但 LiteLLM 中已不存在（仅报告）
+
+邮箱冲突在第一遍按邮箱排序的归并中找出，内存只与冲突数量有关；第二遍按 id 归并并逐行写出 JSONL 变更清单。
+"""
+
+import psycopg2
+import sys
+import json
+import argparse
+from collections import Counter
+
+from bridge_client import connection, close_all
+
+DEFAULT_FETCH_SIZE = 2000
+SETTINGS_IGNORED = ('effective_models',)
+INFO_IGNORED = ('source_version', 'usage')
+
+LOCAL_COLUMNS = ('webui_id', 'user_id', 'user_email', 'display_name', 'role', 'sso_user_id',
+                 'settings', 'info', 'version_prefix', 'mapped')
+
+# 与 migrate_existing_users_to_openwebui() 写入的内容保持一致
+LOCAL_USERS_SQL = """
+    SELECT 'usr_' || u.user_id AS webui_id,
+           u.user_id,
+           u.user_email,
+           CASE
+               WHEN u.team_id IS NOT NULL
+                   THEN COALESCE(t.team_alias || '-' || u.user_alias, u.user_alias, 'User-' || u.user_id)
+               ELSE COALESCE(u.user_alias, 'User-' || u.user_id)
+           END AS display_name,
+           CASE WHEN u.user_role IN ('proxy_admin', 'proxy_admin_viewer') THEN 'admin' ELSE 'user' END AS role,
+           u.sso_user_id,
+           json_build_object(
+               'max_budget', u.max_budget,
+               'spend', u.spend,
+               'models', u.models,
+               'metadata', u.metadata,
+               'model_spend', u.model_spend,
+               'model_max_budget', u.model_max_budget
+           )::jsonb AS settings,
+           json_build_object(
+               'organization_id', u.organization_id,
+               'team_id', u.team_id,
+               'original_user_id', u.user_id,
+               'user_role', u.user_role
+           )::jsonb AS info,
+           lpad(floor(EXTRACT(EPOCH FROM COALESCE(u.updated_at, CURRENT_TIMESTAMP)) * 1000000)::bigint::text,
+                20, '0') AS version_prefix,
+           EXISTS (SELECT 1 FROM sync_mapping sm
+                   WHERE sm.litellm_type = 'user' AND sm.litellm_id = u.user_id) AS mapped
+    FROM "LiteLLM_UserTable" u
+    LEFT JOIN "LiteLLM_TeamTable" t ON t.team_id = u.team_id
+    ORDER BY ('usr_' || u.user_id) COLLATE "C";
+"""
+
+REMOTE_USERS_SQL = """
+    SELECT id, email, name, role, oauth_sub, settings::jsonb, info::jsonb
+    FROM "user"
+    WHERE id LIKE 'usr\\_%'
+    ORDER BY id COLLATE "C";
+"""
+
+LOCAL_EMAILS_SQL = """
+    SELECT lower(user_email), user_id
+    FROM "LiteLLM_UserTable"
+    WHERE user_email IS NOT NULL AND user_email != ''
+    ORDER BY lower(user_email) COLLATE "C";
+"""
+
+REMOTE_EMAILS_SQL = """
+    SELECT lower(email), id
+    FROM "user"
+    WHERE id NOT LIKE 'usr\\_%' AND email IS NOT NULL AND email != ''
+    ORDER BY lower(email) COLLATE "C";
+"""
+
+
+def stream(conn, name, sql, fetch_size):
+    """服务器端游标逐行产出"""
+    with conn.cursor(name=name) as cursor:
+        cursor.itersize = fetch_size
+        cursor.execute(sql)
+        for row in cursor:
+            yield row
+
+
+def merge_by_key(left, right):
+    """
+    两个按 key（第一列）升序的流做全外归并，产出 (key, left_rows, right_rows)
+
+    同一 key 的行在各自一侧聚在一起（邮箱不唯一时会有多行），内存只与单个 key 的行数有关。
+    """
+    left_iter, right_iter = iter(left), iter(right)
+    left_row, right_row = next(left_iter, None), next(right_iter, None)
+
+    def take(row, rows_iter):
+        key = row[0]
+        group = [row]
+        row = next(rows_iter, None)
+        while row is not None and row[0] == key:
+            group.append(row)
+            row = next(rows_iter, None)
+        return key, group, row
+
+    while left_row is not None or right_row is not None:
+        if right_row is None or (left_row is not None and left_row[0] < right_row[0]):
+            key, group, left_row = take(left_row, left_iter)
+            yield key, group, []
+        elif left_row is None or right_row[0] < left_row[0]:
+            key, group, right_row = take(right_row, right_iter)
+            yield key, [], group
+        else:
+            key, left_group, left_row = take(left_row, left_iter)
+            _, right_group, right_row = take(right_row, right_iter)
+            yield key, left_group, right_group
+
+
+def find_email_conflicts(source_conn, target_conn, fetch_size):
+    """按邮箱归并，返回 {LiteLLM user_id: 冲突的 Open WebUI 用户 id}"""
+    conflicts = {}
+    for _, local_rows, remote_rows in merge_by_key(
+            stream(source_conn, 'plan_local_emails', LOCAL_EMAILS_SQL, fetch_size),
+            stream(target_conn, 'plan_remote_emails', REMOTE_EMAILS_SQL, fetch_size)):
+        if local_rows and remote_rows:
+            for _, user_id in local_rows:
+                conflicts[user_id] = remote_rows[0][1]
+    return conflicts
+
+
+def _as_dict(value):
+    if isinstance(value, str):
+        return json.loads(value)
+    return value or {}
+
+
+def _without(data, ignored):
+    return {k: v for k, v in _as_dict(data).items() if k not in ignored}
+
+
+def diff_user(local, remote):
+    """返回会被迁移覆盖的字段 {字段: {'from': 目标当前值, 'to': 迁移写入值}}"""
+    _, email, name, role, oauth_sub, settings, info = remote
+    changes = {}
+    for field, old, new in (('email', email, local['user_email']),
+                            ('name', name, local['display_name']),
+                            ('role', role, local['role']),
+                            ('oauth_sub', oauth_sub, local['sso_user_id']),
+                            ('settings', _without(settings, SETTINGS_IGNORED), _without(local['settings'], ())),
+                            ('info', _without(info, INFO_IGNORED), _without(local['info'], ()))):
+        if old != new:
+            changes[field] = {'from': old, 'to': new}
+    return changes
+
+
+def classify(local, remote, mode, conflicts):
+    """一个 id 的归并结果 → 计划条目"""
+    if local is None:
+        return {'action': 'orphan', 'openwebui_id': remote[0]}
+
+    entry = {'user_id': local['user_id'], 'openwebui_id': local['webui_id']}
+
+    if not local['user_email']:
+        return dict(entry, action='skip', reason='no_email')
+    if mode == 'migrate' and local['mapped']:
+        return dict(entry, action='skip', reason='already_synced')
+    if local['user_id'] in conflicts:
+        return dict(entry, action='conflict', reason='email_collision',
+                    email=local['user_email'], conflicting_id=conflicts[local['user_id']])
+    if remote is None:
+        return dict(entry, action='create', email=local['user_email'], name=local['display_name'])
+
+    # 目标上的 source_version 比本次会写入的新时，upsert 的版本守卫会拒绝写入
+    remote_version = _as_dict(remote[6]).get('source_version')
+    if remote_version and remote_version[:20] > local['version_prefix']:
+        return dict(entry, action='skip', reason='remote_newer')
+
+    changes = diff_user(local, remote)
+    if not changes:
+        return dict(entry, action='skip', reason='unchanged')
+    return dict(entry, action='update', changes=changes)
+
+
+def build_plan(output_path, mode='migrate', fetch_size=DEFAULT_FETCH_SIZE):
+    """流式生成计划，逐行写出 JSONL，返回汇总"""
+    summary = Counter()
+    reasons = Counter()
+
+    with connection('source') as source_conn, connection('target') as target_conn:
+        conflicts = find_email_conflicts(source_conn, target_conn, fetch_size)
+
+        with open(output_path, 'w', encoding='utf-8') as out:
+            for _, local_group, remote_group in merge_by_key(
+                    stream(source_conn, 'plan_local_users', LOCAL_USERS_SQL, fetch_size),
+                    stream(target_conn, 'plan_remote_users', REMOTE_USERS_SQL, fetch_size)):
+                local = dict(zip(LOCAL_COLUMNS, local_group[0])) if local_group else None
+                remote = remote_group[0] if remote_group else None
+                entry = classify(local, remote, mode, conflicts)
+
+                summary[entry['action']] += 1
+                if 'reason' in entry:
+                    reasons[f"{entry['action']}:{entry['reason']}"] += 1
+                out.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+
+        source_conn.rollback()
+        target_conn.rollback()
+
+    return {
+        'mode': mode,
+        'actions': dict(summary),
+        'reasons': dict(reasons),
+        'plan_path': output_path,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='迁移 / 重同步预演（不写入任何数据）')
+    parser.add_argument('--mode', choices=('migrate', 'resync'), default='migrate',
+                        help='migrate: 与 migrate_existing_users_to_openwebui() 相同，跳过已映射用户; '
+                             'resync: 所有用户都重新推送')
+    parser.add_argument('--output', default='migration-plan.jsonl', help='JSONL 变更清单路径')
+    parser.add_argument('--summary', help='把汇总另存为 JSON 文件')
+    parser.add_argument('--fetch-size', type=int, default=DEFAULT_FETCH_SIZE, help='服务器端游标每次取回的行数')
+    args = parser.parse_args()
+
+    print(f"🚀 生成{args.mode}计划（预演，不写入数据）...")
+    try:
+        summary = build_plan(args.output, args.mode, args.fetch_size)
+    except psycopg2.Error as e:
+        print(f"❌ 数据库错误: {e}")
+        return False
+    finally:
+        close_all()
+
+    print("\n📊 计划汇总:")
+    for action in ('create', 'update', 'skip', 'conflict', 'orphan'):
+        print(f"   {action:<9} {summary['actions'].get(action, 0)}")
+    for reason, count in sorted(summary['reasons'].items()):
+        print(f"     - {reason}: {count}")
+    print(f"\n✅ 变更清单已写入: {args.output}")
+
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"✅ 汇总已写入: {args.summary}")
+
+    # 有冲突时返回非零，便于在部署流水线中拦截
+    return summary['actions'].get('conflict', 0) == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
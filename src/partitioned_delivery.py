@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+哈希分区并行投递 - 按 LiteLLM 实体键把变更分配到多个工作线程/进程，分区内严格保序
+"""
+
+import psycopg2
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from remote_batch import execute_pipelined
+
+# 每个工作线程/进程独占的目标库连接
+_worker_local = threading.local()
+
+
+def partition_key(change):
+    """
+    变更的保序键
+
+    API key 变更写的是所属用户的 "user".api_key，因此与该用户的变更共用一个键，
+    保证 "更新 → 删除" 不会被并行打乱而让已删除的用户复活。
+    """
+    if change['entity_type'] == 'organization':
+        return 'organization:' + change['entity_id']
+    if change['entity_type'] == 'api_key':
+        return 'user:' + (change['payload'].get('user_id') or '')
+    return 'user:' + change['entity_id']
+
+
+def partition_of(key, partitions):
+    """稳定哈希（跨进程一致，不受 PYTHONHASHSEED 影响）"""
+    return zlib.crc32(key.encode('utf-8')) % partitions
+
+
+def _init_worker(conn_str):
+    """工作线程/进程初始化: 建立自己的目标库连接"""
+    _worker_local.conn_str = conn_str
+    _worker_local.conn = psycopg2.connect(conn_str)
+
+
+def _apply_partition(indexed_statements):
+    """
+    在当前工作者的连接上，用一个远端事务、一次往返执行一个分区的全部变更
+
+    indexed_statements: [(全局变更下标, [(sql, params), ...]), ...]，按变更顺序排列
+    返回 {全局变更下标: 错误信息}
+    """
+    conn = getattr(_worker_local, 'conn', None)
+    if conn is None or conn.closed:
+        conn = _worker_local.conn = psycopg2.connect(_worker_local.conn_str)
+
+    try:
+        failures = execute_pipelined(conn, [stmts for _, stmts in indexed_statements])
+    except Exception:
+        if not conn.closed:
+            conn.close()
+        raise
+
+    return {indexed_statements[i][0]: err for i, err in failures.items()}
+
+
+class PartitionedApplier:
+    """
+    把一批变更按实体键哈希拆分到 N 个分区并行执行
+
+    同一实体总是落在同一分区，分区内按变更 id 顺序执行；整批所有分区完成后才返回，
+    调用方随后推进投递进度。任一分区连接级失败时整批重试（upsert 带版本守卫，可安全重放）。
+    """
+
+    def __init__(self, conn_str, partitions, worker_mode='thread'):
+        self.partitions = partitions
+        executor_cls = ProcessPoolExecutor if worker_mode == 'process' else ThreadPoolExecutor
+        self.executor = executor_cls(
+            max_workers=partitions,
+            initializer=_init_worker,
+            initargs=(conn_str,)
+        )
+
+    def apply(self, keyed_statements):
+        """
+        keyed_statements: [(partition_key, [(sql, params), ...]), ...]，按变更顺序排列
+
+        返回 {变更下标: 错误信息}，只包含语句执行失败的变更"""
+        buckets = [[] for _ in range(self.partitions)]
+        for index, (key, statements) in enumerate(keyed_statements):
+            buckets[partition_of(key, self.partitions)].append((index, statements))
+
+        futures = [self.executor.submit(_apply_partition, bucket) for bucket in buckets if bucket]
+
+        failures = {}
+        errors = []
+        for future in futures:
+            try:
+                failures.update(future.result())
+            except Exception as e:
+                errors.append(str(e))
+
+        if errors:
+            raise RuntimeError(f"{len(errors)}/{len(futures)} 个分区失败: {errors[0]}")
+        return failures
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -6,9 +6,21 @@
 import psycopg2
 import sys
 import time
+import os
+import argparse
 import subprocess
 from datetime import datetime
 
+from bridge_client import connection, close_all
+from test_real_insert import test_real_insert
+from test_real_update import test_real_update
+from test_real_delete import test_real_delete
+from stress_test import run_stress
+from experiment_report import audit_mark, build_report, write_json_report
+from sync_waiter import install_audit_notify, remove_audit_notify
+
+REPORT_PATH = "/home/ubuntu/llm_proxy/integrate/docs/real-experiment-report.md"
+
 def run_real_experiment():
     """执行完整的真实表结构实验"""
     
@@ -17,23 +29,28 @@ def run_real_experiment():
     print("基于实际 LiteLLM 和 Open WebUI 表结构的数据库同步实验")
     print("=" * 70)
     
+    run_started = datetime.now()
+    results = {}
+    
     # 实验步骤
     steps = [
         ("创建实验数据库", create_experiment_databases),
         ("设置表结构和触发器", run_setup_script),
         ("验证环境设置", verify_setup),
+        ("安装测试审计通知", install_audit_notify),
         ("执行INSERT测试", run_insert_test),
         ("执行UPDATE测试", run_update_test),
         ("执行DELETE测试", run_delete_test),
-        ("生成实验报告", generate_final_report)
+        ("生成实验报告", lambda: generate_final_report(results, run_started))
     ]
     
-    results = {}
-    
     for step_name, step_func in steps:
         print(f"\\n🔄 步骤: {step_name}")
         print("-" * 50)
         
+        # 每个阶段写入的审计记录区间（数据库创建前为 None）
+        audit_before = audit_mark()
+        
         try:
             start_time = time.time()
             success = step_func()
@@ -42,7 +59,8 @@ def run_real_experiment():
             results[step_name] = {
                 'success': success,
                 'duration': end_time - start_time,
-                'timestamp': datetime.now()
+                'timestamp': datetime.now(),
+                'audit_range': (audit_before, audit_mark())
             }
             
             if success:
@@ -80,6 +98,15 @@ def run_real_experiment():
         if 'error' in result:
             print(f"      错误: {result['error']}")
     
+    # 审计通知触发器只在测试期间存在
+    try:
+        remove_audit_notify()
+    except psycopg2.Error:
+        pass
+
+    # 各步骤共用的连接池到此为止
+    close_all()
+    
     success_rate = (successful_steps / len(steps)) * 100
     print(f"\\n📈 实验统计:")
     print(f"   成功步骤: {successful_steps}/{len(steps)} ({success_rate:.1f}%)")
@@ -92,32 +119,24 @@ def create_experiment_databases():
     """创建实验数据库"""
     try:
         # 连接默认数据库创建新数据库
-        conn = psycopg2.connect(
-            host="172.21.0.4",
-            port="5432", 
-            database="postgres",
-            user="webui",
-            password="webui"
-        )
-        conn.autocommit = True
-        cursor = conn.cursor()
-        
-        # 创建LiteLLM数据库
-        try:
-            cursor.execute("CREATE DATABASE litellm_real;")
-            print("   ✅ 创建数据库: litellm_real")
-        except psycopg2.errors.DuplicateDatabase:
-            print("   ℹ️  数据库 litellm_real 已存在")
-        
-        # 创建Open WebUI数据库
-        try:
-            cursor.execute("CREATE DATABASE openwebui_real;")
-            print("   ✅ 创建数据库: openwebui_real")
-        except psycopg2.errors.DuplicateDatabase:
-            print("   ℹ️  数据库 openwebui_real 已存在")
-        
-        cursor.close()
-        conn.close()
+        with connection('admin', autocommit=True) as conn:
+            cursor = conn.cursor()
+            
+            # 创建LiteLLM数据库
+            try:
+                cursor.execute("CREATE DATABASE litellm_real;")
+                print("   ✅ 创建数据库: litellm_real")
+            except psycopg2.errors.DuplicateDatabase:
+                print("   ℹ️  数据库 litellm_real 已存在")
+            
+            # 创建Open WebUI数据库
+            try:
+                cursor.execute("CREATE DATABASE openwebui_real;")
+                print("   ✅ 创建数据库: openwebui_real")
+            except psycopg2.errors.DuplicateDatabase:
+                print("   ℹ️  数据库 openwebui_real 已存在")
+            
+            cursor.close()
         return True
         
     except Exception as e:
@@ -128,7 +147,7 @@ def run_setup_script():
     """运行环境设置脚本"""
     try:
         result = subprocess.run(
-            ['python', 'integrate/src/setup_real_experiment.py'],
+            [sys.executable, 'integrate/src/setup_real_experiment.py'],
             cwd='/home/ubuntu/llm_proxy',
             capture_output=True,
             text=True,
@@ -159,54 +178,40 @@ def verify_setup():
     """验证环境设置"""
     try:
         # 连接源数据库检查表
-        source_conn = psycopg2.connect(
-            host="172.21.0.4",
-            port="5432",
-            database="litellm_real",
-            user="webui",
-            password="webui"
-        )
-        source_cursor = source_conn.cursor()
-        
-        # 检查LiteLLM表
-        litellm_tables = ['LiteLLM_OrganizationTable', 'LiteLLM_TeamTable', 'LiteLLM_UserTable']
-        for table in litellm_tables:
-            source_cursor.execute(f'SELECT COUNT(*) FROM "{table}";')
-            count = source_cursor.fetchone()[0]
-            print(f"   ✅ {table}: {count} 条记录")
-        
-        # 检查同步函数
-        source_cursor.execute("SELECT COUNT(*) FROM pg_proc WHERE proname LIKE 'sync_%';")
-        func_count = source_cursor.fetchone()[0]
-        print(f"   ✅ 同步函数数量: {func_count}")
-        
-        # 检查触发器
-        source_cursor.execute("SELECT COUNT(*) FROM pg_trigger WHERE tgname LIKE '%sync%' OR tgname LIKE '%delete%';")
-        trigger_count = source_cursor.fetchone()[0]
-        print(f"   ✅ 触发器数量: {trigger_count}")
-        
-        source_cursor.close()
-        source_conn.close()
+        with connection('source') as source_conn:
+            source_cursor = source_conn.cursor()
+            
+            # 检查LiteLLM表
+            litellm_tables = ['LiteLLM_OrganizationTable', 'LiteLLM_TeamTable', 'LiteLLM_UserTable']
+            for table in litellm_tables:
+                source_cursor.execute(f'SELECT COUNT(*) FROM "{table}";')
+                count = source_cursor.fetchone()[0]
+                print(f"   ✅ {table}: {count} 条记录")
+            
+            # 检查同步函数
+            source_cursor.execute("SELECT COUNT(*) FROM pg_proc WHERE proname LIKE 'sync_%';")
+            func_count = source_cursor.fetchone()[0]
+            print(f"   ✅ 同步函数数量: {func_count}")
+            
+            # 检查触发器
+            source_cursor.execute("SELECT COUNT(*) FROM pg_trigger WHERE tgname LIKE '%sync%' OR tgname LIKE '%delete%';")
+            trigger_count = source_cursor.fetchone()[0]
+            print(f"   ✅ 触发器数量: {trigger_count}")
+            
+            source_cursor.close()
         
         # 连接目标数据库检查表
-        target_conn = psycopg2.connect(
-            host="172.21.0.4",
-            port="5432",
-            database="openwebui_real",
-            user="webui",
-            password="webui"
-        )
-        target_cursor = target_conn.cursor()
-        
-        # 检查Open WebUI表
-        openwebui_tables = ['user', 'group']
-        for table in openwebui_tables:
-            target_cursor.execute(f'SELECT COUNT(*) FROM "{table}";')
-            count = target_cursor.fetchone()[0]
-            print(f"   ✅ Open WebUI {table}: {count} 条记录")
-        
-        target_cursor.close()
-        target_conn.close()
+        with connection('target') as target_conn:
+            target_cursor = target_conn.cursor()
+            
+            # 检查Open WebUI表
+            openwebui_tables = ['user', 'group']
+            for table in openwebui_tables:
+                target_cursor.execute(f'SELECT COUNT(*) FROM "{table}";')
+                count = target_cursor.fetchone()[0]
+                print(f"   ✅ Open WebUI {table}: {count} 条记录")
+            
+            target_cursor.close()
         
         return True
         
@@ -214,124 +219,60 @@ def verify_setup():
         print(f"   ❌ 环境验证失败: {e}")
         return False
 
-def run_insert_test():
-    """运行INSERT测试"""
+def run_test_phase(label, test_func):
+    """在当前进程内执行测试阶段，复用已预热的连接池"""
     try:
-        result = subprocess.run(
-            ['python', 'integrate/src/test_real_insert.py'],
-            cwd='/home/ubuntu/llm_proxy',
-            capture_output=True,
-            text=True,
-            timeout=120
-        )
-        
-        if result.returncode == 0:
-            print("   ✅ INSERT测试通过")
-            # 显示测试结果摘要
-            lines = result.stdout.split('\\n')
-            for line in lines:
-                if '✅' in line and ('测试通过' in line or 'INSERT' in line):
-                    print(f"   {line}")
+        if test_func():
+            print(f"   ✅ {label}测试通过")
             return True
-        else:
-            print(f"   ❌ INSERT测试失败")
-            # 显示错误信息
-            lines = result.stdout.split('\\n')
-            for line in lines[-5:]:
-                if line.strip():
-                    print(f"   {line}")
-            return False
-            
+        print(f"   ❌ {label}测试失败")
+        return False
     except Exception as e:
-        print(f"   ❌ INSERT测试异常: {e}")
+        print(f"   ❌ {label}测试异常: {e}")
         return False
 
+def run_insert_test():
+    """运行INSERT测试"""
+    return run_test_phase('INSERT', test_real_insert)
+
 def run_update_test():
     """运行UPDATE测试"""
-    try:
-        result = subprocess.run(
-            ['python', 'integrate/src/test_real_update.py'],
-            cwd='/home/ubuntu/llm_proxy',
-            capture_output=True,
-            text=True,
-            timeout=120
-        )
-        
-        if result.returncode == 0:
-            print("   ✅ UPDATE测试通过")
-            return True
-        else:
-            print(f"   ❌ UPDATE测试失败")
-            # 显示错误信息
-            lines = result.stdout.split('\\n')
-            for line in lines[-5:]:
-                if line.strip():
-                    print(f"   {line}")
-            return False
-            
-    except Exception as e:
-        print(f"   ❌ UPDATE测试异常: {e}")
-        return False
+    return run_test_phase('UPDATE', test_real_update)
 
 def run_delete_test():
     """运行DELETE测试"""
-    try:
-        result = subprocess.run(
-            ['python', 'integrate/src/test_real_delete.py'],
-            cwd='/home/ubuntu/llm_proxy',
-            capture_output=True,
-            text=True,
-            timeout=120
-        )
-        
-        if result.returncode == 0:
-            print("   ✅ DELETE测试通过")
-            return True
-        else:
-            print(f"   ❌ DELETE测试失败")
-            # 显示错误信息 
-            lines = result.stdout.split('\\n')
-            for line in lines[-5:]:
-                if line.strip():
-                    print(f"   {line}")
-            return False
-            
-    except Exception as e:
-        print(f"   ❌ DELETE测试异常: {e}")
-        return False
+    return run_test_phase('DELETE', test_real_delete)
 
-def generate_final_report():
-    """生成最终实验报告"""
+def generate_final_report(results, run_started):
+    """生成最终实验报告（Markdown + 同名 JSON）"""
     try:
         # 收集统计数据
-        source_conn = psycopg2.connect(
-            host="172.21.0.4",
-            port="5432",
-            database="litellm_real",
-            user="webui",
-            password="webui"
-        )
-        source_cursor = source_conn.cursor()
-        
-        # 获取最终统计
-        source_cursor.execute("SELECT * FROM check_real_sync_status();")
-        status_data = source_cursor.fetchall()
-        
-        # 获取审计统计
-        source_cursor.execute("""
-            SELECT operation, COUNT(*) as total,
-                   COUNT(CASE WHEN sync_result = 'SUCCESS' THEN 1 END) as success
-            FROM sync_audit 
-            GROUP BY operation 
-            ORDER BY operation;
-        """)
-        audit_data = source_cursor.fetchall()
+        with connection('source') as source_conn:
+            source_cursor = source_conn.cursor()
+            
+            # 获取最终统计
+            source_cursor.execute("SELECT * FROM check_real_sync_status();")
+            status_data = source_cursor.fetchall()
+            
+            # 获取审计统计
+            source_cursor.execute("""
+                SELECT operation, COUNT(*) as total,
+                       COUNT(CASE WHEN sync_result = 'SUCCESS' THEN 1 END) as success
+                FROM sync_audit 
+                GROUP BY operation 
+                ORDER BY operation;
+            """)
+            audit_data = source_cursor.fetchall()
+            
+            source_cursor.close()
         
-        source_cursor.close()
-        source_conn.close()
+        # 机器可读报告: 阶段耗时/吞吐、按操作的数量与同步延迟百分位、环境信息
+        report = build_report(results, run_started)
+        json_path = REPORT_PATH[:-len('.md')] + '.json'
+        write_json_report(json_path, report)
         
         # 生成报告
-        report_path = "/home/ubuntu/llm_proxy/integrate/docs/real-experiment-report.md"
+        report_path = REPORT_PATH
         
         with open(report_path, 'w', encoding='utf-8') as f:
             f.write("# 真实表结构数据库同步实验报告\\n\\n")
@@ -362,6 +303,20 @@ def generate_final_report():
             
             f.write(f"\\n**总体成功率**: {total_success}/{total_ops} ({overall_rate:.1f}%)\\n\\n")
             
+            f.write("## 同步延迟（本次运行）\\n\\n")
+            f.write("| 操作 | 记录数 | p50 (ms) | p95 (ms) | p99 (ms) |\\n|---|---|---|---|---|\\n")
+            for operation, op_stats in report['operations'].items():
+                latency = op_stats['latency_ms']
+                if latency['samples']:
+                    f.write(f"| {operation} | {latency['samples']} | {latency['p50']} | {latency['p95']} | {latency['p99']} |\\n")
+            f.write("\\n")
+            
+            f.write("## 阶段耗时\\n\\n")
+            for phase in report['phases']:
+                throughput = f", {phase['throughput_ops_per_s']} 审计记录/s" if phase['throughput_ops_per_s'] else ""
+                f.write(f"- {'✅' if phase['success'] else '❌'} **{phase['name']}**: {phase['duration_s']}s{throughput}\\n")
+            f.write(f"\\n机器可读报告: `{os.path.basename(json_path)}`\\n\\n")
+            
             f.write("## 技术特性\\n\\n")
             f.write("### 表结构映射\\n")
             f.write("- **LiteLLM_OrganizationTable** → Open WebUI **group**\\n")
@@ -381,28 +336,51 @@ def generate_final_report():
             f.write("- **映射维护**: sync_mapping 表跟踪所有同步关系\\n\\n")
             
             f.write("## 结论\\n\\n")
-            if overall_rate >= 95:
+            phases_passed = all(r['success'] for r in results.values())
+            if phases_passed and overall_rate >= 95:
                 f.write("✅ **实验成功**: 真实表结构同步系统运行稳定，可投入生产环境使用。\\n\\n")
             else:
                 f.write("❌ **实验部分成功**: 需要进一步优化和调试。\\n\\n")
             
+            # 功能点按对应测试阶段的实际结果勾选
+            def checked(step_name):
+                return 'x' if results.get(step_name, {}).get('success') else ' '
+            
             f.write("### 验证的功能点\\n")
-            f.write("- [x] 组织创建和同步\\n")
-            f.write("- [x] 用户创建和复杂名称映射\\n") 
-            f.write("- [x] 角色权限正确转换\\n")
-            f.write("- [x] 用户和组织信息更新同步\\n")
-            f.write("- [x] 级联删除和清理\\n")
-            f.write("- [x] 完整的审计追踪\\n")
-            f.write("- [x] 错误处理和恢复\\n\\n")
+            f.write(f"- [{checked('执行INSERT测试')}] 组织创建和同步\\n")
+            f.write(f"- [{checked('执行INSERT测试')}] 用户创建和复杂名称映射\\n")
+            f.write(f"- [{checked('执行INSERT测试')}] 角色权限正确转换\\n")
+            f.write(f"- [{checked('执行UPDATE测试')}] 用户和组织信息更新同步\\n")
+            f.write(f"- [{checked('执行DELETE测试')}] 级联删除和清理\\n")
+            f.write(f"- [{'x' if total_ops > 0 else ' '}] 完整的审计追踪\\n\\n")
             
             f.write(f"---\\n\\n*报告生成时间: {datetime.now().isoformat()}*\\n")
         
         print(f"   ✅ 实验报告已生成: {report_path}")
+        print(f"   ✅ JSON 报告已生成: {json_path}")
         return True
         
     except Exception as e:
         print(f"   ❌ 报告生成失败: {e}")
         return False
 
+def main():
+    parser = argparse.ArgumentParser(description='真实表结构实验执行器')
+    parser.add_argument('--stress', action='store_true', help='并发 CRUD 压力模式（代替顺序功能测试）')
+    parser.add_argument('--sessions', type=int, default=16, help='并发会话数')
+    parser.add_argument('--operations', type=int, default=200, help='每个会话的操作数')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子（基线与桥接阶段使用相同工作负载）')
+    parser.add_argument('--worker-mode', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--no-baseline', action='store_true', help='跳过关闭触发器的基线阶段')
+    args = parser.parse_args()
+
+    if args.stress:
+        try:
+            return run_stress(args.sessions, args.operations, args.seed,
+                              worker_mode=args.worker_mode, baseline=not args.no_baseline)
+        finally:
+            close_all()
+    return run_real_experiment()
+
 if __name__ == "__main__":
-    sys.exit(0 if run_real_experiment() else 1)
\ No newline at end of file
+    sys.exit(0 if main() else 1)
\ No newline at end of file
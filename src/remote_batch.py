@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+远端流水线批量执行 - 把一批变更的全部语句组装成一个远端事务，一次网络往返发送
+
+与 SQL 端的 sync_remote_batch() 使用相同的脚本结构: 远端 DO 块逐条执行语句，
+每条语句在自己的子事务中运行；同一组（同一条变更）内某条语句失败后，该组剩余语句跳过，
+其它组照常执行。失败信息经 set_config 回传，由同一次往返中的 SELECT 读出。
+"""
+
+import json
+
+BATCH_DOLLAR_TAG = '$bridge_batch$'
+
+PIPELINE_TEMPLATE = """
+DO {tag}
+DECLARE
+    stmts TEXT[] := {statements}::text[];
+    stmt_groups INTEGER[] := {groups}::integer[];
+    failed_groups INTEGER[] := '{{}}'::integer[];
+    failures JSONB := '[]'::jsonb;
+BEGIN
+    FOR i IN 1 .. COALESCE(array_length(stmts, 1), 0) LOOP
+        IF stmt_groups[i] = ANY(failed_groups) THEN
+            failures := failures || jsonb_build_array(jsonb_build_object(
+                'stmt', i - 1, 'group', stmt_groups[i], 'skipped', true));
+            CONTINUE;
+        END IF;
+        BEGIN
+            EXECUTE stmts[i];
+        EXCEPTION WHEN OTHERS THEN
+            failed_groups := failed_groups || stmt_groups[i];
+            failures := failures || jsonb_build_array(jsonb_build_object(
+                'stmt', i - 1, 'group', stmt_groups[i], 'error', SQLERRM));
+        END;
+    END LOOP;
+    PERFORM set_config('bridge.batch_failures', failures::text, true);
+END
+{tag};
+SELECT current_setting('bridge.batch_failures');
+"""
+
+
+def render_statement(cursor, sql, params):
+    """在客户端把参数渲染进语句（与 SQL 端 format('%L') 等价）"""
+    if params is None:
+        return sql
+    rendered = cursor.mogrify(sql, params)
+    return rendered.decode('utf-8') if isinstance(rendered, bytes) else rendered
+
+
+def build_pipeline_script(cursor, grouped_statements):
+    """
+    grouped_statements: [[(sql, params), ...], ...]，每个内层列表是一组（通常对应一条变更）
+
+    返回 (script, statement_count)
+    """
+    statements = []
+    groups = []
+    for group_index, group in enumerate(grouped_statements):
+        for sql, params in group:
+            text = render_statement(cursor, sql, params)
+            if BATCH_DOLLAR_TAG in text:
+                raise ValueError(f"语句中不能包含 {BATCH_DOLLAR_TAG}")
+            statements.append(text)
+            groups.append(group_index)
+
+    if not statements:
+        return None, 0
+
+    script = PIPELINE_TEMPLATE.format(
+        tag=BATCH_DOLLAR_TAG,
+        statements=render_statement(cursor, '%s', (statements,)),
+        groups=render_statement(cursor, '%s', (groups,)),
+    )
+    return script, len(statements)
+
+
+def execute_pipelined(conn, grouped_statements):
+    """
+    一次往返执行整批语句并提交
+
+    返回 {group_index: error_message}，只包含失败的组；连接级错误直接抛出（整批可重试）。
+    """
+    try:
+        with conn.cursor() as cursor:
+            script, count = build_pipeline_script(cursor, grouped_statements)
+            if count == 0:
+                return {}
+            cursor.execute(script)
+            raw = cursor.fetchone()[0]
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+
+    return parse_failures(raw)
+
+
+def parse_failures(raw):
+    """把远端回传的失败列表转换为 {group_index: error_message}（跳过的语句不单独计入）"""
+    failed = {}
+    for failure in json.loads(raw or '[]'):
+        if 'error' in failure:
+            failed[failure['group']] = failure['error']
+    return failed
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+长时间浸泡测试 - 测量桥接在持续更新负载下带来的表膨胀、autovacuum 压力和 WAL 量（仅用于测试数据库）
+
+每种桥接模式依次运行相同时长的持续更新负载:
+- off:     所有桥接触发器都关闭（基线）
+- trigger: 直接同步触发器（每次写入通过 dblink 同步到 Open WebUI）
+- outbox:  变更捕获触发器 + 投递引擎（multi-target-sync.sql / sync_delivery.py）；
+           开始前把所投递目标库的进度推进到当前变更日志末尾，只投递本模式产生的变更
+两种桥接模式都启用有效模型物化触发器（effective-models.sql）；查找缓存失效触发器属于 outbox 模式；
+测试用审计通知触发器（test-audit-notify.sql）在所有模式下都关闭。
+
+运行期间周期性采样两端的 pg_stat_user_tables、pg_total_relation_size 和 pg_current_wal_lsn()，
+报告每一百万次源库写入对应的表增长、死元组、autovacuum 次数和 WAL 字节数。
+两个数据库在同一实例上时 WAL 是共享的，只报告一次。
+
+模式通过 ALTER TABLE ... ENABLE / DISABLE TRIGGER 切换（需要表的所有者权限），结束后恢复原状态。
+"""
+
+import psycopg2
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from bridge_client import checkout, release, connection, ensure_pool_capacity, close_all
+
+SOAK_PREFIX = 'soak_'
+MODES = ('off', 'trigger', 'outbox')
+
+# 表 → 桥接触发器
+DIRECT_TRIGGERS = {
+    'LiteLLM_OrganizationTable': ('organization_sync_trigger', 'organization_delete_trigger'),
+    'LiteLLM_UserTable': ('user_sync_trigger', 'user_delete_trigger'),
+    'LiteLLM_VerificationToken': ('trigger_sync_api_key_to_webui', 'trigger_sync_api_key_delete_to_webui'),
+}
+CAPTURE_TRIGGERS = {
+    'LiteLLM_OrganizationTable': ('organization_capture_trigger',),
+    'LiteLLM_UserTable': ('user_capture_trigger',),
+    'LiteLLM_VerificationToken': ('api_key_capture_trigger', 'api_key_delete_capture_trigger'),
+    'LiteLLM_TeamTable': ('team_lookup_invalidate_trigger', 'team_lookup_update_invalidate_trigger'),
+}
+EFFECTIVE_MODELS_TRIGGERS = {
+    'LiteLLM_OrganizationTable': ('effective_models_organization_trigger',),
+    'LiteLLM_UserTable': ('effective_models_user_trigger',),
+    'LiteLLM_TeamTable': ('effective_models_team_trigger',),
+}
+TEST_TRIGGERS = {
+    'sync_audit': ('sync_audit_notify_trigger',),
+}
+
+# 触发器组 → 启用它的模式
+MODE_TRIGGERS = (
+    (DIRECT_TRIGGERS, ('trigger',)),
+    (CAPTURE_TRIGGERS, ('outbox',)),
+    (EFFECTIVE_MODELS_TRIGGERS, ('trigger', 'outbox')),
+    (TEST_TRIGGERS, ()),
+)
+
+SAMPLED_TABLES = {
+    'source': ('sync_audit', 'sync_mapping', 'sync_mapping_state', 'sync_change_log', 'sync_target_progress',
+               'LiteLLM_UserTable', 'LiteLLM_OrganizationTable', 'LiteLLM_VerificationToken'),
+    'target': ('user', 'auth', 'group'),
+}
+
+TABLE_STATS_SQL = """
+    SELECT relname, n_tup_ins, n_tup_upd, n_tup_hot_upd, n_tup_del, n_live_tup, n_dead_tup,
+           autovacuum_count, autoanalyze_count, pg_total_relation_size(relid)
+    FROM pg_stat_user_tables
+    WHERE schemaname = 'public' AND relname = ANY(%s);
+"""
+
+TABLE_COLUMNS = ('n_tup_ins', 'n_tup_upd', 'n_tup_hot_upd', 'n_tup_del', 'n_live_tup', 'n_dead_tup',
+                 'autovacuum_count', 'autoanalyze_count', 'total_bytes')
+
+
+def _lsn_bytes(lsn):
+    high, low = lsn.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def _names(kind, count):
+    return [f'{SOAK_PREFIX}{kind}_{i}' for i in range(count)]
+
+
+# -----------------------------------------------------------------------------
+# 模式切换
+# -----------------------------------------------------------------------------
+
+def trigger_states():
+    """{(表, 触发器): tgenabled}，只包含已安装的桥接触发器"""
+    wanted = [(table, name) for group, _ in MODE_TRIGGERS
+              for table, names in group.items() for name in names]
+    with connection('source') as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT c.relname, t.tgname, t.tgenabled
+                FROM pg_trigger t
+                JOIN pg_class c ON c.oid = t.tgrelid
+                WHERE NOT t.tgisinternal
+                  AND (c.relname::text, t.tgname::text) IN (SELECT * FROM unnest(%s::text[], %s::text[]));
+            """, ([t for t, _ in wanted], [n for _, n in wanted]))
+            states = {(table, name): enabled for table, name, enabled in cursor.fetchall()}
+        conn.rollback()
+    return states
+
+
+def set_triggers(states, enable):
+    """enable: {(表, 触发器): bool}"""
+    with connection('source') as conn:
+        with conn.cursor() as cursor:
+            for (table, name), on in enable.items():
+                if (table, name) in states:
+                    cursor.execute(f'ALTER TABLE "{table}" {"ENABLE" if on else "DISABLE"} TRIGGER "{name}";')
+        conn.commit()
+
+
+def apply_mode(states, mode):
+    enable = {}
+    for group, modes in MODE_TRIGGERS:
+        for table, names in group.items():
+            for name in names:
+                enable[(table, name)] = mode in modes
+    set_triggers(states, enable)
+
+
+def restore_triggers(states):
+    set_triggers(states, {key: enabled != 'D' for key, enabled in states.items()})
+
+
+# -----------------------------------------------------------------------------
+# 工作负载: 持续的小更新，每个操作一个事务 = 一次源库写入
+# -----------------------------------------------------------------------------
+
+def seed(space):
+    with connection('source') as conn:
+        with conn.cursor() as cursor:
+            for org_id in space['orgs']:
+                cursor.execute("""
+                    INSERT INTO "LiteLLM_OrganizationTable"
+                    (organization_id, organization_alias, budget_id, models, spend, metadata, created_by, updated_by)
+                    VALUES (%s, %s, 'budget_soak', %s, 0, '{}', 'soak', 'soak')
+                    ON CONFLICT (organization_id) DO NOTHING
+                """, (org_id, f'Soak Org {org_id}', ['gpt-4']))
+            for i, user_id in enumerate(space['users']):
+                cursor.execute("""
+                    INSERT INTO "LiteLLM_UserTable"
+                    (user_id, user_alias, organization_id, user_email, user_role, teams, max_budget, spend, models,
+                     metadata)
+                    VALUES (%s, %s, %s, %s, 'internal_user', '{}', 1000, 0, %s, '{}')
+                    ON CONFLICT (user_id) DO NOTHING
+                """, (user_id, f'Soak User {i}', space['orgs'][i % len(space['orgs'])],
+                      f'{user_id}@soak.test', ['gpt-4']))
+            for i, token in enumerate(space['keys']):
+                cursor.execute("""
+                    INSERT INTO "LiteLLM_VerificationToken" (token, user_id, key_alias, models)
+                    VALUES (%s, %s, 'soak', %s)
+                    ON CONFLICT (token) DO NOTHING
+                """, (token, space['users'][i % len(space['users'])], ['gpt-4']))
+        conn.commit()
+
+
+def cleanup(space):
+    pattern = SOAK_PREFIX.replace('_', '\\_') + '%'
+    with connection('source') as conn:
+        with conn.cursor() as cursor:
+            if space['keys']:
+                cursor.execute('DELETE FROM "LiteLLM_VerificationToken" WHERE token LIKE %s;', (pattern,))
+            cursor.execute('DELETE FROM "LiteLLM_UserTable" WHERE user_id LIKE %s;', (pattern,))
+            cursor.execute('DELETE FROM "LiteLLM_OrganizationTable" WHERE organization_id LIKE %s;', (pattern,))
+            cursor.execute('DELETE FROM sync_mapping WHERE litellm_id LIKE %s;', (pattern,))
+        conn.commit()
+
+    with connection('target') as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('DELETE FROM auth WHERE id LIKE %s;', ('usr\\_' + pattern,))
+            cursor.execute('DELETE FROM "user" WHERE id LIKE %s;', ('usr\\_' + pattern,))
+            cursor.execute('DELETE FROM "group" WHERE id LIKE %s;', ('grp\\_' + pattern,))
+        conn.commit()
+
+
+def op_user_spend(cursor, rng, space):
+    cursor.execute('UPDATE "LiteLLM_UserTable" SET spend = spend + %s, updated_at = CURRENT_TIMESTAMP '
+                   'WHERE user_id = %s;', (rng.random() / 100, rng.choice(space['users'])))
+
+
+def op_user_profile(cursor, rng, space):
+    cursor.execute('UPDATE "LiteLLM_UserTable" SET user_alias = %s, metadata = %s, updated_at = CURRENT_TIMESTAMP '
+                   'WHERE user_id = %s;',
+                   (f'Soak User {rng.randint(0, 99999)}', json.dumps({'note': rng.randint(0, 99999)}),
+                    rng.choice(space['users'])))
+
+
+def op_org_spend(cursor, rng, space):
+    cursor.execute('UPDATE "LiteLLM_OrganizationTable" SET spend = spend + %s, updated_at = CURRENT_TIMESTAMP '
+                   'WHERE organization_id = %s;', (rng.random() / 10, rng.choice(space['orgs'])))
+
+
+def op_key_alias(cursor, rng, space):
+    cursor.execute('UPDATE "LiteLLM_VerificationToken" SET key_alias = %s WHERE token = %s;',
+                   (f'soak-{rng.randint(0, 99999)}', rng.choice(space['keys'])))
+
+
+OPERATIONS = [
+    (op_user_spend, 70, False),
+    (op_user_profile, 15, False),
+    (op_org_spend, 10, False),
+    (op_key_alias, 5, True),
+]
+
+
+class WriteCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.errors = 0
+
+    def add(self, ok):
+        with self.lock:
+            if ok:
+                self.writes += 1
+            else:
+                self.errors += 1
+
+
+def run_session(session_id, deadline, seed_value, space, counter):
+    rng = random.Random(seed_value * 1000 + session_id)
+    available = [(op, weight) for op, weight, needs_keys in OPERATIONS if space['keys'] or not needs_keys]
+    ops, weights = zip(*available)
+
+    conn = checkout('source')
+    cursor = conn.cursor()
+    try:
+        while time.monotonic() < deadline:
+            try:
+                rng.choices(ops, weights)[0](cursor, rng, space)
+                conn.commit()
+                counter.add(True)
+            except psycopg2.Error:
+                conn.rollback()
+                counter.add(False)
+    finally:
+        cursor.close()
+        release('source', conn)
+
+
+# -----------------------------------------------------------------------------
+# 采样
+# -----------------------------------------------------------------------------
+
+def sample_database(db):
+    with connection(db) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_current_wal_lsn()::text;')
+            lsn = cursor.fetchone()[0]
+            cursor.execute(TABLE_STATS_SQL, (list(SAMPLED_TABLES[db]),))
+            tables = {row[0]: dict(zip(TABLE_COLUMNS, row[1:])) for row in cursor.fetchall()}
+        conn.rollback()
+    return {'wal_bytes': _lsn_bytes(lsn), 'tables': tables}
+
+
+class Sampler(threading.Thread):
+    def __init__(self, interval, counter, started):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.counter = counter
+        self.started = started
+        self.stop_event = threading.Event()
+        self.samples = []
+
+    def take(self):
+        sample = {'elapsed_s': round(time.monotonic() - self.started, 1), 'writes': self.counter.writes}
+        for db in SAMPLED_TABLES:
+            sample[db] = sample_database(db)
+        self.samples.append(sample)
+        return sample
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.take()
+            except psycopg2.Error as e:
+                print(f"   ⚠️ 采样失败: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+def same_cluster():
+    """两个逻辑数据库是否在同一个 PostgreSQL 实例上（共享 WAL）"""
+    identifiers = []
+    for db in SAMPLED_TABLES:
+        with connection(db) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT system_identifier FROM pg_control_system();')
+                identifiers.append(cursor.fetchone()[0])
+            conn.rollback()
+    return len(set(identifiers)) == 1
+
+
+def summarize(first, last, shared_wal):
+    """首尾采样的差值，并按每一百万次源库写入归一化"""
+    writes = last['writes'] - first['writes']
+    scale = 1_000_000 / writes if writes else 0
+    result = {'writes': writes, 'duration_s': last['elapsed_s'] - first['elapsed_s'], 'databases': {}}
+
+    for db in SAMPLED_TABLES:
+        wal = last[db]['wal_bytes'] - first[db]['wal_bytes']
+        tables = {}
+        for name, end in last[db]['tables'].items():
+            start = first[db]['tables'].get(name, dict.fromkeys(TABLE_COLUMNS, 0))
+            delta = {column: end[column] - start[column] for column in TABLE_COLUMNS}
+            updates = delta['n_tup_upd']
+            tables[name] = {
+                'growth_bytes': delta['total_bytes'],
+                'growth_bytes_per_million': round(delta['total_bytes'] * scale),
+                'rows_written_per_million': round((delta['n_tup_ins'] + updates + delta['n_tup_del']) * scale),
+                'hot_update_ratio': round(delta['n_tup_hot_upd'] / updates, 3) if updates else None,
+                'dead_tuples': end['n_dead_tup'],
+                'autovacuum_runs': delta['autovacuum_count'],
+                'autovacuum_runs_per_million': round(delta['autovacuum_count'] * scale, 1),
+                'autoanalyze_runs': delta['autoanalyze_count'],
+            }
+        result['databases'][db] = {'wal_bytes': wal, 'wal_bytes_per_million': round(wal * scale), 'tables': tables}
+
+    if shared_wal:
+        result['databases']['target']['wal_bytes'] = None
+        result['databases']['target']['wal_bytes_per_million'] = None
+    return result
+
+
+# -----------------------------------------------------------------------------
+# 运行
+# -----------------------------------------------------------------------------
+
+def start_delivery(target_names):
+    """outbox 模式: 后台投递线程，返回 (停止函数, 目标库列表)"""
+    from sync_delivery import SOURCE_DSN, load_targets, run_target_worker
+
+    source_conn = psycopg2.connect(SOURCE_DSN)
+    try:
+        # 跳过运行前已积压的变更，否则 outbox 模式的目标端写入和 WAL 会被放大
+        with source_conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE sync_target_progress p SET
+                    last_change_id = GREATEST(p.last_change_id, m.max_id),
+                    last_high_change_id = GREATEST(p.last_high_change_id, m.max_id)
+                FROM (SELECT COALESCE(MAX(id), 0) AS max_id FROM sync_change_log) m,
+                     sync_target t
+                WHERE t.target_name = p.target_name AND t.enabled
+                  AND (%(names)s::text[] IS NULL OR t.target_name = ANY(%(names)s::text[]));
+            """, {'names': list(target_names) if target_names else None})
+            if cursor.rowcount:
+                print(f"   ⏩ 已将 {cursor.rowcount} 个目标库的进度推进到变更日志末尾")
+        source_conn.commit()
+        targets = load_targets(source_conn, target_names)
+    finally:
+        source_conn.close()
+    if not targets:
+        return None
+
+    stop_event = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(targets))
+    futures = [executor.submit(run_target_worker, target, 500, 0.5, stop_event) for target in targets]
+
+    def stop():
+        stop_event.set()
+        for future in futures:
+            future.result()
+        # 负载停止后追平剩余变更，使目标端的写入也计入本模式
+        for target in targets:
+            run_target_worker(target, 500, 0.5, threading.Event(), once=True)
+        executor.shutdown()
+
+    return stop
+
+
+def run_mode(mode, states, space, sessions, duration, interval, seed_value, shared_wal, target_names):
+    print(f"\n🔄 模式 {mode}: {sessions} 个会话, {duration}s")
+    apply_mode(states, mode)
+    seed(space)
+
+    stop_delivery = None
+    if mode == 'outbox':
+        stop_delivery = start_delivery(target_names)
+        if stop_delivery is None:
+            print("   ⚠️ 没有已启用的目标库（register_sync_target），跳过 outbox 模式")
+            return None
+
+    counter = WriteCounter()
+    started = time.monotonic()
+    sampler = Sampler(interval, counter, started)
+    first = sampler.take()
+    sampler.start()
+
+    deadline = started + duration
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        for future in [executor.submit(run_session, i, deadline, seed_value, space, counter)
+                       for i in range(sessions)]:
+            future.result()
+
+    if stop_delivery is not None:
+        stop_delivery()
+    sampler.stop()
+    last = sampler.take()
+
+    summary = summarize(first, last, shared_wal)
+    summary.update({'mode': mode, 'errors': counter.errors, 'samples': sampler.samples})
+    print_mode(summary)
+    return summary
+
+
+def print_mode(summary):
+    print(f"   源库写入: {summary['writes']} 次 ({summary['writes'] / max(summary['duration_s'], 0.1):.0f}/s), "
+          f"失败 {summary['errors']}")
+    for db, data in summary['databases'].items():
+        if data['wal_bytes'] is not None:
+            print(f"   {db} WAL: {data['wal_bytes'] / 1048576:.1f} MB "
+                  f"({data['wal_bytes_per_million'] / 1048576:.1f} MB / 百万次写入)")
+        for name, table in sorted(data['tables'].items()):
+            if not table['rows_written_per_million'] and not table['growth_bytes']:
+                continue
+            hot = f"{table['hot_update_ratio']:.0%}" if table['hot_update_ratio'] is not None else '-'
+            print(f"     {name:<28} 增长 {table['growth_bytes_per_million'] / 1048576:>8.1f} MB/百万  "
+                  f"死元组 {table['dead_tuples']:>8}  HOT {hot:>5}  autovacuum {table['autovacuum_runs']}")
+
+
+def run_soak(modes=MODES, sessions=8, duration=600, interval=10, users=1000, orgs=20, keys=200, seed_value=42,
+             target_names=None):
+    print("🚀 开始浸泡测试...")
+    ensure_pool_capacity(sessions + 4)
+
+    with connection('source') as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('\"LiteLLM_VerificationToken\"') IS NOT NULL;")
+            with_keys = cursor.fetchone()[0]
+        conn.rollback()
+    space = {'orgs': _names('org', orgs), 'users': _names('user', users),
+             'keys': _names('key', keys) if with_keys else []}
+
+    shared_wal = same_cluster()
+    if shared_wal:
+        print("   ℹ️  两个数据库在同一实例上，WAL 只统计一次（记在 source 下）")
+
+    states = trigger_states()
+    results = []
+    try:
+        for mode in modes:
+            result = run_mode(mode, states, space, sessions, duration, interval, seed_value, shared_wal,
+                              target_names)
+            if result is not None:
+                results.append(result)
+    finally:
+        restore_triggers(states)
+        cleanup(space)
+
+    return {
+        'created_at': datetime.now().isoformat(),
+        'settings': {'sessions': sessions, 'duration_s': duration, 'sample_interval_s': interval,
+                     'users': users, 'orgs': orgs, 'keys': len(space['keys'])},
+        'shared_wal': shared_wal,
+        'modes': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='桥接浸泡测试: 表膨胀、autovacuum 和 WAL 开销（仅用于测试数据库）')
+    parser.add_argument('--mode', action='append', choices=MODES, help='要运行的模式（可重复，默认全部）')
+    parser.add_argument('--duration', type=int, default=600, help='每种模式的持续时间（秒）')
+    parser.add_argument('--sessions', type=int, default=8, help='并发写入会话数')
+    parser.add_argument('--sample-interval', type=float, default=10, help='采样间隔（秒）')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--orgs', type=int, default=20)
+    parser.add_argument('--keys', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--target', action='append', help='outbox 模式只投递指定目标库（可重复）')
+    parser.add_argument('--output', default='soak-report.json', help='JSON 报告（含全部采样）')
+    args = parser.parse_args()
+
+    try:
+        report = run_soak(args.mode or MODES, args.sessions, args.duration, args.sample_interval,
+                          args.users, args.orgs, args.keys, args.seed, args.target)
+    except psycopg2.Error as e:
+        print(f"❌ 数据库错误: {e}")
+        return False
+    finally:
+        close_all()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    print(f"\n✅ 浸泡测试报告已写入: {args.output}")
+    return all(mode['errors'] == 0 for mode in report['modes'])
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+SQL 剖析 - 找出桥接 PL/pgSQL 函数内部哪些语句占用了时间（仅用于本地测试数据库）
+
+PL/pgSQL 内部的语句默认不出现在统计里，剖析期间对源库和目标库临时设置（ALTER DATABASE，结束后 RESET）:
+- pg_stat_statements.track = all        → 触发器 / 函数内部的嵌套语句单独计时
+- track_functions = all                 → pg_stat_user_functions 给出每个函数的总耗时 / 自身耗时
+- session_preload_libraries = auto_explain, auto_explain.log_nested_statements = on
+                                        → 嵌套语句的执行计划（JSON）写入服务器日志，剖析结束后用 pg_read_file 取回
+
+然后通过桥接触发器执行一次工作负载（功能测试或压力测试），按总耗时排序输出每条语句的调用次数、
+耗时、所属函数和最慢一次的执行计划，并可与保存的基线报告比较。
+
+前提: shared_preload_libraries 包含 pg_stat_statements（--configure-server 会写入，需要重启数据库）；
+admin 连接需要超级用户权限；读取执行计划还需要 logging_collector = on。
+"""
+
+import psycopg2
+import re
+import sys
+import json
+import argparse
+from datetime import datetime
+
+from bridge_client import connection, close_all
+
+PROFILE_VERSION = 1
+PROFILED_DATABASES = ('source', 'target')
+
+# ALTER DATABASE ... SET 的设置；explain_min_ms 在运行时填入
+PROFILE_SETTINGS = {
+    'pg_stat_statements.track': 'all',
+    'track_functions': 'all',
+    'session_preload_libraries': 'auto_explain',
+    'auto_explain.log_nested_statements': 'on',
+    'auto_explain.log_analyze': 'on',
+    'auto_explain.log_buffers': 'on',
+    'auto_explain.log_format': 'json',
+}
+
+STATEMENTS_SQL = """
+    SELECT query, calls, total_exec_time, mean_exec_time, max_exec_time, rows,
+           shared_blks_hit, shared_blks_read, toplevel
+    FROM pg_stat_statements
+    WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+      AND query NOT ILIKE '%%pg_stat_statements%%'
+    ORDER BY total_exec_time DESC
+    LIMIT %s;
+"""
+
+FUNCTIONS_SQL = """
+    SELECT p.oid, p.proname, p.prosrc
+    FROM pg_proc p
+    JOIN pg_language l ON l.oid = p.prolang
+    JOIN pg_namespace n ON n.oid = p.pronamespace
+    WHERE l.lanname = 'plpgsql' AND n.nspname = 'public';
+"""
+
+FUNCTION_STATS_SQL = """
+    SELECT funcname, calls, total_time, self_time
+    FROM pg_stat_user_functions
+    WHERE schemaname = 'public'
+    ORDER BY total_time DESC;
+"""
+
+
+def _normalize(text):
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def _fragments(query):
+    """把语句按 $n 占位符（pg_stat_statements 规范化后的常量）切成必须按顺序出现的片段"""
+    return [fragment.strip() for fragment in re.split(r'\$\d+', _normalize(query)) if fragment.strip()]
+
+
+def _matches(fragments, text):
+    position = 0
+    for fragment in fragments:
+        position = text.find(fragment, position)
+        if position < 0:
+            return False
+        position += len(fragment)
+    return True
+
+
+def _database_names():
+    names = {}
+    for db in PROFILED_DATABASES:
+        with connection(db) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT current_database();')
+                names[db] = cursor.fetchone()[0]
+            conn.rollback()
+    return names
+
+
+def _quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def check_server(configure=False):
+    """pg_stat_statements 必须预加载；configure=True 时写入 ALTER SYSTEM（重启后生效）"""
+    with connection('admin', autocommit=True) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('SHOW shared_preload_libraries;')
+            libraries = [lib.strip() for lib in cursor.fetchone()[0].split(',') if lib.strip()]
+            if 'pg_stat_statements' in libraries:
+                return True
+
+            print("⚠️ shared_preload_libraries 中没有 pg_stat_statements")
+            if configure:
+                cursor.execute('ALTER SYSTEM SET shared_preload_libraries = %s;',
+                               (', '.join(libraries + ['pg_stat_statements']),))
+                print("   已执行 ALTER SYSTEM，请重启数据库后重新运行")
+            else:
+                print("   使用 --configure-server 写入配置，或手动修改 postgresql.conf 后重启")
+            return False
+
+
+def enable_profiling(db_names, explain_min_ms):
+    """对测试库设置剖析参数，并清空已有统计；之后新建的会话（含 dblink 会话）生效"""
+    settings = dict(PROFILE_SETTINGS, **{'auto_explain.log_min_duration': str(explain_min_ms)})
+    with connection('admin', autocommit=True) as conn:
+        with conn.cursor() as cursor:
+            for db_name in db_names.values():
+                for name, value in settings.items():
+                    cursor.execute(f'ALTER DATABASE {_quote_ident(db_name)} SET {name} = %s;', (value,))
+
+    for db in PROFILED_DATABASES:
+        with connection(db) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_stat_statements;')
+                cursor.execute('SELECT pg_stat_statements_reset();')
+                cursor.execute(FUNCTIONS_SQL)
+                for oid, _, _ in cursor.fetchall():
+                    cursor.execute('SELECT pg_stat_reset_single_function_counters(%s);', (oid,))
+            conn.commit()
+
+    # 连接池里的旧连接不会读取新的数据库级设置
+    close_all()
+
+
+def disable_profiling(db_names):
+    with connection('admin', autocommit=True) as conn:
+        with conn.cursor() as cursor:
+            for db_name in db_names.values():
+                for name in list(PROFILE_SETTINGS) + ['auto_explain.log_min_duration']:
+                    cursor.execute(f'ALTER DATABASE {_quote_ident(db_name)} RESET {name};')
+    close_all()
+
+
+def log_position():
+    """(当前日志文件, 大小)；没有 logging_collector 或无权读取时返回 None"""
+    try:
+        with connection('admin') as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_current_logfile('stderr');")
+                log_file = cursor.fetchone()[0]
+                if log_file is None:
+                    print("   ⚠️ 没有开启 logging_collector，报告中不含执行计划")
+                    return None
+                cursor.execute('SELECT size FROM pg_stat_file(%s);', (log_file,))
+                return log_file, cursor.fetchone()[0]
+    except psycopg2.Error as e:
+        print(f"   ⚠️ 无法读取服务器日志位置，报告中不含执行计划: {e}")
+        return None
+
+
+def collect_plans(start):
+    """读取 start 之后写入服务器日志的 auto_explain JSON 计划，返回 [(耗时 ms, 计划)]"""
+    if start is None:
+        return []
+    log_file, offset = start
+    with connection('admin') as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT size FROM pg_stat_file(%s);', (log_file,))
+            size = cursor.fetchone()[0]
+            if size <= offset:
+                print("   ⚠️ 剖析期间服务器日志没有增长（日志已轮转？），报告中不含执行计划")
+                return []
+            cursor.execute('SELECT pg_read_file(%s, %s, %s);', (log_file, offset, size - offset))
+            content = cursor.fetchone()[0]
+
+    plans = []
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r'duration: ([\d.]+) ms\s+plan:\s*', content):
+        try:
+            plan, _ = decoder.raw_decode(content, match.end())
+        except ValueError:
+            # 其他后端的日志行插在计划中间时无法解析，跳过
+            continue
+        plans.append((float(match.group(1)), plan))
+    return plans
+
+
+def _plan_outline(node, depth=0, lines=None):
+    """计划树 → 缩进的单行节点摘要"""
+    lines = [] if lines is None else lines
+    label = node.get('Node Type', '?')
+    if node.get('Relation Name'):
+        label += f" on {node['Relation Name']}"
+    if node.get('Index Name'):
+        label += f" using {node['Index Name']}"
+    if 'Actual Rows' in node:
+        label += f" (rows={node['Actual Rows']}, loops={node.get('Actual Loops', 1)})"
+    lines.append('  ' * depth + label)
+    for child in node.get('Plans', []):
+        _plan_outline(child, depth + 1, lines)
+    return lines
+
+
+def collect_database(db, plans, limit):
+    """一个数据库的函数统计和语句排名；语句按源码片段归属到函数，计划按查询文本归属到语句"""
+    with connection(db) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(FUNCTIONS_SQL)
+            sources = {name: _normalize(src).replace('perform ', 'select ') for _, name, src in cursor.fetchall()}
+            cursor.execute(FUNCTION_STATS_SQL)
+            functions = [{'name': name, 'calls': calls, 'total_ms': round(total, 3), 'self_ms': round(self_time, 3)}
+                         for name, calls, total, self_time in cursor.fetchall()]
+            cursor.execute(STATEMENTS_SQL, (limit,))
+            rows = cursor.fetchall()
+        conn.rollback()
+
+    statements = []
+    for query, calls, total, mean, maximum, result_rows, blks_hit, blks_read, toplevel in rows:
+        fragments = _fragments(query)
+        owners = sorted(name for name, src in sources.items() if not toplevel and _matches(fragments, src))
+        slowest = max(((duration, plan) for duration, plan in plans
+                       if _matches(fragments, _normalize(plan.get('Query Text', '')))),
+                      key=lambda item: item[0], default=None)
+        statements.append({
+            'query': _normalize(query),
+            'functions': owners,
+            'toplevel': toplevel,
+            'calls': calls,
+            'total_ms': round(total, 3),
+            'mean_ms': round(mean, 3),
+            'max_ms': round(maximum, 3),
+            'rows': result_rows,
+            'shared_blks_hit': blks_hit,
+            'shared_blks_read': blks_read,
+            'slowest_plan': slowest and {'duration_ms': slowest[0], 'plan': slowest[1].get('Plan')},
+        })
+    return {'functions': functions, 'statements': statements}
+
+
+def run_workload(workload):
+    if workload == 'stress':
+        from stress_test import run_stress
+        return run_stress(sessions=4, operations=50, baseline=False)
+
+    from test_real_insert import test_real_insert
+    from test_real_update import test_real_update
+    from test_real_delete import test_real_delete
+    return all(test() for test in (test_real_insert, test_real_update, test_real_delete))
+
+
+def profile(workload='functional', explain_min_ms=1, limit=50):
+    """在剖析设置下执行工作负载，返回报告"""
+    db_names = _database_names()
+    enable_profiling(db_names, explain_min_ms)
+    try:
+        start = log_position()
+        started = datetime.now()
+        workload_ok = run_workload(workload)
+        plans = collect_plans(start)
+        databases = {db: collect_database(db, plans, limit) for db in PROFILED_DATABASES}
+    finally:
+        disable_profiling(db_names)
+
+    return {
+        'version': PROFILE_VERSION,
+        'created_at': started.isoformat(),
+        'workload': workload,
+        'workload_ok': workload_ok,
+        'plans_captured': len(plans),
+        'databases': databases,
+    }
+
+
+def diff_reports(current, baseline, threshold_pct):
+    """按 (数据库, 规范化语句) 比较平均耗时；返回 (差异列表, 回归数)"""
+    rows = []
+    regressions = 0
+    for db, data in current['databases'].items():
+        before = {s['query']: s for s in baseline['databases'].get(db, {}).get('statements', [])}
+        for statement in data['statements']:
+            old = before.pop(statement['query'], None)
+            if old is None:
+                rows.append({'database': db, 'query': statement['query'], 'status': 'new',
+                             'mean_ms': statement['mean_ms'], 'calls': statement['calls']})
+                continue
+            change_pct = ((statement['mean_ms'] - old['mean_ms']) / old['mean_ms'] * 100) if old['mean_ms'] else 0
+            status = 'regressed' if change_pct > threshold_pct else 'improved' if change_pct < -threshold_pct else 'same'
+            regressions += status == 'regressed'
+            rows.append({'database': db, 'query': statement['query'], 'status': status,
+                         'mean_ms': statement['mean_ms'], 'baseline_mean_ms': old['mean_ms'],
+                         'change_pct': round(change_pct, 1),
+                         'calls': statement['calls'], 'baseline_calls': old['calls']})
+        for query, old in before.items():
+            rows.append({'database': db, 'query': query, 'status': 'gone',
+                         'baseline_mean_ms': old['mean_ms'], 'baseline_calls': old['calls']})
+    return rows, regressions
+
+
+def print_report(report, top):
+    for db, data in report['databases'].items():
+        print(f"\n📊 {db}: 函数耗时")
+        for function in data['functions'][:top]:
+            print(f"   {function['name']:<40} {function['calls']:>7} 次  总 {function['total_ms']:>10.1f}ms  "
+                  f"自身 {function['self_ms']:>10.1f}ms")
+
+        print(f"\n📊 {db}: 语句耗时（按总耗时排序）")
+        for rank, statement in enumerate(data['statements'][:top], 1):
+            owner = ', '.join(statement['functions']) or ('(顶层)' if statement['toplevel'] else '(未识别)')
+            print(f"   {rank:>2}. {statement['total_ms']:>10.1f}ms  {statement['calls']:>7} 次  "
+                  f"均 {statement['mean_ms']:.3f}ms  [{owner}]")
+            print(f"       {statement['query'][:120]}")
+            if statement['slowest_plan'] and statement['slowest_plan']['plan']:
+                for line in _plan_outline(statement['slowest_plan']['plan'])[:6]:
+                    print(f"         {line}")
+
+
+def print_diff(rows, regressions, threshold_pct):
+    print(f"\n📊 与基线比较（阈值 ±{threshold_pct}%）")
+    for row in rows:
+        if row['status'] == 'same':
+            continue
+        icon = {'regressed': '❌', 'improved': '✅', 'new': '🆕', 'gone': '➖'}[row['status']]
+        if 'change_pct' in row:
+            detail = f"{row['baseline_mean_ms']:.3f} → {row['mean_ms']:.3f}ms ({row['change_pct']:+.1f}%)"
+        else:
+            detail = f"{row.get('mean_ms', row.get('baseline_mean_ms')):.3f}ms"
+        print(f"   {icon} [{row['database']}] {detail}  {row['query'][:100]}")
+    print(f"   回归语句: {regressions}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='桥接 SQL 函数的语句级剖析（仅用于测试数据库）')
+    parser.add_argument('--workload', choices=('functional', 'stress'), default='functional',
+                        help='functional: INSERT/UPDATE/DELETE 功能测试; stress: 小规模并发压力测试')
+    parser.add_argument('--output', default='sql-profile.json', help='JSON 报告路径（可作为以后的基线）')
+    parser.add_argument('--baseline', help='与之比较的基线报告')
+    parser.add_argument('--threshold-pct', type=float, default=20.0, help='平均耗时变化超过该比例视为回归')
+    parser.add_argument('--explain-min-ms', type=float, default=1, help='auto_explain 记录计划的最小耗时')
+    parser.add_argument('--limit', type=int, default=50, help='每个数据库保留的语句数')
+    parser.add_argument('--top', type=int, default=15, help='控制台输出的条目数')
+    parser.add_argument('--configure-server', action='store_true',
+                        help='缺少 pg_stat_statements 预加载时执行 ALTER SYSTEM（需要重启）')
+    args = parser.parse_args()
+
+    try:
+        if not check_server(args.configure_server):
+            return False
+        print(f"🚀 剖析 {args.workload} 工作负载...")
+        report = profile(args.workload, args.explain_min_ms, args.limit)
+    except psycopg2.Error as e:
+        print(f"❌ 数据库错误: {e}")
+        return False
+    finally:
+        close_all()
+
+    print_report(report, args.top)
+    print(f"\n   捕获执行计划: {report['plans_captured']}")
+
+    ok = report['workload_ok']
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows, regressions = diff_reports(report, baseline, args.threshold_pct)
+        report['baseline'] = {'path': args.baseline, 'created_at': baseline['created_at'],
+                              'regressions': regressions, 'diff': rows}
+        print_diff(rows, regressions, args.threshold_pct)
+        ok = ok and regressions == 0
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    print(f"\n✅ 剖析报告已写入: {args.output}")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+并发 CRUD 压力测试 - 多个会话在重叠的组织、用户和 API key 上交错执行增删改
+
+1. 基线阶段（可选）: session_replication_role = replica 关闭触发器，测量纯 LiteLLM 写入能力
+2. 桥接阶段: 触发器开启，同样的随机工作负载（相同种子）
+3. 比对 LiteLLM 与 Open WebUI 的最终状态，报告吞吐、死锁次数和触发器带来的锁等待时间
+"""
+
+import psycopg2
+import psycopg2.errors
+import sys
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from bridge_client import checkout, release, connection, ensure_pool_capacity, reset_after_fork
+
+STRESS_PREFIX = 'stress_'
+MAX_RETRIES = 5
+LOCK_SAMPLE_INTERVAL = 0.05
+
+
+def _names(kind, count):
+    return [f'{STRESS_PREFIX}{kind}_{i}' for i in range(count)]
+
+
+def _has_table(cursor, table):
+    cursor.execute('SELECT to_regclass(%s) IS NOT NULL;', (f'"{table}"',))
+    return cursor.fetchone()[0]
+
+
+def cleanup(replica=False):
+    """删除上一次压力测试留下的数据（两端都清理，保证每个阶段从同一起点开始）"""
+    pattern = STRESS_PREFIX.replace('_', '\\_') + '%'
+    with connection('source') as conn:
+        cursor = conn.cursor()
+        if replica:
+            cursor.execute('SET LOCAL session_replication_role = replica;')
+        if _has_table(cursor, 'LiteLLM_VerificationToken'):
+            cursor.execute('DELETE FROM "LiteLLM_VerificationToken" WHERE token LIKE %s;', (pattern,))
+        cursor.execute('DELETE FROM "LiteLLM_UserTable" WHERE user_id LIKE %s;', (pattern,))
+        cursor.execute('DELETE FROM "LiteLLM_OrganizationTable" WHERE organization_id LIKE %s;', (pattern,))
+        cursor.execute('DELETE FROM sync_mapping WHERE litellm_id LIKE %s;', (pattern,))
+        conn.commit()
+
+    with connection('target') as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM auth WHERE id LIKE %s;', ('usr\\_' + pattern,))
+        cursor.execute('DELETE FROM "user" WHERE id LIKE %s;', ('usr\\_' + pattern,))
+        cursor.execute('DELETE FROM "group" WHERE id LIKE %s;', ('grp\\_' + pattern,))
+        conn.commit()
+
+
+# -----------------------------------------------------------------------------
+# 工作负载: 每个操作是一个事务；多行操作按随机顺序加锁，故意制造锁冲突
+# -----------------------------------------------------------------------------
+
+def op_upsert_org(cursor, rng, space):
+    org_id = rng.choice(space['orgs'])
+    cursor.execute("""
+        INSERT INTO "LiteLLM_OrganizationTable"
+        (organization_id, organization_alias, budget_id, models, spend, metadata, created_by, updated_by)
+        VALUES (%s, %s, %s, %s, %s, '{}', 'stress', 'stress')
+        ON CONFLICT (organization_id) DO UPDATE SET
+            organization_alias = EXCLUDED.organization_alias,
+            spend = EXCLUDED.spend,
+            updated_at = CURRENT_TIMESTAMP
+    """, (org_id, f'Stress Org {rng.randint(0, 9999)}', 'budget_stress', ['gpt-4'], rng.random() * 100))
+
+
+def op_delete_org(cursor, rng, space):
+    org_id = rng.choice(space['orgs'])
+    cursor.execute('UPDATE "LiteLLM_UserTable" SET organization_id = NULL, updated_at = CURRENT_TIMESTAMP '
+                   'WHERE organization_id = %s;', (org_id,))
+    cursor.execute('DELETE FROM "LiteLLM_OrganizationTable" WHERE organization_id = %s;', (org_id,))
+
+
+def op_upsert_user(cursor, rng, space):
+    user_id = rng.choice(space['users'])
+    cursor.execute("""
+        INSERT INTO "LiteLLM_UserTable"
+        (user_id, user_alias, organization_id, user_email, user_role, teams, max_budget, spend, models, metadata)
+        VALUES (%s, %s, (SELECT organization_id FROM "LiteLLM_OrganizationTable" WHERE organization_id = %s),
+                %s, %s, '{}', %s, 0, %s, '{}')
+        ON CONFLICT (user_id) DO UPDATE SET
+            user_alias = EXCLUDED.user_alias,
+            organization_id = EXCLUDED.organization_id,
+            user_role = EXCLUDED.user_role,
+            updated_at = CURRENT_TIMESTAMP
+    """, (user_id, f'Stress User {rng.randint(0, 9999)}', rng.choice(space['orgs']),
+          f'{user_id}@stress.test', rng.choice(['internal_user', 'proxy_admin']),
+          rng.random() * 500, ['gpt-4']))
+
+
+def op_move_users(cursor, rng, space):
+    """在一个事务里按随机顺序更新两个用户——并发时是典型的死锁来源"""
+    for user_id in rng.sample(space['users'], 2):
+        cursor.execute('UPDATE "LiteLLM_UserTable" SET spend = spend + %s, organization_id = '
+                       '(SELECT organization_id FROM "LiteLLM_OrganizationTable" WHERE organization_id = %s), '
+                       'updated_at = CURRENT_TIMESTAMP WHERE user_id = %s;',
+                       (rng.random(), rng.choice(space['orgs']), user_id))
+
+
+def op_delete_user(cursor, rng, space):
+    user_id = rng.choice(space['users'])
+    if space['keys']:
+        cursor.execute('DELETE FROM "LiteLLM_VerificationToken" WHERE user_id = %s;', (user_id,))
+    cursor.execute('DELETE FROM "LiteLLM_UserTable" WHERE user_id = %s;', (user_id,))
+
+
+def op_create_key(cursor, rng, space):
+    cursor.execute("""
+        INSERT INTO "LiteLLM_VerificationToken" (token, user_id, key_alias, models)
+        SELECT %s, user_id, %s, %s FROM "LiteLLM_UserTable" WHERE user_id = %s
+        ON CONFLICT (token) DO NOTHING
+    """, (rng.choice(space['keys']), 'stress', ['gpt-4'], rng.choice(space['users'])))
+
+
+def op_delete_key(cursor, rng, space):
+    cursor.execute('DELETE FROM "LiteLLM_VerificationToken" WHERE token = %s;', (rng.choice(space['keys']),))
+
+
+OPERATIONS = [
+    (op_upsert_org, 2, False),
+    (op_delete_org, 1, False),
+    (op_upsert_user, 4, False),
+    (op_move_users, 3, False),
+    (op_delete_user, 1, False),
+    (op_create_key, 2, True),
+    (op_delete_key, 1, True),
+]
+
+
+def run_session(session_id, operations, seed, space, replica):
+    """单个压力会话；线程和进程工作者都调用它"""
+    rng = random.Random(seed * 1000 + session_id)
+    available = [(op, weight) for op, weight, needs_keys in OPERATIONS if space['keys'] or not needs_keys]
+    ops, weights = zip(*available)
+
+    stats = {'ok': 0, 'deadlocks': 0, 'retries': 0, 'rejected': 0, 'errors': 0, 'abandoned': 0,
+             'op_seconds': [], 'error_samples': []}
+    conn = checkout('source')
+    cursor = conn.cursor()
+    try:
+        if replica:
+            cursor.execute('SET session_replication_role = replica;')
+            conn.commit()
+
+        for _ in range(operations):
+            op = rng.choices(ops, weights)[0]
+            op_seed = rng.random()
+            for attempt in range(MAX_RETRIES):
+                started = time.perf_counter()
+                try:
+                    op(cursor, random.Random(op_seed), space)
+                    conn.commit()
+                    stats['ok'] += 1
+                    stats['op_seconds'].append(time.perf_counter() - started)
+                    break
+                except (psycopg2.errors.DeadlockDetected, psycopg2.errors.SerializationFailure):
+                    conn.rollback()
+                    stats['deadlocks'] += 1
+                    stats['retries'] += 1
+                except psycopg2.IntegrityError:
+                    # 并发删除导致的外键/唯一约束冲突属于正常竞争，不重试
+                    conn.rollback()
+                    stats['rejected'] += 1
+                    break
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    stats['errors'] += 1
+                    if len(stats['error_samples']) < 3:
+                        stats['error_samples'].append(f"{op.__name__}: {e}".strip())
+                    break
+            else:
+                # 每次重试都死锁: 操作被放弃，单独计数而不是悄悄丢掉
+                stats['abandoned'] += 1
+                if len(stats['error_samples']) < 3:
+                    stats['error_samples'].append(f"{op.__name__}: {MAX_RETRIES} 次重试均死锁，已放弃")
+    finally:
+        if replica and not conn.closed:
+            conn.rollback()
+            cursor.execute('RESET session_replication_role;')
+            conn.commit()
+        cursor.close()
+        release('source', conn)
+
+    return stats
+
+
+class LockWaitSampler(threading.Thread):
+    """周期性采样 pg_stat_activity 中等待锁的会话数，累加成锁等待时间（会话·秒）"""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.stop_event = threading.Event()
+        self.lock_wait_seconds = 0.0
+        self.max_waiting = 0
+
+    def run(self):
+        with connection('source', autocommit=True) as conn:
+            cursor = conn.cursor()
+            while not self.stop_event.wait(LOCK_SAMPLE_INTERVAL):
+                cursor.execute("""
+                    SELECT COUNT(*) FROM pg_stat_activity
+                    WHERE datname = current_database() AND wait_event_type = 'Lock';
+                """)
+                waiting = cursor.fetchone()[0]
+                self.lock_wait_seconds += waiting * LOCK_SAMPLE_INTERVAL
+                self.max_waiting = max(self.max_waiting, waiting)
+            cursor.close()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+def run_phase(label, sessions, operations, seed, space, replica, worker_mode):
+    """执行一个阶段并返回汇总"""
+    print(f"\n🔄 {label}: {sessions} 个会话 × {operations} 次操作 ({worker_mode})")
+    cleanup(replica)
+
+    sampler = LockWaitSampler()
+    sampler.start()
+    executor_cls = ProcessPoolExecutor if worker_mode == 'process' else ThreadPoolExecutor
+    started = time.perf_counter()
+    # 进程工作者不能使用 fork 继承的池化连接（与父进程共用 socket）
+    pool_options = {'initializer': reset_after_fork} if worker_mode == 'process' else {}
+    with executor_cls(max_workers=sessions, **pool_options) as executor:
+        futures = [executor.submit(run_session, i, operations, seed, space, replica) for i in range(sessions)]
+        results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - started
+    sampler.stop()
+
+    op_seconds = sorted(s for r in results for s in r['op_seconds'])
+    summary = {
+        'label': label,
+        'elapsed': elapsed,
+        'ok': sum(r['ok'] for r in results),
+        'deadlocks': sum(r['deadlocks'] for r in results),
+        'rejected': sum(r['rejected'] for r in results),
+        'errors': sum(r['errors'] for r in results),
+        'abandoned': sum(r['abandoned'] for r in results),
+        'error_samples': [e for r in results for e in r['error_samples']][:5],
+        'lock_wait_seconds': sampler.lock_wait_seconds,
+        'max_waiting': sampler.max_waiting,
+        'p50': op_seconds[len(op_seconds) // 2] if op_seconds else 0.0,
+        'p95': op_seconds[int(len(op_seconds) * 0.95)] if op_seconds else 0.0,
+    }
+    summary['throughput'] = summary['ok'] / elapsed if elapsed > 0 else 0.0
+
+    print(f"   吞吐: {summary['throughput']:.1f} ops/s ({summary['ok']} 成功, {elapsed:.2f}s)")
+    print(f"   操作延迟: p50 {summary['p50'] * 1000:.1f}ms, p95 {summary['p95'] * 1000:.1f}ms")
+    print(f"   死锁/序列化重试: {summary['deadlocks']}, 约束冲突: {summary['rejected']}, 错误: {summary['errors']}, "
+          f"重试耗尽放弃: {summary['abandoned']}")
+    print(f"   锁等待: {summary['lock_wait_seconds']:.2f} 会话·秒 (峰值 {summary['max_waiting']} 个会话)")
+    for sample in summary['error_samples']:
+        print(f"      错误示例: {sample}")
+    return summary
+
+
+def verify_final_state(space):
+    """比对压力测试数据在 LiteLLM 与 Open WebUI 中的最终状态"""
+    pattern = STRESS_PREFIX.replace('_', '\\_') + '%'
+    with connection('source') as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT organization_id, organization_alias FROM "LiteLLM_OrganizationTable" '
+                       'WHERE organization_id LIKE %s;', (pattern,))
+        orgs = {'grp_' + org_id: alias for org_id, alias in cursor.fetchall()}
+        cursor.execute('SELECT user_id, user_alias, user_email, user_role FROM "LiteLLM_UserTable" '
+                       'WHERE user_id LIKE %s;', (pattern,))
+        users = {
+            'usr_' + user_id: (alias or 'User', email,
+                               'admin' if role in ('proxy_admin', 'proxy_admin_viewer') else 'user')
+            for user_id, alias, email, role in cursor.fetchall()
+        }
+        tokens = {}
+        if space['keys']:
+            cursor.execute('SELECT user_id, token FROM "LiteLLM_VerificationToken" WHERE token LIKE %s;', (pattern,))
+            for user_id, token in cursor.fetchall():
+                tokens.setdefault('usr_' + user_id, set()).add(token)
+        conn.rollback()
+
+    with connection('target') as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, name FROM "group" WHERE id LIKE %s;', ('grp\\_' + pattern,))
+        groups = dict(cursor.fetchall())
+        cursor.execute('SELECT id, name, email, role, api_key FROM "user" WHERE id LIKE %s;', ('usr\\_' + pattern,))
+        webui_users = {row[0]: row[1:] for row in cursor.fetchall()}
+        conn.rollback()
+
+    problems = []
+    for group_id in orgs.keys() - groups.keys():
+        problems.append(f"缺少组 {group_id}")
+    for group_id in groups.keys() - orgs.keys():
+        problems.append(f"多余的组 {group_id}")
+    for group_id in orgs.keys() & groups.keys():
+        if orgs[group_id] != groups[group_id]:
+            problems.append(f"组名称不一致 {group_id}: {orgs[group_id]!r} vs {groups[group_id]!r}")
+
+    for user_id in users.keys() - webui_users.keys():
+        problems.append(f"缺少用户 {user_id}")
+    for user_id in webui_users.keys() - users.keys():
+        problems.append(f"多余的用户 {user_id}")
+    for user_id in users.keys() & webui_users.keys():
+        name, email, role, api_key = webui_users[user_id]
+        if (name, email, role) != users[user_id]:
+            problems.append(f"用户不一致 {user_id}: {users[user_id]} vs {(name, email, role)}")
+        if api_key and api_key.startswith(STRESS_PREFIX) and api_key not in tokens.get(user_id, set()):
+            problems.append(f"用户 {user_id} 的 api_key 指向已删除或他人的 key")
+
+    print(f"\n🔍 最终状态比对: 组 {len(orgs)}/{len(groups)}, 用户 {len(users)}/{len(webui_users)} (LiteLLM/Open WebUI)")
+    if problems:
+        print(f"   ❌ 发现 {len(problems)} 处不一致:")
+        for problem in problems[:20]:
+            print(f"      - {problem}")
+    else:
+        print("   ✅ 两端最终状态一致")
+    return not problems
+
+
+def run_stress(sessions=16, operations=200, seed=42, orgs=4, users=24, keys=32,
+               worker_mode='thread', baseline=True):
+    """压力模式入口"""
+    print("🚀 开始并发 CRUD 压力测试...")
+    print("=" * 70)
+
+    # 会话 + 锁采样 + 清理/比对各需要一个连接
+    ensure_pool_capacity(sessions + 4)
+
+    with connection('source') as conn:
+        with_keys = _has_table(conn.cursor(), 'LiteLLM_VerificationToken')
+        conn.rollback()
+    space = {
+        'orgs': _names('org', orgs),
+        'users': _names('user', users),
+        'keys': _names('key', keys) if with_keys else [],
+    }
+    if not with_keys:
+        print("   ℹ️  未找到 LiteLLM_VerificationToken，跳过 API key 操作")
+
+    base = None
+    if baseline:
+        try:
+            base = run_phase('基线（触发器关闭）', sessions, operations, seed, space, True, worker_mode)
+        except psycopg2.errors.InsufficientPrivilege:
+            print("   ⚠️  当前用户无权设置 session_replication_role，跳过基线阶段")
+
+    bridged = run_phase('桥接（触发器开启）', sessions, operations, seed, space, False, worker_mode)
+    consistent = verify_final_state(space)
+
+    if base:
+        print("\n📊 触发器开销:")
+        print(f"   吞吐: {base['throughput']:.1f} → {bridged['throughput']:.1f} ops/s")
+        print(f"   p95 延迟: {base['p95'] * 1000:.1f} → {bridged['p95'] * 1000:.1f}ms")
+        print(f"   死锁: {base['deadlocks']} → {bridged['deadlocks']}")
+        print(f"   锁等待增加: {bridged['lock_wait_seconds'] - base['lock_wait_seconds']:.2f} 会话·秒")
+
+    cleanup()
+    return consistent and bridged['errors'] == 0 and bridged['abandoned'] == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_stress() else 1)
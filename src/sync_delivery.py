@@ -0,0 +1,654 @@
+#!/usr/bin/env python3
+"""
+多目标同步投递引擎 - 将 sync_change_log 中捕获的 LiteLLM 变更并行推送到所有匹配的 Open WebUI 目标库
+
+优先级通道（见 classify_sync_change()）:
+- 高优先级变更（删除、角色变更、组织迁移）在每个主通道批次之前先投递，进度记在 last_high_change_id
+- 主通道按 id 顺序投递其余变更，跳过已提前投递的高优先级变更，以及被同一实体更晚的高优先级变更取代的旧变更
+- 只改消费计数的 bulk 变更可以用每个目标库的令牌桶限速
+"""
+
+import psycopg2
+import psycopg2.extras
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from bridge_client import dsn_for
+from lookup_cache import LookupCache
+from partitioned_delivery import PartitionedApplier, partition_key
+from remote_batch import execute_pipelined
+
+# LiteLLM 源库连接（sync_change_log / sync_target 所在的数据库），见 bridge_client 的配置规则
+SOURCE_DSN = dsn_for('source')
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_POLL_INTERVAL = 1.0
+MAX_RETRY_DELAY = 60.0
+
+# sync_change_log.priority
+PRIORITY_BULK = 2
+
+
+def load_targets(source_conn, target_names=None):
+    """读取已启用的目标库及其投递进度"""
+    with source_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute("""
+            SELECT t.target_name, t.conn_str, t.organization_filter,
+                   p.last_change_id, p.last_high_change_id, p.failed_attempts
+            FROM sync_target t
+            JOIN sync_target_progress p ON p.target_name = t.target_name
+            WHERE t.enabled
+            ORDER BY t.target_name;
+        """)
+        targets = [dict(row) for row in cursor.fetchall()]
+    source_conn.commit()
+
+    if target_names:
+        targets = [t for t in targets if t['target_name'] in target_names]
+    return targets
+
+
+class CaptureHorizon:
+    """
+    变更日志的可见性水位: 不超过它的 id 要么已提交可见，要么永远不会出现
+
+    sync_change_log.id 在插入时分配而不是在提交时: id 较小的事务可能在较大 id 已投递、进度越过它之后才提交，
+    按 id 推进的进度会永久跳过它。每次读取前先采样 id 序列的当前值 L，再（用新的语句）取快照的 xmax X:
+    分配过 <= L 的 id 的事务在采样时都已拥有 xid 且 xid < X，当快照 xmin >= X 时它们都已结束，
+    <= L 的 id 从此稳定。没有进行中的写事务时采样立即生效；长时间运行的写事务会让投递停在它开始前的位置。
+    """
+
+    def __init__(self):
+        self.samples = deque()   # [(L, X)]，按采样顺序
+        self.safe_id = 0
+
+    def advance(self, source_conn):
+        """采样并返回当前可以安全读取到的最大 id"""
+        with source_conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT COALESCE(pg_sequence_last_value(pg_get_serial_sequence('sync_change_log', 'id')::regclass), 0);
+            """)
+            last_id = cursor.fetchone()[0]
+            cursor.execute("""
+                SELECT pg_snapshot_xmin(s)::text, pg_snapshot_xmax(s)::text FROM pg_current_snapshot() AS s;
+            """)
+            xmin, xmax = (int(x) for x in cursor.fetchone())
+        source_conn.commit()
+
+        if last_id > self.safe_id and (not self.samples or last_id > self.samples[-1][0]):
+            self.samples.append((last_id, xmax))
+        while self.samples and self.samples[0][1] <= xmin:
+            self.safe_id = max(self.safe_id, self.samples.popleft()[0])
+        return self.safe_id
+
+
+def fetch_changes(source_conn, after_id, limit, high_water_id=0, upto_id=None):
+    """
+    按 id 顺序读取 after_id 之后、upto_id（CaptureHorizon 的水位）之前的一批变更
+
+    high_water_id 是高优先级通道已投递到的位置：该位置之前的高优先级变更，以及同一实体
+    在其后还有已投递高优先级变更的旧变更，标记 delivered_early，主通道只推进进度不再执行。
+    高优先级通道同样只读到 CaptureHorizon 的水位，水位之内的 id 都已稳定，
+    因此 high_water_id 之前的高优先级变更确实都已投递，可以按 id 判断。
+    """
+    with source_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute("""
+            SELECT cl.id, cl.entity_type, cl.entity_id, cl.operation, cl.organization_id,
+                   cl.old_organization_id, cl.source_version, cl.priority, cl.payload,
+                   cl.id <= %(high)s AND (
+                       cl.priority = 0
+                       OR EXISTS (
+                           SELECT 1 FROM sync_change_log h
+                           WHERE h.priority = 0
+                             AND h.entity_type = cl.entity_type AND h.entity_id = cl.entity_id
+                             AND h.id > cl.id AND h.id <= %(high)s
+                       )
+                   ) AS delivered_early
+            FROM sync_change_log cl
+            WHERE cl.id > %(after)s
+              AND (%(upto)s IS NULL OR cl.id <= %(upto)s)
+            ORDER BY cl.id
+            LIMIT %(limit)s;
+        """, {'after': after_id, 'limit': limit, 'high': high_water_id, 'upto': upto_id})
+        changes = [dict(row) for row in cursor.fetchall()]
+    source_conn.commit()
+    return changes
+
+
+def fetch_high_changes(source_conn, after_id, limit, upto_id=None):
+    """读取 after_id 之后、upto_id（CaptureHorizon 的水位）之前尚未投递的高优先级变更"""
+    with source_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute("""
+            SELECT id, entity_type, entity_id, operation, organization_id,
+                   old_organization_id, source_version, priority, payload
+            FROM sync_change_log
+            WHERE priority = 0 AND id > %(after)s
+              AND (%(upto)s IS NULL OR id <= %(upto)s)
+            ORDER BY id
+            LIMIT %(limit)s;
+        """, {'after': after_id, 'limit': limit, 'upto': upto_id})
+        changes = [dict(row) for row in cursor.fetchall()]
+    source_conn.commit()
+    return changes
+
+
+class TokenBucket:
+    """每个目标库一个令牌桶：bulk 变更每条消耗一个令牌，按 rate 条/秒补充，最多积累 burst 个"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = max(burst or rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        # 最近一次取令牌是否失败（投递循环据此区分"已追平"和"被限速"）
+        self.blocked = False
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.blocked = False
+            return True
+        self.blocked = True
+        return False
+
+    def wait_time(self):
+        """距离下一个令牌可用的秒数"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+def route_change(target, change):
+    """
+    判断变更对目标库的作用: 'UPSERT' / 'DELETE' / None(与该目标无关)
+
+    用户被移出目标库负责的组织时，对该目标库转换为删除。
+    """
+    org_filter = target.get('organization_filter')
+    if not org_filter:
+        return change['operation']
+
+    if change['organization_id'] in org_filter:
+        return change['operation']
+
+    if (change['operation'] == 'UPSERT' and change['entity_type'] == 'user'
+            and change.get('old_organization_id') in org_filter):
+        return 'DELETE'
+
+    return None
+
+
+def resolve_team_aliases(source_conn, changes, cache=None):
+    """一次查询解析本批用户变更涉及的所有团队别名；给出 cache 时只查询未缓存的团队"""
+    team_ids = {
+        c['payload'].get('team_id') for c in changes
+        if c['entity_type'] == 'user' and c['payload'].get('team_id')
+    }
+    if not team_ids:
+        return {}
+
+    if cache is not None:
+        return {team_id: attrs['team_alias'] for team_id, attrs in cache.get_many(source_conn, 'team', team_ids).items()}
+
+    with source_conn.cursor() as cursor:
+        cursor.execute(
+            'SELECT team_id, team_alias FROM "LiteLLM_TeamTable" WHERE team_id = ANY(%s);',
+            (list(team_ids),)
+        )
+        aliases = dict(cursor.fetchall())
+    source_conn.commit()
+    return aliases
+
+
+def user_display_name(payload, team_aliases):
+    """与 sync_user_to_openwebui() 相同的显示名称规则"""
+    user_alias = payload.get('user_alias')
+    team_alias = team_aliases.get(payload.get('team_id')) if payload.get('team_id') else None
+
+    if team_alias and user_alias:
+        return f"{team_alias}-{user_alias}"
+    return user_alias or 'User'
+
+
+def user_role_mapped(payload):
+    """与 sync_user_to_openwebui() 相同的角色映射"""
+    if payload.get('user_role') in ('proxy_admin', 'proxy_admin_viewer'):
+        return 'admin'
+    return 'user'
+
+
+def build_statements(change, action, team_aliases):
+    """
+    把一条变更转换为目标库上要执行的 (sql, params) 列表
+
+    语义与 litellm-webui-sync.sql / api-key-sync.sql 中的触发器函数一致。
+    upsert 和删除都带 source_version 守卫：重试或乱序到达的旧变更不会覆盖较新的数据。
+    """
+    payload = change['payload']
+    entity_type = change['entity_type']
+    source_version = change.get('source_version')
+    statements = []
+
+    if entity_type == 'organization':
+        group_id = 'grp_' + payload['organization_id']
+        if action == 'DELETE':
+            statements.append(('''
+                DELETE FROM "group"
+                WHERE id = %s
+                  AND ((meta::jsonb->>'source_version') IS NULL
+                       OR (meta::jsonb->>'source_version') COLLATE "C" < %s)
+            ''', (group_id, source_version)))
+        else:
+            alias = payload.get('organization_alias')
+            statements.append(("""
+                INSERT INTO "group" (id, name, description, meta, created_at, updated_at)
+                VALUES (%s, %s, %s, %s::jsonb,
+                        EXTRACT(EPOCH FROM %s::timestamp)::bigint,
+                        EXTRACT(EPOCH FROM COALESCE(%s::timestamp, CURRENT_TIMESTAMP))::bigint)
+                ON CONFLICT (id) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    description = EXCLUDED.description,
+                    meta = EXCLUDED.meta,
+                    updated_at = EXCLUDED.updated_at
+                WHERE ("group".meta::jsonb->>'source_version') IS NULL
+                   OR ("group".meta::jsonb->>'source_version') COLLATE "C" < (EXCLUDED.meta::jsonb->>'source_version')
+            """, (group_id, alias, f"{alias} organization" if alias else '',
+                  json.dumps({
+                      'organization_id': payload['organization_id'],
+                      'budget_id': payload.get('budget_id'),
+                      'models': payload.get('models'),
+                      'spend': payload.get('spend'),
+                      'model_spend': payload.get('model_spend'),
+                      'metadata': payload.get('metadata'),
+                      'source_version': source_version,
+                  }),
+                  payload.get('created_at'), payload.get('updated_at'))))
+
+    elif entity_type == 'user':
+        user_id_mapped = 'usr_' + payload['user_id']
+        if action == 'DELETE':
+            statements.append(('''
+                DELETE FROM "user"
+                WHERE id = %s
+                  AND ((info::jsonb->>'source_version') IS NULL
+                       OR (info::jsonb->>'source_version') COLLATE "C" < %s)
+            ''', (user_id_mapped, source_version)))
+            # 用户行被版本守卫保留时 auth 也保留
+            statements.append(('''
+                DELETE FROM auth
+                WHERE id = %s AND NOT EXISTS (SELECT 1 FROM "user" WHERE id = %s)
+            ''', (user_id_mapped, user_id_mapped)))
+        else:
+            statements.append(("""
+                INSERT INTO "user" (id, email, name, role, oauth_sub, settings, info, profile_image_url,
+                                    last_active_at, created_at, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s,
+                        EXTRACT(EPOCH FROM CURRENT_TIMESTAMP)::bigint,
+                        EXTRACT(EPOCH FROM %s::timestamp)::bigint,
+                        EXTRACT(EPOCH FROM COALESCE(%s::timestamp, CURRENT_TIMESTAMP))::bigint)
+                ON CONFLICT (id) DO UPDATE SET
+                    email = EXCLUDED.email,
+                    name = EXCLUDED.name,
+                    role = EXCLUDED.role,
+                    oauth_sub = EXCLUDED.oauth_sub,
+                    -- 保留 push_effective_models() 写入的 effective_models（effective-models.sql）
+                    settings = (jsonb_strip_nulls(jsonb_build_object('effective_models', "user".settings::jsonb->'effective_models'))
+                                || EXCLUDED.settings::jsonb)::json,
+                    -- 保留 push_usage_rollups() 写入的 usage（usage-rollups.sql）
+                    info = (jsonb_strip_nulls(jsonb_build_object('usage', "user".info::jsonb->'usage'))
+                            || EXCLUDED.info::jsonb)::json,
+                    updated_at = EXCLUDED.updated_at
+                WHERE ("user".info::jsonb->>'source_version') IS NULL
+                   OR ("user".info::jsonb->>'source_version') COLLATE "C" < (EXCLUDED.info::jsonb->>'source_version')
+            """, (user_id_mapped, payload.get('user_email'),
+                  user_display_name(payload, team_aliases), user_role_mapped(payload),
+                  payload.get('sso_user_id'),
+                  json.dumps({
+                      'max_budget': payload.get('max_budget'),
+                      'spend': payload.get('spend'),
+                      'models': payload.get('models'),
+                      'metadata': payload.get('metadata'),
+                      'model_spend': payload.get('model_spend'),
+                      'model_max_budget': payload.get('model_max_budget'),
+                  }),
+                  json.dumps({
+                      'organization_id': payload.get('organization_id'),
+                      'team_id': payload.get('team_id'),
+                      'original_user_id': payload['user_id'],
+                      'user_role': payload.get('user_role'),
+                      'source_version': source_version,
+                  }),
+                  '/static/profile-user.png',
+                  payload.get('created_at'), payload.get('updated_at'))))
+
+            if payload.get('user_email'):
+                statements.append(('CREATE EXTENSION IF NOT EXISTS pgcrypto', None))
+                # 只在上面的 upsert 生效（"user" 行带的正是本变更的版本）时写入，旧变更不会改动 auth
+                statements.append(("""
+                    INSERT INTO auth (id, email, password, active)
+                    SELECT %s, %s, crypt(%s, gen_salt('bf', 12)), true
+                    WHERE EXISTS (SELECT 1 FROM "user" WHERE id = %s AND info::jsonb->>'source_version' = %s)
+                    ON CONFLICT (id) DO UPDATE SET
+                        email = EXCLUDED.email,
+                        active = EXCLUDED.active
+                """, (user_id_mapped, payload['user_email'], payload['user_email'],
+                      user_id_mapped, source_version)))
+
+    elif entity_type == 'api_key':
+        webui_user_id = 'usr_' + payload['user_id']
+        if action == 'DELETE':
+            statements.append(('UPDATE "user" SET api_key = NULL WHERE id = %s AND api_key = %s',
+                               (webui_user_id, payload['token'])))
+        else:
+            statements.append(('UPDATE "user" SET api_key = %s WHERE id = %s',
+                               (payload['token'], webui_user_id)))
+
+    return statements
+
+
+class SerialApplier:
+    """单连接执行整批变更：全部语句组装成一个远端事务，一次往返发送"""
+
+    def __init__(self, conn_str):
+        self.conn_str = conn_str
+        self.conn = None
+
+    def apply(self, keyed_statements):
+        """返回 {变更下标: 错误信息}，只包含语句执行失败的变更"""
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(self.conn_str)
+        try:
+            return execute_pipelined(self.conn, [stmts for _, stmts in keyed_statements])
+        except Exception:
+            # 连接可能已损坏，下次重新建立
+            self.close()
+            raise
+
+    def close(self):
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = None
+
+
+def make_applier(target, partitions=1, worker_mode='thread'):
+    """partitions > 1 时按实体键哈希分区并行投递"""
+    if partitions > 1:
+        return PartitionedApplier(target['conn_str'], partitions, worker_mode)
+    return SerialApplier(target['conn_str'])
+
+
+def record_progress(source_conn, target_name, last_change_id, delivered, error=None, batch_range=None,
+                    failed_changes=(), lane='main'):
+    """
+    更新目标库的投递进度，并写入批次审计
+
+    failed_changes: [(change, error_message)]，语句级失败的变更逐条记入 sync_audit 后跳过，
+    避免一条坏数据永久阻塞该目标库；连接级错误（error）不推进进度，整批稍后重试。
+    lane='high' 时推进的是高优先级通道的位置 last_high_change_id。
+    """
+    progress_column = 'last_high_change_id' if lane == 'high' else 'last_change_id'
+    with source_conn.cursor() as cursor:
+        for change, change_error in failed_changes:
+            cursor.execute("""
+                INSERT INTO sync_audit (operation, record_id, sync_result, error_message, new_data)
+                VALUES ('DELIVER_CHANGE', %s, 'FAILED', %s, %s);
+            """, (change['entity_id'], change_error,
+                  json.dumps({'target': target_name, 'change_id': change['id'],
+                              'entity_type': change['entity_type'], 'operation': change['operation']})))
+
+        if error is None:
+            cursor.execute(f"""
+                UPDATE sync_target_progress
+                SET {progress_column} = %s,
+                    delivered_count = delivered_count + %s,
+                    failed_attempts = 0,
+                    last_error = NULL,
+                    last_delivered_at = CURRENT_TIMESTAMP,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE target_name = %s;
+            """, (last_change_id, delivered, target_name))
+            cursor.execute("""
+                INSERT INTO sync_audit (operation, record_id, sync_result, new_data)
+                VALUES ('DELIVER_BATCH', %s, 'SUCCESS', %s);
+            """, (target_name, json.dumps({'first_id': batch_range[0], 'last_id': batch_range[1], 'lane': lane,
+                                           'delivered': delivered, 'failed': len(failed_changes)})))
+        else:
+            cursor.execute("""
+                UPDATE sync_target_progress
+                SET failed_attempts = failed_attempts + 1,
+                    last_error = %s,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE target_name = %s;
+            """, (error, target_name))
+            cursor.execute("""
+                INSERT INTO sync_audit (operation, record_id, sync_result, error_message, new_data)
+                VALUES ('DELIVER_BATCH', %s, 'FAILED', %s, %s);
+            """, (target_name, error, json.dumps({'first_id': batch_range[0] if batch_range else None,
+                                                  'last_id': batch_range[1] if batch_range else None})))
+    source_conn.commit()
+
+
+def apply_changes(source_conn, applier, target, changes, batch_range, cache=None, lane='main'):
+    """
+    在目标库上执行一批变更并记录进度（主通道推进 last_change_id，高优先级通道推进 last_high_change_id）
+
+    返回实际执行的变更数。连接级失败时记录错误后抛出，不推进进度。
+    """
+    team_aliases = resolve_team_aliases(source_conn, changes, cache)
+
+    keyed_statements = []
+    keyed_changes = []
+    for change in changes:
+        action = route_change(target, change)
+        if action is None:
+            continue
+        statements = build_statements(change, action, team_aliases)
+        if statements:
+            keyed_statements.append((partition_key(change), statements))
+            keyed_changes.append(change)
+
+    try:
+        failures = applier.apply(keyed_statements) if keyed_statements else {}
+    except Exception as e:
+        record_progress(source_conn, target['target_name'], None, 0, error=str(e), batch_range=batch_range,
+                        lane=lane)
+        raise
+
+    failed_changes = [(keyed_changes[i], err) for i, err in sorted(failures.items())]
+    record_progress(source_conn, target['target_name'], batch_range[1],
+                    len(keyed_changes) - len(failed_changes), batch_range=batch_range,
+                    failed_changes=failed_changes, lane=lane)
+    return len(keyed_changes)
+
+
+def deliver_high_once(source_conn, applier, target, batch_size, cache=None, horizon=None):
+    """
+    投递一批尚未投递的高优先级变更，可以越过主通道的位置，但不越过 CaptureHorizon 的水位
+
+    返回本批处理的变更数（0 表示高优先级通道已追平）。horizon 应与主通道共用并在多次调用间复用。
+    """
+    if horizon is None:
+        horizon = CaptureHorizon()
+    after_id = max(target['last_change_id'], target.get('last_high_change_id') or 0)
+    changes = fetch_high_changes(source_conn, after_id, batch_size, horizon.advance(source_conn))
+    if not changes:
+        return 0
+
+    batch_range = (changes[0]['id'], changes[-1]['id'])
+    apply_changes(source_conn, applier, target, changes, batch_range, cache, lane='high')
+    target['last_high_change_id'] = batch_range[1]
+    return len(changes)
+
+
+def deliver_target_once(source_conn, applier, target, batch_size, cache=None, bucket=None, horizon=None):
+    """
+    把目标库积压的变更投递一批（主通道）
+
+    返回本批处理的变更数（0 表示已追平或被限速，后者 bucket.blocked 为真）。失败时抛出异常且不推进进度。
+    已由高优先级通道投递或被其取代的变更只推进进度；给出 bucket 时，批次在第一条取不到令牌的 bulk 变更前截断。
+    horizon 应在多次调用间复用（见 CaptureHorizon），否则持续写入时水位难以推进。
+    """
+    if bucket is not None:
+        bucket.blocked = False
+    if horizon is None:
+        horizon = CaptureHorizon()
+    changes = fetch_changes(source_conn, target['last_change_id'], batch_size,
+                            target.get('last_high_change_id') or 0, horizon.advance(source_conn))
+    if not changes:
+        return 0
+
+    if bucket is not None:
+        for i, change in enumerate(changes):
+            if (change['priority'] == PRIORITY_BULK and not change['delivered_early']
+                    and not bucket.try_take()):
+                changes = changes[:i]
+                break
+        if not changes:
+            return 0
+
+    batch_range = (changes[0]['id'], changes[-1]['id'])
+    apply_changes(source_conn, applier, target, [c for c in changes if not c['delivered_early']],
+                  batch_range, cache)
+    target['last_change_id'] = batch_range[1]
+    return len(changes)
+
+
+def run_target_worker(target, batch_size, poll_interval, stop_event, once=False,
+                      partitions=1, worker_mode='thread', cache=None, bulk_rate=None, bulk_burst=None):
+    """
+    单个目标库的独立投递循环
+
+    每个目标库有自己的线程、源库连接和目标库连接；某个区域变慢或失败只会让它自己退避重试。
+    每个主通道批次之前先追平高优先级通道，因此删除和降权的延迟最多是一个主通道批次加一次轮询间隔。
+    bulk_rate（条/秒）限制 bulk 变更的投递速率；被限速时主通道等待，高优先级通道照常投递。
+    """
+    name = target['target_name']
+    source_conn = None
+    applier = make_applier(target, partitions, worker_mode)
+    bucket = TokenBucket(bulk_rate, bulk_burst) if bulk_rate else None
+    horizon = CaptureHorizon()
+    failures = 0
+    totals = {'target': name, 'delivered': 0, 'high': 0, 'batches': 0, 'errors': 0}
+
+    while not stop_event.is_set():
+        try:
+            if source_conn is None or source_conn.closed:
+                source_conn = psycopg2.connect(SOURCE_DSN)
+
+            while not stop_event.is_set():
+                high = deliver_high_once(source_conn, applier, target, batch_size, cache, horizon)
+                if not high:
+                    break
+                totals['delivered'] += high
+                totals['high'] += high
+                totals['batches'] += 1
+
+            processed = deliver_target_once(source_conn, applier, target, batch_size, cache, bucket, horizon)
+            failures = 0
+
+            if processed:
+                totals['delivered'] += processed
+                totals['batches'] += 1
+                continue
+
+            if bucket is not None and bucket.blocked:
+                stop_event.wait(min(bucket.wait_time(), poll_interval))
+                continue
+
+            if once:
+                break
+            stop_event.wait(poll_interval)
+
+        except Exception as e:
+            failures += 1
+            totals['errors'] += 1
+            print(f"   ❌ [{name}] 投递失败 (第{failures}次): {e}")
+
+            # 源库连接可能已损坏，下次循环重新建立
+            if source_conn is not None and not source_conn.closed:
+                source_conn.close()
+            source_conn = None
+
+            if once:
+                break
+            stop_event.wait(min(poll_interval * (2 ** failures), MAX_RETRY_DELAY))
+
+    applier.close()
+    if source_conn is not None and not source_conn.closed:
+        source_conn.close()
+
+    return totals
+
+
+def run_delivery(target_names=None, batch_size=DEFAULT_BATCH_SIZE, poll_interval=DEFAULT_POLL_INTERVAL, once=False,
+                 partitions=1, worker_mode='thread', bulk_rate=None, bulk_burst=None):
+    """为每个已启用的目标库启动独立的投递线程"""
+    source_conn = psycopg2.connect(SOURCE_DSN)
+    try:
+        targets = load_targets(source_conn, target_names)
+    finally:
+        source_conn.close()
+
+    if not targets:
+        print("❌ 没有已启用的目标库，请先执行 register_sync_target()")
+        return False
+
+    print(f"🚀 启动多目标投递: {', '.join(t['target_name'] for t in targets)}")
+
+    stop_event = threading.Event()
+    # 所有目标库共享一个团队 / 组织查找缓存
+    cache = LookupCache(SOURCE_DSN)
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = [
+            executor.submit(run_target_worker, target, batch_size, poll_interval, stop_event, once,
+                            partitions, worker_mode, cache, bulk_rate, bulk_burst)
+            for target in targets
+        ]
+        try:
+            results = [f.result() for f in futures]
+        except KeyboardInterrupt:
+            stop_event.set()
+            results = [f.result() for f in futures]
+    cache.close()
+
+    print("\n📊 投递总结:")
+    for r in results:
+        status = "✅" if r['errors'] == 0 else "⚠️"
+        print(f"   {status} {r['target']}: {r['delivered']} 条变更 (高优先级 {r['high']}), "
+              f"{r['batches']} 批, {r['errors']} 次错误")
+    print(f"   查找缓存: 命中 {cache.stats['hits']}, 未命中 {cache.stats['misses']}, "
+          f"失效 {cache.stats['invalidations']}, 淘汰 {cache.stats['evictions']}")
+
+    return all(r['errors'] == 0 for r in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LiteLLM → Open WebUI 多目标投递引擎')
+    parser.add_argument('--target', action='append', help='只投递指定目标库（可重复）')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--interval', type=float, default=DEFAULT_POLL_INTERVAL, help='空闲时的轮询间隔（秒）')
+    parser.add_argument('--once', action='store_true', help='每个目标库追平后退出')
+    parser.add_argument('--partitions', type=int, default=1,
+                        help='每个目标库的并行分区数（按实体键哈希，分区内保序）')
+    parser.add_argument('--worker-mode', choices=['thread', 'process'], default='thread',
+                        help='分区工作者使用线程还是进程')
+    parser.add_argument('--bulk-rate', type=float, help='每个目标库 bulk 变更（只改消费计数）的投递速率上限（条/秒）')
+    parser.add_argument('--bulk-burst', type=int, help='令牌桶容量，默认等于 --bulk-rate')
+    args = parser.parse_args()
+
+    return run_delivery(args.target, args.batch_size, args.interval, args.once,
+                        args.partitions, args.worker_mode, args.bulk_rate, args.bulk_burst)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
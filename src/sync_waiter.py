@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+同步收敛等待器 - 代替测试中固定的 time.sleep，等到期望的 sync_audit 记录出现为止
+
+默认按指数退避重新查询 sync_audit。测试库上安装了 sql/test-audit-notify.sql（install_audit_notify()）时，
+同时 LISTEN bridge_sync_audit，审计记录写入即被唤醒。该触发器只用于测试库：NOTIFY 在提交时持有全局锁。
+返回每条期望记录从变更前标记点到被观察到的传播延迟（秒），测试因此同时是一个延迟探针。
+"""
+
+import os
+import select
+import json
+import time
+
+from bridge_client import checkout, release
+
+NOTIFY_CHANNEL = 'bridge_sync_audit'
+AUDIT_NOTIFY_SQL = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sql', 'test-audit-notify.sql')
+MIN_POLL_DELAY = 0.005
+MAX_POLL_DELAY = 0.5
+DEFAULT_TIMEOUT = 10.0
+
+
+class SyncTimeout(TimeoutError):
+    """超过期限仍有期望的审计记录未出现"""
+
+    def __init__(self, pending, observed):
+        self.pending = pending
+        self.observed = observed
+        super().__init__(f"同步等待超时，仍未出现: {sorted(pending)}")
+
+
+class SyncWaiter:
+    """
+    用法:
+        waiter = SyncWaiter()
+        mark = waiter.mark()
+        ... 在 LiteLLM 中执行变更 ...
+        latencies = waiter.wait([('SYNC_USER', 'alice')], mark)
+        waiter.close()
+    """
+
+    def __init__(self, db='source'):
+        self.db = db
+        self.conn = checkout(db, autocommit=True)
+        with self.conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {NOTIFY_CHANNEL};')
+
+    def mark(self):
+        """记录变更前的审计位置和时间点，只有之后写入的审计记录才算数"""
+        with self.conn.cursor() as cursor:
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM sync_audit;')
+            last_id = cursor.fetchone()[0]
+        # 标记点之前积压的通知与本次等待无关
+        self.conn.poll()
+        del self.conn.notifies[:]
+        return last_id, time.monotonic()
+
+    def _query(self, pending, after_id):
+        operations = sorted({op for op, _ in pending})
+        record_ids = sorted({record_id for _, record_id in pending})
+        with self.conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT operation, record_id
+                FROM sync_audit
+                WHERE id > %s AND operation = ANY(%s) AND record_id = ANY(%s);
+            """, (after_id, operations, record_ids))
+            return {(op, record_id) for op, record_id in cursor.fetchall()}
+
+    def _drain_notifies(self, after_id):
+        seen = set()
+        for notify in self.conn.notifies:
+            try:
+                payload = json.loads(notify.payload)
+            except ValueError:
+                continue
+            if payload.get('id', 0) > after_id:
+                seen.add((payload.get('operation'), payload.get('record_id')))
+        del self.conn.notifies[:]
+        return seen
+
+    def wait(self, expected, mark, timeout=DEFAULT_TIMEOUT):
+        """
+        等待 expected 中的每个 (operation, record_id) 都出现在 sync_audit 中（成功或失败都算已同步）
+
+        返回 {(operation, record_id): 传播延迟秒数}；超时抛出 SyncTimeout。
+        """
+        after_id, started = mark
+        pending = set(expected)
+        observed = {}
+        deadline = started + timeout
+        delay = MIN_POLL_DELAY
+
+        def observe(keys):
+            now = time.monotonic()
+            for key in keys & pending:
+                observed[key] = now - started
+            pending.difference_update(keys)
+
+        # 同步触发器在变更语句返回前已写完审计，多数情况下第一次查询即可完成
+        observe(self._query(pending, after_id))
+
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise SyncTimeout(pending, observed)
+
+            readable, _, _ = select.select([self.conn], [], [], min(delay, remaining))
+            if readable:
+                self.conn.poll()
+                observe(self._drain_notifies(after_id))
+            else:
+                # 没有通知（或未安装通知触发器）时回退为指数退避轮询
+                observe(self._query(pending, after_id))
+                delay = min(delay * 2, MAX_POLL_DELAY)
+
+        return observed
+
+    def close(self):
+        if not self.conn.closed:
+            with self.conn.cursor() as cursor:
+                cursor.execute('UNLISTEN *;')
+        release(self.db, self.conn)
+
+
+def install_audit_notify(db='source'):
+    """在测试库上安装审计通知触发器（sql/test-audit-notify.sql）"""
+    with open(AUDIT_NOTIFY_SQL, encoding='utf-8') as f:
+        script = f.read()
+    conn = checkout(db, autocommit=True)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(script)
+    finally:
+        release(db, conn)
+    return True
+
+
+def remove_audit_notify(db='source'):
+    """删除审计通知触发器，等待器回退为轮询"""
+    conn = checkout(db, autocommit=True)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('DROP TRIGGER IF EXISTS sync_audit_notify_trigger ON sync_audit;')
+            cursor.execute('DROP FUNCTION IF EXISTS notify_sync_audit();')
+    finally:
+        release(db, conn)
+
+
+def report_latency(label, latencies):
+    """打印一组传播延迟"""
+    if not latencies:
+        return
+    values = sorted(latencies.values())
+    print(f"   ⏱️  {label}: {len(values)} 条, 最大 {values[-1] * 1000:.1f}ms, "
+          f"中位 {values[len(values) // 2] * 1000:.1f}ms")
@@ -3,33 +3,20 @@
 真实表结构 DELETE 测试 - 验证LiteLLM到Open WebUI的删除同步
 """
 
-import psycopg2
 import sys
-import time
 import json
 from datetime import datetime
 
+from bridge_client import checkout, release
+from sync_waiter import SyncWaiter, report_latency
+
 def test_real_delete():
     """测试真实表结构的DELETE操作同步"""
     
     # 连接数据库
-    source_conn = psycopg2.connect(
-        host="172.21.0.4",
-        port="5432",
-        database="litellm_real",
-        user="webui",
-        password="webui"
-    )
-    source_conn.autocommit = True
-    
-    target_conn = psycopg2.connect(
-        host="172.21.0.4", 
-        port="5432",
-        database="openwebui_real",
-        user="webui",
-        password="webui"
-    )
-    target_conn.autocommit = True
+    source_conn = checkout('source', autocommit=True)
+    target_conn = checkout('target', autocommit=True)
+    waiter = SyncWaiter()
     
     print("🧪 开始真实表结构 DELETE 测试...")
     print("=" * 50)
@@ -93,6 +80,7 @@ def test_real_delete():
         
         # 3. 执行用户删除
         print("\\n📝 执行用户删除...")
+        delete_mark = waiter.mark()
         
         delete_sql = 'DELETE FROM "LiteLLM_UserTable" WHERE user_id = %s'
         source_cursor.execute(delete_sql, ('charlie',))
@@ -100,7 +88,7 @@ def test_real_delete():
         
         # 等待触发器执行
         print("\\n⏳ 等待删除触发器同步...")
-        time.sleep(2)
+        report_latency('删除同步延迟', waiter.wait([('DELETE_USER', 'charlie')], delete_mark))
         
         # 4. 验证删除后状态
         print("\\n📊 删除后状态:")
@@ -199,18 +187,23 @@ def test_real_delete():
             print(f"   准备删除组织: {org_to_delete[0]} ({org_to_delete[1]})")
             
             # 先删除该组织下的用户 (eve)
+            org_users_mark = waiter.mark()
+            source_cursor.execute("SELECT user_id FROM \"LiteLLM_UserTable\" WHERE organization_id = 'org_research';")
+            org_user_ids = [row[0] for row in source_cursor.fetchall()]
             source_cursor.execute("DELETE FROM \"LiteLLM_UserTable\" WHERE organization_id = 'org_research';")
             print(f"   ✅ 先删除组织下的用户")
             
             # 等待用户删除同步
-            time.sleep(1)
+            report_latency('组织用户删除延迟',
+                           waiter.wait([('DELETE_USER', user_id) for user_id in org_user_ids], org_users_mark))
             
             # 删除组织
+            org_mark = waiter.mark()
             source_cursor.execute("DELETE FROM \"LiteLLM_OrganizationTable\" WHERE organization_id = 'org_research';")
             print(f"   ✅ 删除LiteLLM组织: {org_to_delete[0]}")
             
             # 等待同步
-            time.sleep(2)
+            report_latency('组织删除延迟', waiter.wait([('DELETE_ORG', org_to_delete[0])], org_mark))
             
             # 验证组织删除
             source_cursor.execute("SELECT COUNT(*) FROM \"LiteLLM_OrganizationTable\" WHERE organization_id = 'org_research';")
@@ -266,8 +259,9 @@ def test_real_delete():
         traceback.print_exc()
         return False
     finally:
-        source_conn.close()
-        target_conn.close()
+        release('source', source_conn)
+        release('target', target_conn)
+        waiter.close()
 
 if __name__ == "__main__":
     sys.exit(0 if test_real_delete() else 1)
\ No newline at end of file
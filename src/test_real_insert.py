@@ -3,33 +3,20 @@
 真实表结构 INSERT 测试 - 验证LiteLLM到Open WebUI的同步
 """
 
-import psycopg2
 import sys
-import time
 import json
 from datetime import datetime
 
+from bridge_client import checkout, release
+from sync_waiter import SyncWaiter, report_latency
+
 def test_real_insert():
     """测试真实表结构的INSERT操作同步"""
     
     # 连接数据库
-    source_conn = psycopg2.connect(
-        host="172.21.0.4",
-        port="5432",
-        database="litellm_real",
-        user="webui",
-        password="webui"
-    )
-    source_conn.autocommit = True
-    
-    target_conn = psycopg2.connect(
-        host="172.21.0.4", 
-        port="5432",
-        database="openwebui_real",
-        user="webui",
-        password="webui"
-    )
-    target_conn.autocommit = True
+    source_conn = checkout('source', autocommit=True)
+    target_conn = checkout('target', autocommit=True)
+    waiter = SyncWaiter()
     
     print("🧪 开始真实表结构 INSERT 测试...")
     print("=" * 50)
@@ -40,6 +27,7 @@ def test_real_insert():
         
         # 1. 创建测试组织
         print("\\n📝 创建测试组织...")
+        org_mark = waiter.mark()
         
         org_data = [
             ('org_tech', 'Technology Corp', 'budget_tech', ['gpt-4', 'claude-3']),
@@ -76,10 +64,11 @@ def test_real_insert():
         
         # 等待组织同步
         print("\\n⏳ 等待组织同步...")
-        time.sleep(2)
+        report_latency('组织同步延迟', waiter.wait([('SYNC_ORG', org[0]) for org in org_data], org_mark))
         
         # 3. 创建测试用户
         print("\\n📝 创建测试用户...")
+        user_mark = waiter.mark()
         
         user_data = [
             ('alice', 'Alice Chen', 'team_backend', 'org_tech', 'alice@techcorp.com', 'internal_user', None, 200.0),
@@ -105,7 +94,7 @@ def test_real_insert():
         
         # 等待用户同步
         print("\\n⏳ 等待用户同步...")
-        time.sleep(3)
+        report_latency('用户同步延迟', waiter.wait([('SYNC_USER', user[0]) for user in user_data], user_mark))
         
         # 4. 验证LiteLLM源表数据
         print("\\n📊 验证LiteLLM源表数据:")
@@ -265,8 +254,9 @@ def test_real_insert():
         traceback.print_exc()
         return False
     finally:
-        source_conn.close()
-        target_conn.close()
+        release('source', source_conn)
+        release('target', target_conn)
+        waiter.close()
 
 if __name__ == "__main__":
     sys.exit(0 if test_real_insert() else 1)
\ No newline at end of file
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+高优先级通道测试 - 验证两个高优先级变更按与 id 相反的顺序提交时都能投递
+
+sync_change_log.id 在插入时分配: 事务 T1 先取得 id_a 但后提交，T2 取得 id_b > id_a 先提交。
+高优先级通道若先投递了 id_b，主通道不能再按 id 推断 id_a 已投递，否则 id_a 的删除永远不会送达。
+
+需要已安装 multi-target-sync.sql 并注册了一个没有组织过滤的目标库。
+测试期间直接同步触发器被关闭（与 soak_test 的 outbox 模式相同），结束后恢复。
+"""
+
+import psycopg2
+import sys
+import threading
+
+from bridge_client import checkout, release
+from sync_delivery import SOURCE_DSN, load_targets, run_target_worker
+from soak_test import trigger_states, apply_mode, restore_triggers
+
+PRIORITY_USERS = ('prio_a', 'prio_b')
+
+
+def deliver_once(target):
+    """把目标库追平一次（高优先级通道 + 主通道）"""
+    return run_target_worker(target, 100, 0.1, threading.Event(), once=True)
+
+
+def target_user_ids(target_conn):
+    with target_conn.cursor() as cursor:
+        cursor.execute('SELECT id FROM "user" WHERE id = ANY(%s) ORDER BY id;',
+                       (['usr_' + user_id for user_id in PRIORITY_USERS],))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def test_real_priority_lanes():
+    """测试逆 id 顺序提交的高优先级删除"""
+
+    source_conn = checkout('source', autocommit=True)
+    states = None
+    target_conn = None
+    pending_conn = None
+
+    print("🧪 开始高优先级通道测试...")
+    print("=" * 50)
+
+    try:
+        source_cursor = source_conn.cursor()
+
+        source_cursor.execute("SELECT to_regclass('sync_change_log') IS NOT NULL;")
+        if not source_cursor.fetchone()[0]:
+            print("   ❌ 未安装 multi-target-sync.sql")
+            return False
+
+        targets = [t for t in load_targets(source_conn) if not t['organization_filter']]
+        if not targets:
+            print("   ❌ 没有已启用且无组织过滤的目标库（register_sync_target）")
+            return False
+        target = targets[0]
+        target_conn = psycopg2.connect(target['conn_str'])
+        target_conn.autocommit = True
+        print(f"   目标库: {target['target_name']}")
+
+        # 1. 只保留变更捕获，避免直接同步触发器掩盖投递结果
+        states = trigger_states()
+        apply_mode(states, 'outbox')
+
+        print("\n📝 创建测试用户并投递:")
+        for user_id in PRIORITY_USERS:
+            source_cursor.execute("""
+                INSERT INTO "LiteLLM_UserTable"
+                (user_id, user_alias, user_email, user_role, teams, max_budget, spend, models, metadata)
+                VALUES (%s, %s, %s, 'internal_user', '{}', 100, 0, %s, '{}')
+                ON CONFLICT (user_id) DO NOTHING;
+            """, (user_id, f'Priority {user_id}', f'{user_id}@priority.test', ['gpt-4']))
+        deliver_once(target)
+
+        created = target_user_ids(target_conn)
+        print(f"   目标库用户: {created}")
+        if len(created) != len(PRIORITY_USERS):
+            print("   ❌ 测试用户未投递到目标库")
+            return False
+
+        # 2. prio_a 的删除先取得 id 但不提交；prio_b 的删除后取得 id 并先提交
+        print("\n🔀 逆 id 顺序提交两个删除:")
+        pending_conn = psycopg2.connect(SOURCE_DSN)
+        with pending_conn.cursor() as cursor:
+            cursor.execute('DELETE FROM "LiteLLM_UserTable" WHERE user_id = %s;', ('prio_a',))
+        source_cursor.execute('DELETE FROM "LiteLLM_UserTable" WHERE user_id = %s;', ('prio_b',))
+
+        first = deliver_once(target)
+        remaining_while_pending = target_user_ids(target_conn)
+        print(f"   T1 未提交时投递 {first['delivered']} 条, 目标库剩余: {remaining_while_pending}")
+
+        pending_conn.commit()
+        second = deliver_once(target)
+        remaining = target_user_ids(target_conn)
+        print(f"   T1 提交后投递 {second['delivered']} 条 (高优先级 {second['high']}), 目标库剩余: {remaining}")
+
+        # 3. 核对变更 id 的顺序和进度
+        source_cursor.execute("""
+            SELECT entity_id, id, priority FROM sync_change_log
+            WHERE entity_type = 'user' AND operation = 'DELETE' AND entity_id = ANY(%s)
+            ORDER BY id DESC;
+        """, (list(PRIORITY_USERS),))
+        delete_ids = {}
+        for entity_id, change_id, priority in source_cursor.fetchall():
+            delete_ids.setdefault(entity_id, (change_id, priority))
+        print(f"   删除变更: {delete_ids}")
+
+        source_cursor.execute("""
+            SELECT last_change_id, last_high_change_id FROM sync_target_progress WHERE target_name = %s;
+        """, (target['target_name'],))
+        last_change_id, last_high_change_id = source_cursor.fetchone()
+        print(f"   进度: 主通道 {last_change_id}, 高优先级通道 {last_high_change_id}")
+
+        reversed_order = (len(delete_ids) == 2
+                          and delete_ids['prio_a'][0] < delete_ids['prio_b'][0])
+        high_priority = all(priority == 0 for _, priority in delete_ids.values())
+        both_deleted = remaining == []
+        progress_past = reversed_order and last_change_id >= delete_ids['prio_b'][0]
+        no_errors = first['errors'] == 0 and second['errors'] == 0
+
+        success = all([reversed_order, high_priority, both_deleted, progress_past, no_errors])
+
+        print(f"\n📈 高优先级通道测试结果:")
+        print(f"   删除 id 与提交顺序相反: {'✅' if reversed_order else '❌'}")
+        print(f"   删除进入高优先级通道: {'✅' if high_priority else '❌'}")
+        print(f"   两个删除都已送达: {'✅' if both_deleted else '❌'}")
+        print(f"   主通道进度越过两个删除: {'✅' if progress_past else '❌'}")
+        print(f"   投递无错误: {'✅' if no_errors else '❌'}")
+
+        print(f"\n{'✅ 高优先级通道测试通过!' if success else '❌ 高优先级通道测试失败!'}")
+        return success
+
+    except Exception as e:
+        print(f"❌ 高优先级通道测试异常: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        if pending_conn is not None:
+            if not pending_conn.closed:
+                pending_conn.rollback()
+                pending_conn.close()
+        if states is not None:
+            restore_triggers(states)
+        # 清理残留的测试数据（两端都删，忽略不存在的行）
+        with source_conn.cursor() as cursor:
+            cursor.execute('DELETE FROM "LiteLLM_UserTable" WHERE user_id = ANY(%s);', (list(PRIORITY_USERS),))
+        if target_conn is not None:
+            with target_conn.cursor() as cursor:
+                ids = ['usr_' + user_id for user_id in PRIORITY_USERS]
+                cursor.execute('DELETE FROM auth WHERE id = ANY(%s);', (ids,))
+                cursor.execute('DELETE FROM "user" WHERE id = ANY(%s);', (ids,))
+            target_conn.close()
+        release('source', source_conn)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if test_real_priority_lanes() else 1)
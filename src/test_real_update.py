@@ -3,33 +3,20 @@
 真实表结构 UPDATE 测试 - 验证LiteLLM到Open WebUI的更新同步
 """
 
-import psycopg2
 import sys
-import time
 import json
 from datetime import datetime
 
+from bridge_client import checkout, release
+from sync_waiter import SyncWaiter, report_latency
+
 def test_real_update():
     """测试真实表结构的UPDATE操作同步"""
     
     # 连接数据库
-    source_conn = psycopg2.connect(
-        host="172.21.0.4",
-        port="5432",
-        database="litellm_real",
-        user="webui",
-        password="webui"
-    )
-    source_conn.autocommit = True
-    
-    target_conn = psycopg2.connect(
-        host="172.21.0.4", 
-        port="5432",
-        database="openwebui_real",
-        user="webui",
-        password="webui"
-    )
-    target_conn.autocommit = True
+    source_conn = checkout('source', autocommit=True)
+    target_conn = checkout('target', autocommit=True)
+    waiter = SyncWaiter()
     
     print("🧪 开始真实表结构 UPDATE 测试...")
     print("=" * 50)
@@ -63,6 +50,7 @@ def test_real_update():
         
         # 2. 执行组织更新 - 更新Technology Corp
         print("\\n📝 执行组织更新...")
+        update_mark = waiter.mark()
         
         new_org_alias = "Advanced Technology Corporation"
         new_models = ['gpt-4', 'claude-3', 'gemini-pro', 'gpt-4o']
@@ -117,7 +105,7 @@ def test_real_update():
         
         # 等待触发器执行
         print("\\n⏳ 等待触发器同步...")
-        time.sleep(3)
+        report_latency('更新同步延迟', waiter.wait([('SYNC_ORG', 'org_tech'), ('SYNC_USER', 'alice')], update_mark))
         
         # 4. 验证组织更新后状态
         print("\\n📊 验证组织更新:")
@@ -280,8 +268,9 @@ def test_real_update():
         traceback.print_exc()
         return False
     finally:
-        source_conn.close()
-        target_conn.close()
+        release('source', source_conn)
+        release('target', target_conn)
+        waiter.close()
 
 if __name__ == "__main__":
     sys.exit(0 if test_real_update() else 1)
\ No newline at end of file